@@ -0,0 +1,193 @@
+'''
+Admission control of the requests per endpoint class (training uploads, SpaCy inference, GenAI and static UI files).
+Every class has a limit of requests served at the same time and a bounded queue of requests waiting for a slot, with
+a deadline. A request that finds the queue full is rejected with 429, a request that waits longer than the deadline
+is rejected with 503, both with a Retry-After header, instead of waiting for a gunicorn thread without limit.
+A waiting request holds its gunicorn thread, so the limits plus the queues of the slow classes (training and GenAI)
+are kept below the number of threads (8): some threads are always left for the quick SpaCy inference calls.
+Limits are read from ADMISSION_<CLASS>_CONCURRENCY, ADMISSION_<CLASS>_QUEUE and ADMISSION_<CLASS>_QUEUE_TIMEOUT
+(seconds). A concurrency of 0 disables the limit of a class, ADMISSION_CONTROL_ENABLED=false disables all of them.
+'''
+
+import json
+import math
+import os
+import threading
+import time
+
+from apis.metrics import metrics_registry
+
+
+ADMISSION_CONTROL_ENABLED = os.environ.get("ADMISSION_CONTROL_ENABLED", "true").lower() in ("1", "true", "yes")
+
+#weight of the last request in the average time a slot is held (used to estimate Retry-After)
+HOLD_SECONDS_SMOOTHING = 0.2
+
+REJECTED_QUEUE_FULL = "queue_full"
+REJECTED_QUEUE_TIMEOUT = "queue_timeout"
+
+admission_in_flight = metrics_registry.gauge("entitrack_admission_in_flight", "Requests holding a slot, per endpoint class.", ("endpoint_class",))
+admission_queue_depth = metrics_registry.gauge("entitrack_admission_queue_depth", "Requests waiting for a slot, per endpoint class.", ("endpoint_class",))
+admission_rejections_total = metrics_registry.counter("entitrack_admission_rejections_total", "Requests rejected by the admission control, per endpoint class and reason.", ("endpoint_class", "reason"))
+admission_queue_wait_seconds = metrics_registry.histogram("entitrack_admission_queue_wait_seconds", "Time the admitted requests waited for a slot, per endpoint class.", ("endpoint_class",))
+
+
+class AdmissionRejected(Exception):
+
+    def __init__(self, message, status_code, retry_after):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class AdmissionLimiter:
+    '''Limit of concurrent requests of an endpoint class, with a bounded queue of waiting requests.'''
+
+    def __init__(self, name, max_concurrency, max_queue, queue_timeout):
+        if max_concurrency < 0 or max_queue < 0 or queue_timeout < 0:
+            raise ValueError(f"Invalid admission limits for the endpoint class {name}.")
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self._condition = threading.Condition()
+        self.active = 0
+        self.queued = 0
+        self.admitted = 0
+        self.rejected = {REJECTED_QUEUE_FULL: 0, REJECTED_QUEUE_TIMEOUT: 0}
+        self.mean_hold_seconds = 1.0
+
+    def acquire(self):
+        '''Takes a slot, waiting in the queue up to queue_timeout seconds. Raises AdmissionRejected when it is not possible.'''
+        start = time.monotonic()
+        with self._condition:
+            if self.active >= self.max_concurrency:
+                if self.queued >= self.max_queue:
+                    self._reject(REJECTED_QUEUE_FULL)
+                    raise AdmissionRejected(f"Too many {self.name} requests, try again later.", 429, self.retry_after())
+                self.queued += 1
+                self._observe_depth(1)
+                deadline = start + self.queue_timeout
+                try:
+                    while self.active >= self.max_concurrency:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._reject(REJECTED_QUEUE_TIMEOUT)
+                            raise AdmissionRejected(f"The {self.name} requests are overloaded, try again later.", 503, self.retry_after())
+                        self._condition.wait(remaining)
+                finally:
+                    self.queued -= 1
+                    self._observe_depth(-1)
+            self.active += 1
+            self.admitted += 1
+        if metrics_registry.enabled:
+            admission_in_flight.inc(self.name)
+            admission_queue_wait_seconds.observe(time.monotonic() - start, self.name)
+        return time.monotonic()
+
+    def release(self, acquired_at):
+        '''Frees the slot taken by acquire (acquired_at is the value it returned).'''
+        hold_seconds = time.monotonic() - acquired_at
+        with self._condition:
+            self.active -= 1
+            self.mean_hold_seconds += HOLD_SECONDS_SMOOTHING * (hold_seconds - self.mean_hold_seconds)
+            self._condition.notify()
+        if metrics_registry.enabled:
+            admission_in_flight.dec(self.name)
+
+    def retry_after(self):
+        '''Seconds until the queue is expected to be served, at least 1. Must be called holding the lock.'''
+        return max(1, math.ceil(self.mean_hold_seconds * (self.queued + 1) / max(self.max_concurrency, 1)))
+
+    def stats(self):
+        with self._condition:
+            return {'max_concurrency': self.max_concurrency,
+                    'max_queue': self.max_queue,
+                    'queue_timeout': self.queue_timeout,
+                    'active': self.active,
+                    'queued': self.queued,
+                    'admitted': self.admitted,
+                    'rejected': dict(self.rejected),
+                    'mean_hold_seconds': round(self.mean_hold_seconds, 3)}
+
+    def _reject(self, reason):
+        self.rejected[reason] += 1
+        if metrics_registry.enabled:
+            admission_rejections_total.inc(self.name, reason)
+
+    def _observe_depth(self, amount):
+        if metrics_registry.enabled:
+            admission_queue_depth.inc(self.name, amount=amount)
+
+
+def get_limiter(name, max_concurrency, max_queue, queue_timeout):
+    '''Limiter of an endpoint class with the limits of the environment variables (these values by default). None when disabled.'''
+    prefix = f"ADMISSION_{name.upper()}_"
+    max_concurrency = int(os.environ.get(prefix + "CONCURRENCY", max_concurrency))
+    if not ADMISSION_CONTROL_ENABLED or max_concurrency == 0:
+        return None
+    return AdmissionLimiter(name=name,
+                            max_concurrency=max_concurrency,
+                            max_queue=int(os.environ.get(prefix + "QUEUE", max_queue)),
+                            queue_timeout=float(os.environ.get(prefix + "QUEUE_TIMEOUT", queue_timeout)))
+
+
+#endpoint classes: (limiter, HTTP methods, URL rules or rule prefixes ending with *). The first class matching a request is used.
+ENDPOINT_CLASSES = (
+    (get_limiter("training", max_concurrency=1, max_queue=1, queue_timeout=10.0), ("POST",),
+     ("/spacy_train_ner/train", "/spacy_train_ner/train/retrain", "/spacy_train_ner/train/rules")),
+    (get_limiter("spacy", max_concurrency=4, max_queue=8, queue_timeout=2.0), ("POST",),
+     ("/spacy_train_ner/perform_ner*",)),
+    (get_limiter("genai", max_concurrency=3, max_queue=1, queue_timeout=10.0), ("GET", "POST"),
+     ("/gen_ai_ner/perform_ner*", "/gen_ai_ner/list_models_google_studio/*")),
+    (get_limiter("static", max_concurrency=4, max_queue=16, queue_timeout=2.0), ("GET",),
+     ("/UI", "/UI/", "/UI/*")),
+)
+
+
+def get_endpoint_limiter(rule, method):
+    '''Limiter of the endpoint class of a URL rule and method, None when the endpoint is not limited.'''
+    for limiter, methods, rules in ENDPOINT_CLASSES:
+        if limiter is None or method not in methods:
+            continue
+        for class_rule in rules:
+            if rule == class_rule or (class_rule.endswith("*") and rule.startswith(class_rule[:-1])):
+                return limiter
+    return None
+
+
+def admission_stats():
+    return {limiter.name: limiter.stats() for limiter, _, _ in ENDPOINT_CLASSES if limiter is not None}
+
+
+def install_admission_control(app):
+    '''Applies the admission control to the requests of a Flask app, and adds the /admission endpoint with the statistics.
+       The slot is released in teardown_request (as the request metrics are finished, see instrument_app): after the last line
+       of a streamed response, and right after the view for the file responses, which the WSGI servers never close.'''
+    from flask import request, g, Response
+
+    @app.before_request
+    def admit_request():
+        if request.url_rule is None:
+            return None
+        limiter = get_endpoint_limiter(request.url_rule.rule, request.method)
+        if limiter is None:
+            return None
+        try:
+            acquired_at = limiter.acquire()
+        except AdmissionRejected as e:
+            return Response(json.dumps({'message': str(e)}), status=e.status_code, mimetype='application/json',
+                            headers={'Retry-After': str(e.retry_after)})
+        g.admission = (limiter, acquired_at)
+        return None
+
+    @app.teardown_request
+    def release_slot(exc):
+        admission = g.pop('admission', None)
+        if admission is not None:
+            limiter, acquired_at = admission
+            limiter.release(acquired_at)
+
+    @app.route('/admission')
+    def admission():
+        return Response(json.dumps(admission_stats()), mimetype='application/json')
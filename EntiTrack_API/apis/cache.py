@@ -0,0 +1,100 @@
+'''
+Small in memory caches shared by the API namespaces.
+'''
+
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+#Returned by get when a key is not cached (None can be a valid cached value)
+MISSING = object()
+
+
+def hash_key(*parts):
+    '''SHA-256 hex digest of the given parts. Used to avoid keeping secrets (e.g. API keys) or large texts as cache keys.'''
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(str(part).encode('utf-8'))
+        digest.update(b'\x00')
+    return digest.hexdigest()
+
+
+class TTLCache:
+    '''Thread safe LRU cache where the entries expire after a time to live (in seconds).
+       A ttl of None means that the entries never expire and are only removed by the LRU policy.'''
+
+    def __init__(self, max_entries=1024, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=MISSING):
+        '''Returns the cached value or default when the key is missing or expired.'''
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                value, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def set(self, key, value, ttl=MISSING):
+        '''Caches a value. The ttl of the cache is used unless a ttl is given for this entry.'''
+        ttl = self.ttl if ttl is MISSING else ttl
+        expires_at = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key):
+        '''Removes a key from the cache.'''
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        '''Removes all the entries from the cache.'''
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        '''Cache statistics.'''
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries),
+                    'max_entries': self.max_entries}
+
+
+class SQLiteConnection:
+    '''Context manager that opens, commits and closes a SQLite connection (sqlite3's own context manager does not close it).
+       SQLite connections are not shared between threads, a new one is opened for every operation.'''
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, timeout=30)
+
+    def __enter__(self):
+        return self.connection
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.connection.commit()
+            else:
+                self.connection.rollback()
+        finally:
+            self.connection.close()
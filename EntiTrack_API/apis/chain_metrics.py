@@ -0,0 +1,56 @@
+'''
+LangChain callback handler that times the stages of a GenAI NER chain (prompt | llm | json parser) in the metrics.
+This module imports langchain, so it is only imported when a chain is invoked with the metrics enabled.
+'''
+
+import time
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+from apis.metrics import stage_duration_seconds, stage_errors_total
+
+
+GENAI_COMPONENT = "genai"
+
+#run types of the chain steps and the stage they are recorded as
+CHAIN_STEP_STAGES = {'prompt': 'prompt', 'parser': 'json_parse'}
+LLM_STAGE = "llm_call"
+
+
+class StageTimingCallbackHandler(BaseCallbackHandler):
+    '''Records the duration of the prompt formatting, the LLM call and the JSON parsing of every chain run.'''
+
+    def __init__(self):
+        self._starts = {}
+
+    def on_chain_start(self, serialized, inputs, *, run_id, run_type=None, **kwargs):
+        stage = CHAIN_STEP_STAGES.get(run_type)
+        if stage:
+            self._starts[run_id] = (stage, time.perf_counter())
+
+    def on_chain_end(self, outputs, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_chain_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, failed=True)
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._starts[run_id] = (LLM_STAGE, time.perf_counter())
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._starts[run_id] = (LLM_STAGE, time.perf_counter())
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id, failed=True)
+
+    def _finish(self, run_id, failed=False):
+        started = self._starts.pop(run_id, None)
+        if started is None:
+            return
+        stage, start = started
+        stage_duration_seconds.observe(time.perf_counter() - start, GENAI_COMPONENT, stage)
+        if failed:
+            stage_errors_total.inc(GENAI_COMPONENT, stage)
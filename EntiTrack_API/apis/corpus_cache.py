@@ -0,0 +1,161 @@
+'''
+Local store of the preprocessed training corpora (the train and test DocBin shards built from a training CSV).
+Training again on the same CSV (another description or training profile) repeats the CSV parsing, the split, the
+entity spans and the DocBins, so the shards are kept by content: the key is a hash of the file content plus every
+parameter that changes the shards (unstructured column, split, chunk size and preprocessing version).
+The shards are hard linked (copied when not possible) between the store and the session folders, and the store is
+bounded by size on disk, the least recently used corpora are removed first.
+'''
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+
+from apis.cache import hash_key
+from apis.model_registry import get_folder_size
+
+
+CORPUS_CACHE_ENABLED = os.environ.get("CORPUS_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+CORPUS_CACHE_FOLDER = os.environ.get("CORPUS_CACHE_FOLDER", "corpus_cache")
+CORPUS_CACHE_MAX_MB = int(os.environ.get("CORPUS_CACHE_MAX_MB", 2048))
+
+MANIFEST_FILE = "manifest.json"
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_file(path):
+    '''SHA-256 hex digest of the content of a file, read in blocks.'''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def link_or_copy(source, destination):
+    '''Hard links a file (the shards are never modified once written), copies it when the link is not possible.'''
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+    return destination
+
+
+class CorpusCache:
+    '''Store of train/test corpus folders keyed by content, bounded by size (least recently used first).'''
+
+    def __init__(self, folder=CORPUS_CACHE_FOLDER, max_bytes=CORPUS_CACHE_MAX_MB * 1024 * 1024, enabled=CORPUS_CACHE_ENABLED):
+        self.folder = folder
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+
+    def make_key(self, csv_path, *parts):
+        '''Key of the corpus of a CSV file built with the given parameters.'''
+        return hash_key(hash_file(csv_path), *parts)
+
+    def restore(self, key, train_path, test_path):
+        '''Links the cached shards in train_path and test_path and returns the manifest of the corpus. None when not cached.'''
+        if not self.enabled:
+            return None
+        entry_path = os.path.join(self.folder, key)
+        with self._lock:
+            manifest = self._read_manifest(entry_path)
+            if manifest is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            #the mtime of the manifest is the last use of the corpus
+            os.utime(os.path.join(entry_path, MANIFEST_FILE))
+            #linked holding the lock, so the corpus is not evicted meanwhile
+            shutil.copytree(os.path.join(entry_path, "train"), train_path, dirs_exist_ok=True, copy_function=link_or_copy)
+            shutil.copytree(os.path.join(entry_path, "test"), test_path, dirs_exist_ok=True, copy_function=link_or_copy)
+        return manifest
+
+    def store(self, key, train_path, test_path, manifest):
+        '''Keeps the shards of train_path and test_path with a manifest (JSON serializable dict) under a key.'''
+        if not self.enabled:
+            return
+        entry_path = os.path.join(self.folder, key)
+        #built in a temporary folder and renamed, a corpus in the store is always complete
+        temporary_path = os.path.join(self.folder, f".{key}.{uuid.uuid4().hex}")
+        try:
+            shutil.copytree(train_path, os.path.join(temporary_path, "train"), copy_function=link_or_copy)
+            shutil.copytree(test_path, os.path.join(temporary_path, "test"), copy_function=link_or_copy)
+            with open(os.path.join(temporary_path, MANIFEST_FILE), 'w') as f:
+                json.dump({**manifest, 'created_at': time.time()}, f)
+            with self._lock:
+                if not os.path.exists(entry_path):
+                    os.rename(temporary_path, entry_path)
+                    self.stores += 1
+                self._evict(keep=key)
+        except OSError as e:
+            print(f"Unable to store the training corpus {key}: {e}")
+        finally:
+            shutil.rmtree(temporary_path, ignore_errors=True)
+
+    def clear(self):
+        with self._lock:
+            for key in self._list_keys():
+                shutil.rmtree(os.path.join(self.folder, key), ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            entries = self._list_entries()
+            return {'enabled': self.enabled,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'stores': self.stores,
+                    'evictions': self.evictions,
+                    'entries': len(entries),
+                    'stored_bytes': sum(size for _, _, size in entries),
+                    'max_bytes': self.max_bytes}
+
+    def _read_manifest(self, entry_path):
+        try:
+            with open(os.path.join(entry_path, MANIFEST_FILE)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _list_keys(self):
+        if not os.path.isdir(self.folder):
+            return []
+        return [name for name in os.listdir(self.folder) if not name.startswith(".")]
+
+    def _list_entries(self):
+        '''(last use, key, size in bytes) of the stored corpora. Must be called holding the lock.'''
+        entries = []
+        for key in self._list_keys():
+            entry_path = os.path.join(self.folder, key)
+            try:
+                last_used = os.path.getmtime(os.path.join(entry_path, MANIFEST_FILE))
+            except OSError:
+                continue
+            entries.append((last_used, key, get_folder_size(entry_path)))
+        return entries
+
+    def _evict(self, keep):
+        '''Removes the least recently used corpora until the store fits in max_bytes. The corpus just stored is kept.
+           Must be called holding the lock.'''
+        entries = sorted(self._list_entries())
+        total = sum(size for _, _, size in entries)
+        for _, key, size in entries:
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            shutil.rmtree(os.path.join(self.folder, key), ignore_errors=True)
+            total -= size
+            self.evictions += 1
+
+
+corpus_cache = CorpusCache()
@@ -0,0 +1,142 @@
+'''
+Registry of the Google GenAI clients, reused across requests.
+A genai.Client (and the ChatGoogleGenerativeAI models built on it) is kept per API key (keyed by a hash of the key,
+the raw key is only held by the client itself), and every client sends its requests through a single HTTP connection
+pool, so the TCP connections and TLS sessions to the Google endpoint are kept alive and reused by all the requests.
+The clients not used for GENAI_CLIENT_IDLE_SECONDS are dropped, and at most GENAI_CLIENT_MAX_KEYS are kept.
+GENAI_BASE_URL points the clients to another endpoint (e.g. a local stub server for load tests).
+'''
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from apis.cache import hash_key
+
+
+GENAI_CLIENT_POOL_ENABLED = os.environ.get("GENAI_CLIENT_POOL_ENABLED", "true").lower() in ("1", "true", "yes")
+GENAI_CLIENT_MAX_KEYS = int(os.environ.get("GENAI_CLIENT_MAX_KEYS", 64))
+GENAI_CLIENT_IDLE_SECONDS = float(os.environ.get("GENAI_CLIENT_IDLE_SECONDS", 600))
+GENAI_HTTP_MAX_CONNECTIONS = int(os.environ.get("GENAI_HTTP_MAX_CONNECTIONS", 32))
+GENAI_HTTP_MAX_KEEPALIVE_CONNECTIONS = int(os.environ.get("GENAI_HTTP_MAX_KEEPALIVE_CONNECTIONS", 16))
+GENAI_HTTP_KEEPALIVE_SECONDS = float(os.environ.get("GENAI_HTTP_KEEPALIVE_SECONDS", 60))
+GENAI_BASE_URL = os.environ.get("GENAI_BASE_URL") or None
+
+
+class _ClientEntry:
+
+    def __init__(self, client):
+        self.client = client
+        self.chat_models = {}
+        self.last_used = time.monotonic()
+        #only one thread builds the chat models of a key
+        self.lock = threading.Lock()
+
+
+class GenAIClientRegistry:
+    '''Thread safe registry of genai clients and chat models per API key, with idle eviction and a bounded size.
+       When disabled, a new client (and chat model) is built for every call.'''
+
+    def __init__(self, max_keys=GENAI_CLIENT_MAX_KEYS, idle_seconds=GENAI_CLIENT_IDLE_SECONDS, enabled=GENAI_CLIENT_POOL_ENABLED,
+                 base_url=GENAI_BASE_URL):
+        self.max_keys = max_keys
+        self.idle_seconds = idle_seconds
+        self.enabled = enabled
+        self.base_url = base_url
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._http_client = None
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.chat_models_built = 0
+
+    def get_client(self, api_key):
+        '''The genai client of an API key.'''
+        if not self.enabled:
+            return self._build_client(api_key, http_client=None)
+        return self._get_entry(api_key).client
+
+    def get_chat_model(self, api_key, model_key, **llm_kwargs):
+        '''The ChatGoogleGenerativeAI model of an API key, model and options. It sends its requests with the pooled client of the key.'''
+        if not self.enabled:
+            return self._build_chat_model(api_key, model_key, None, llm_kwargs)
+        entry = self._get_entry(api_key)
+        model_id = (model_key, tuple(sorted(llm_kwargs.items())))
+        with entry.lock:
+            chat_model = entry.chat_models.get(model_id)
+            if chat_model is None:
+                chat_model = entry.chat_models[model_id] = self._build_chat_model(api_key, model_key, entry.client, llm_kwargs)
+            return chat_model
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            self._evict_idle()
+            return {'enabled': self.enabled,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries),
+                    'max_entries': self.max_keys,
+                    'chat_models': sum(len(entry.chat_models) for entry in self._entries.values()),
+                    'chat_models_built': self.chat_models_built}
+
+    def _get_entry(self, api_key):
+        key = hash_key(api_key)
+        with self._lock:
+            self._evict_idle()
+            entry = self._entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                entry.last_used = time.monotonic()
+                return entry
+            self.misses += 1
+            entry = self._entries[key] = _ClientEntry(self._build_client(api_key, self._get_http_client()))
+            while len(self._entries) > self.max_keys:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+            return entry
+
+    def _evict_idle(self):
+        #the entries are in order of use, the idle ones are at the beginning
+        idle_since = time.monotonic() - self.idle_seconds
+        while self._entries:
+            key, entry = next(iter(self._entries.items()))
+            if entry.last_used > idle_since:
+                break
+            #the chains that still use the client keep working, the client is only dropped from the registry
+            del self._entries[key]
+            self.evictions += 1
+
+    def _get_http_client(self):
+        if self._http_client is None:
+            import httpx
+            self._http_client = httpx.Client(limits=httpx.Limits(max_connections=GENAI_HTTP_MAX_CONNECTIONS,
+                                                                 max_keepalive_connections=GENAI_HTTP_MAX_KEEPALIVE_CONNECTIONS,
+                                                                 keepalive_expiry=GENAI_HTTP_KEEPALIVE_SECONDS),
+                                             timeout=None)
+        return self._http_client
+
+    def _build_client(self, api_key, http_client):
+        from google import genai
+        from google.genai import types
+        return genai.Client(api_key=api_key, http_options=types.HttpOptions(base_url=self.base_url, httpx_client=http_client))
+
+    def _build_chat_model(self, api_key, model_key, client, llm_kwargs):
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        chat_model = ChatGoogleGenerativeAI(model=model_key, google_api_key=api_key, base_url=self.base_url, **llm_kwargs)
+        if client is not None:
+            #the model builds its own client, it is replaced by the pooled one
+            chat_model.client = client
+        with self._lock:
+            self.chat_models_built += 1
+        return chat_model
+
+
+genai_client_registry = GenAIClientRegistry()
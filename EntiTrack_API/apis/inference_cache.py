@@ -0,0 +1,143 @@
+'''
+In memory cache of the NER results of the trained session models.
+Imported files repeat the same addresses many times, so the entities of a text are kept per training session
+(keyed by a hash of the text) and the repeated texts of a batch are sent once to the model.
+The cache is bounded by number of entries (least recently used first). The entries of a session are purged when
+the session is deleted or its training job finishes, and when its model-best changes on disk (same stamp as the model registry).
+'''
+
+import os
+import threading
+from collections import OrderedDict
+
+from apis.cache import MISSING, hash_key
+from apis.model_registry import get_model_stamp
+
+
+INFERENCE_CACHE_ENABLED = os.environ.get("INFERENCE_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+INFERENCE_CACHE_MAX_ENTRIES = int(os.environ.get("INFERENCE_CACHE_MAX_ENTRIES", 50000))
+#default of the normalize_text option of the requests: the texts are normalized as the training texts (massage_data) before the NER
+INFERENCE_NORMALIZE_TEXT = os.environ.get("INFERENCE_NORMALIZE_TEXT", "false").lower() in ("1", "true", "yes")
+
+
+class InferenceResultCache:
+    '''Thread safe LRU cache of the entities of a text per training session.'''
+
+    def __init__(self, max_entries=INFERENCE_CACHE_MAX_ENTRIES, enabled=INFERENCE_CACHE_ENABLED):
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self._entries = OrderedDict()
+        #keys of every session, for purging a session without scanning the whole cache
+        self._session_keys = {}
+        self._session_stamps = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.duplicates = 0
+        self.purges = 0
+
+    def perform_ner(self, training_session_id, texts, run_ner):
+        '''Entities of every text, in the same order. run_ner(training_session_id, texts) is called once with the
+           distinct texts that are not cached.'''
+        keys = [hash_key(text) for text in texts]
+        results = {}
+        pending = {}
+        stamp = None
+        with self._lock:
+            if self.enabled:
+                stamp = self._check_model(training_session_id)
+            for key, text in zip(keys, texts):
+                if key in results or key in pending:
+                    self.duplicates += 1
+                    continue
+                value = self._get(training_session_id, key) if self.enabled else MISSING
+                if value is MISSING:
+                    pending[key] = text
+                else:
+                    results[key] = value
+
+        if pending:
+            pending_results = run_ner(training_session_id, list(pending.values()))
+            results.update(zip(pending, pending_results))
+            if self.enabled:
+                with self._lock:
+                    #not stored when the session was purged while the NER was running (the results may be of the previous model)
+                    if self._session_stamps.get(training_session_id, MISSING) == stamp:
+                        for key in pending:
+                            self._set(training_session_id, key, results[key])
+
+        return [results[key] for key in keys]
+
+    def purge(self, training_session_id):
+        '''Removes the results of a session (the session was deleted or its model changed).'''
+        with self._lock:
+            self._purge(training_session_id)
+            self._session_stamps.pop(training_session_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._session_keys.clear()
+            self._session_stamps.clear()
+
+    def stats(self):
+        with self._lock:
+            return {'enabled': self.enabled,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'duplicates': self.duplicates,
+                    'evictions': self.evictions,
+                    'purges': self.purges,
+                    'entries': len(self._entries),
+                    'max_entries': self.max_entries,
+                    'sessions': len(self._session_keys)}
+
+    def _check_model(self, training_session_id):
+        '''Purges the session when its model-best was replaced after the results were cached and returns the stamp of model-best
+           (see get_model_stamp). Must be called holding the lock.'''
+        try:
+            stamp = get_model_stamp(training_session_id)
+        except OSError:
+            stamp = None
+        if self._session_stamps.get(training_session_id, stamp) != stamp:
+            self._purge(training_session_id)
+        self._session_stamps[training_session_id] = stamp
+        return stamp
+
+    def _get(self, training_session_id, key):
+        entry_key = (training_session_id, key)
+        value = self._entries.get(entry_key, MISSING)
+        if value is MISSING:
+            self.misses += 1
+            return MISSING
+        self._entries.move_to_end(entry_key)
+        self.hits += 1
+        return value
+
+    def _set(self, training_session_id, key, value):
+        entry_key = (training_session_id, key)
+        self._entries[entry_key] = value
+        self._entries.move_to_end(entry_key)
+        self._session_keys.setdefault(training_session_id, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            (evicted_session_id, evicted_key), _ = self._entries.popitem(last=False)
+            self._discard_session_key(evicted_session_id, evicted_key)
+            self.evictions += 1
+
+    def _purge(self, training_session_id):
+        keys = self._session_keys.pop(training_session_id, None)
+        if keys:
+            for key in keys:
+                self._entries.pop((training_session_id, key), None)
+            self.purges += 1
+
+    def _discard_session_key(self, training_session_id, key):
+        keys = self._session_keys.get(training_session_id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._session_keys[training_session_id]
+
+
+inference_cache = InferenceResultCache()
@@ -0,0 +1,179 @@
+'''
+Pool of worker processes that run the NER of the trained SpaCy models.
+With a single gunicorn worker all the SpaCy inference runs on one GIL (one core), the pool spreads it over several processes.
+The workers are forked after the most used session models are loaded, so the model weights are shared copy-on-write
+by all the workers instead of being loaded once per worker.
+Requests for a preloaded (shared) model go to the least busy worker, other sessions always go to the same worker
+(chosen by session id) so every session model is loaded by a single worker.
+'''
+
+import gc
+import multiprocessing
+import os
+import threading
+import zlib
+
+from apis.model_registry import model_registry
+
+
+#0 disables the pool (the NER runs in the API process)
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", 0))
+#comma separated session ids, or the number of most recent sessions, loaded before forking the workers
+INFERENCE_PRELOAD_SESSIONS = os.environ.get("INFERENCE_PRELOAD_SESSIONS", "4")
+INFERENCE_BATCH_SIZE = int(os.environ.get("INFERENCE_BATCH_SIZE", 256))
+
+
+def worker_main(connection, process_document):
+    '''Main loop of a worker process. Receives (command, training_session_id, texts) and answers with (ok, result).'''
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            break
+        if request is None:
+            break
+        command, training_session_id, texts = request
+        try:
+            if command == 'ner':
+                nlp = model_registry.get(training_session_id)
+                result = [process_document(document) for document in nlp.pipe(texts, batch_size=INFERENCE_BATCH_SIZE)]
+            elif command == 'invalidate':
+                model_registry.invalidate(training_session_id)
+                result = None
+            else:
+                raise ValueError(f"Unknown command {command}")
+            connection.send((True, result))
+        except Exception as e:
+            connection.send((False, f"{type(e).__name__}: {e}"))
+
+
+class InferenceWorkerError(Exception):
+    pass
+
+
+class _InferenceWorker:
+
+    def __init__(self, process, connection):
+        self.process = process
+        self.connection = connection
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = 0
+
+    def is_alive(self):
+        return self.process.is_alive()
+
+    def call(self, command, training_session_id, texts=None):
+        '''Sends a request to the worker and waits for the answer. The requests to a worker are serialized.'''
+        with self.lock:
+            try:
+                self.connection.send((command, training_session_id, texts))
+                ok, result = self.connection.recv()
+            except (EOFError, BrokenPipeError, OSError):
+                raise InferenceWorkerError("The inference worker process stopped unexpectedly.")
+            self.requests += 1
+        if not ok:
+            raise InferenceWorkerError(result)
+        return result
+
+
+class InferencePool:
+
+    def __init__(self, process_document, size=INFERENCE_WORKERS):
+        '''process_document(document) converts a SpaCy document to the (picklable) result returned to the API.'''
+        self.process_document = process_document
+        self.size = size
+        self.shared_sessions = set()
+        self.fallbacks = 0
+        self._workers = []
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self._workers)
+
+    def start(self, preload_sessions=()):
+        '''Loads the preload sessions models and forks the workers.
+           Must be called before the API starts serving requests (forking a process with running threads is not safe).'''
+        with self._lock:
+            if self._workers or self.size < 1:
+                return
+            for training_session_id in preload_sessions:
+                try:
+                    model_registry.get(training_session_id)
+                    self.shared_sessions.add(training_session_id)
+                except Exception as e:
+                    print(f"Unable to preload the model of the session {training_session_id}: {e}")
+
+            #objects created so far are never collected, so the garbage collector of the workers does not write to (copy) their pages
+            gc.collect()
+            gc.freeze()
+            context = multiprocessing.get_context("fork")
+            for index in range(self.size):
+                connection, child_connection = context.Pipe()
+                process = context.Process(target=worker_main, args=(child_connection, self.process_document), name=f"inference_worker_{index}", daemon=True)
+                process.start()
+                child_connection.close()
+                self._workers.append(_InferenceWorker(process, connection))
+            gc.unfreeze()
+
+    def perform_ner(self, training_session_id, texts):
+        '''Results of process_document for every text, in the same order.
+           Runs in the API process when the pool is disabled or the worker of the session is not alive.'''
+        texts = list(texts)
+        worker = self._choose_worker(training_session_id)
+        if worker is None:
+            if self.enabled:
+                with self._lock:
+                    self.fallbacks += 1
+            nlp = model_registry.get(training_session_id)
+            return [self.process_document(document) for document in nlp.pipe(texts, batch_size=INFERENCE_BATCH_SIZE)]
+
+        with self._lock:
+            worker.in_flight += 1
+        try:
+            return worker.call('ner', training_session_id, texts)
+        finally:
+            with self._lock:
+                worker.in_flight -= 1
+
+    def invalidate(self, training_session_id):
+        '''Removes a session model from all the workers (the session was deleted or retrained).'''
+        self.shared_sessions.discard(training_session_id)
+        for worker in self._workers:
+            if worker.is_alive():
+                try:
+                    worker.call('invalidate', training_session_id)
+                except InferenceWorkerError as e:
+                    print(e)
+
+    def stats(self):
+        '''Pool statistics.'''
+        with self._lock:
+            return {'workers': len(self._workers),
+                    'workers_alive': sum(1 for worker in self._workers if worker.is_alive()),
+                    'shared_sessions': sorted(self.shared_sessions),
+                    'fallbacks': self.fallbacks,
+                    'requests_per_worker': [worker.requests for worker in self._workers],
+                    'in_flight_per_worker': [worker.in_flight for worker in self._workers]}
+
+    def _choose_worker(self, training_session_id):
+        '''Least busy worker for the shared sessions, the worker assigned by session id for the others. None when not available.'''
+        with self._lock:
+            if not self._workers:
+                return None
+            if training_session_id in self.shared_sessions:
+                alive = [worker for worker in self._workers if worker.is_alive()]
+                return min(alive, key=lambda worker: worker.in_flight) if alive else None
+            worker = self._workers[zlib.crc32(training_session_id.encode('utf-8')) % len(self._workers)]
+            return worker if worker.is_alive() else None
+
+
+def get_preload_sessions(list_sessions):
+    '''Session ids to preload from INFERENCE_PRELOAD_SESSIONS. list_sessions(limit) returns the most recent valid session ids.'''
+    value = INFERENCE_PRELOAD_SESSIONS.strip()
+    if not value:
+        return []
+    if value.isdigit():
+        return list_sessions(int(value)) if int(value) > 0 else []
+    return [training_session_id.strip() for training_session_id in value.split(",") if training_session_id.strip()]
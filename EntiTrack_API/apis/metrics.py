@@ -0,0 +1,237 @@
+'''
+In process metrics (counters, gauges and histograms) exposed in the Prometheus text format on /metrics.
+Every request is counted and timed per endpoint, and the stages of the GenAI, SpaCy and training paths are timed
+with stage_timer, so a slow request can be attributed to a stage.
+With METRICS_ENABLED=false nothing is recorded (stage_timer returns a shared no-op context manager).
+'''
+
+import os
+import threading
+import time
+from contextlib import nullcontext
+
+
+METRICS_ENABLED = os.environ.get("METRICS_ENABLED", "true").lower() in ("1", "true", "yes")
+
+#seconds. The training stages take minutes, so the buckets go further than the Prometheus defaults
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0)
+
+
+def escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(label_names, label_values, extra=()):
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(label_names, label_values)]
+    pairs.extend(f'{name}="{value}"' for name, value in extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._render_items(items))
+        return lines
+
+    def _render_items(self, items):
+        return [f"{self.name}{format_labels(self.label_names, labels)} {format_value(value)}" for labels, value in items]
+
+
+class Counter(_Metric):
+    metric_type = "counter"
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+
+class Gauge(_Metric):
+    metric_type = "gauge"
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def dec(self, *label_values, amount=1):
+        self.inc(*label_values, amount=-amount)
+
+
+class Histogram(_Metric):
+    metric_type = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            entry = self._values.get(label_values)
+            if entry is None:
+                #counts per bucket (not cumulative), sum and count
+                entry = self._values[label_values] = [[0] * len(self.buckets), 0.0, 0]
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    entry[0][index] += 1
+                    break
+            entry[1] += value
+            entry[2] += 1
+
+    def _render_items(self, items):
+        lines = []
+        for labels, (counts, total, count) in items:
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{format_labels(self.label_names, labels, [('le', format_value(upper_bound))])} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.label_names, labels)} {format_value(total)}")
+            lines.append(f"{self.name}_count{format_labels(self.label_names, labels)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self._metrics = []
+
+    def counter(self, name, help_text, label_names=()):
+        return self._register(Counter(name, help_text, label_names))
+
+    def gauge(self, name, help_text, label_names=()):
+        return self._register(Gauge(name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, help_text, label_names, buckets))
+
+    def render(self):
+        '''All the metrics in the Prometheus text exposition format.'''
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+
+metrics_registry = MetricsRegistry()
+
+http_requests_total = metrics_registry.counter("entitrack_http_requests_total", "Requests served, per endpoint, method and status code.", ("endpoint", "method", "status"))
+http_request_duration_seconds = metrics_registry.histogram("entitrack_http_request_duration_seconds", "Time from the start of a request to its teardown: the end of the view for the JSON and file responses, the last line for the streamed ones. Per endpoint and method.", ("endpoint", "method"))
+http_requests_in_flight = metrics_registry.gauge("entitrack_http_requests_in_flight", "Requests being served, per endpoint.", ("endpoint",))
+stage_duration_seconds = metrics_registry.histogram("entitrack_stage_duration_seconds", "Time spent in every stage of the GenAI, SpaCy and training paths.", ("component", "stage"))
+stage_errors_total = metrics_registry.counter("entitrack_stage_errors_total", "Stages that raised an error.", ("component", "stage"))
+
+
+class _StageTimer:
+
+    __slots__ = ("component", "stage", "start")
+
+    def __init__(self, component, stage):
+        self.component = component
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        stage_duration_seconds.observe(time.perf_counter() - self.start, self.component, self.stage)
+        if exc_type is not None:
+            stage_errors_total.inc(self.component, self.stage)
+        return False
+
+
+_NO_TIMER = nullcontext()
+
+
+def stage_timer(component, stage):
+    '''Context manager that records the duration (and the errors) of a stage.'''
+    if not metrics_registry.enabled:
+        return _NO_TIMER
+    return _StageTimer(component, stage)
+
+
+def observe_stage(component, stage, seconds):
+    '''Records the duration of a stage measured elsewhere (e.g. in a worker process).'''
+    if metrics_registry.enabled:
+        stage_duration_seconds.observe(seconds, component, stage)
+
+
+def timed_iterator(iterable, component, stage):
+    '''Yields the items of an iterable, recording the time spent producing every item as a stage (e.g. the chunks of a CSV reader).'''
+    if not metrics_registry.enabled:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        except Exception:
+            stage_duration_seconds.observe(time.perf_counter() - start, component, stage)
+            stage_errors_total.inc(component, stage)
+            raise
+        stage_duration_seconds.observe(time.perf_counter() - start, component, stage)
+        yield item
+
+
+def instrument_app(app):
+    '''Counts and times every request of a Flask app per endpoint (the URL rule, not the URL, so the cardinality is bounded
+       and no API key ends up in a label), and adds the /metrics endpoint.
+       The request is finished in teardown_request: it runs after the last line of the streamed responses (stream_with_context),
+       and it also runs for the file responses, which the WSGI servers send without closing the response.'''
+    from flask import request, g, Response, abort
+
+    @app.before_request
+    def start_request_metrics():
+        if not metrics_registry.enabled:
+            return
+        g.metrics_endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        g.metrics_start = time.perf_counter()
+        http_requests_in_flight.inc(g.metrics_endpoint)
+
+    @app.after_request
+    def record_response_status(response):
+        if 'metrics_endpoint' in g:
+            g.metrics_status = response.status_code
+        return response
+
+    @app.teardown_request
+    def finish_request_metrics(exc):
+        endpoint = g.pop('metrics_endpoint', None)
+        if endpoint is None:
+            return
+        #after_request did not run when the view raised an unhandled error
+        status = g.pop('metrics_status', 500)
+        http_requests_total.inc(endpoint, request.method, str(status))
+        http_request_duration_seconds.observe(time.perf_counter() - g.metrics_start, endpoint, request.method)
+        http_requests_in_flight.dec(endpoint)
+
+    @app.route('/metrics')
+    def metrics():
+        if not metrics_registry.enabled:
+            abort(404)
+        return Response(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,152 @@
+'''
+Process wide registry of loaded SpaCy session models.
+Loading a trained pipeline from disk (spacy.load) is far more expensive than running NER on a short text,
+so the loaded pipelines are kept in memory and reused across requests (and across the gunicorn threads).
+The registry is bounded by number of models and by the approximate size on disk of the loaded models,
+the least recently used model is evicted first.
+A loaded model is reloaded when the meta.json of its model-best changes (see get_model_stamp).
+'''
+
+import os
+import threading
+from collections import OrderedDict
+
+from apis.metrics import stage_timer
+
+
+SESSIONS_FOLDER = "model_train_sessions"
+
+#Limits can be tuned with environment variables.
+MODEL_CACHE_MAX_MODELS = int(os.environ.get("MODEL_CACHE_MAX_MODELS", 8))
+MODEL_CACHE_MAX_MB = int(os.environ.get("MODEL_CACHE_MAX_MB", 512))
+
+
+def get_best_model_path(training_session_id):
+    '''Path of the best model for a given training session.'''
+    return os.path.join(SESSIONS_FOLDER, training_session_id, "models", "model-best")
+
+
+def get_model_stamp(training_session_id):
+    '''Value that changes every time the model-best of a session is replaced or edited. The mtime of the model-best folder does not:
+       SpaCy replaces it with a copy of model-last at every better checkpoint and the copy keeps the mtime, but meta.json is written
+       again every time (by SpaCy and by the session metadata edits). Raises OSError when the model does not exist.'''
+    stat = os.stat(os.path.join(get_best_model_path(training_session_id), "meta.json"))
+    return (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+
+
+def get_folder_size(folder):
+    '''Size in bytes of all the files inside a folder. Used as an approximation of the memory used by a model.'''
+    total = 0
+    for root, _, files in os.walk(folder):
+        for file_name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, file_name))
+            except OSError:
+                pass
+    return total
+
+
+class _CachedModel:
+
+    def __init__(self, nlp, stamp, size):
+        self.nlp = nlp
+        self.stamp = stamp
+        self.size = size
+
+
+class ModelRegistry:
+    '''Thread safe LRU cache of SpaCy pipelines keyed by training session id.'''
+
+    def __init__(self, max_models=MODEL_CACHE_MAX_MODELS, max_bytes=MODEL_CACHE_MAX_MB * 1024 * 1024):
+        self.max_models = max_models
+        self.max_bytes = max_bytes
+        self._models = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, training_session_id):
+        '''Returns the loaded pipeline for a training session. Loads it from disk when missing or stale.
+           Raises the same exceptions as spacy.load when the model cannot be loaded.'''
+        model_path = get_best_model_path(training_session_id)
+        stamp = get_model_stamp(training_session_id)
+
+        with self._lock:
+            cached = self._get_fresh(training_session_id, stamp)
+            if cached:
+                self.hits += 1
+                return cached.nlp
+            loading_lock = self._loading_locks.setdefault(training_session_id, threading.Lock())
+
+        #only one thread loads a given session, other threads asking for the same session wait for it.
+        with loading_lock:
+            with self._lock:
+                cached = self._get_fresh(training_session_id, stamp)
+                if cached:
+                    self.hits += 1
+                    return cached.nlp
+                self.misses += 1
+
+            try:
+                #SpaCy is imported with the first model, so the API starts without loading it
+                import spacy
+                with stage_timer('spacy', 'model_load'):
+                    nlp = spacy.load(model_path)
+                size = get_folder_size(model_path)
+
+                with self._lock:
+                    self._models[training_session_id] = _CachedModel(nlp, stamp, size)
+                    self._models.move_to_end(training_session_id)
+                    self._evict()
+            finally:
+                with self._lock:
+                    self._loading_locks.pop(training_session_id, None)
+            return nlp
+
+    def invalidate(self, training_session_id):
+        '''Removes a training session model from the registry.'''
+        with self._lock:
+            self._models.pop(training_session_id, None)
+
+    def clear(self):
+        '''Removes all the models from the registry.'''
+        with self._lock:
+            self._models.clear()
+
+    def stats(self):
+        '''Cache statistics.'''
+        with self._lock:
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'models_loaded': len(self._models),
+                    'loaded_bytes': self._total_bytes(),
+                    'max_models': self.max_models,
+                    'max_bytes': self.max_bytes,
+                    'training_session_ids': list(self._models.keys())}
+
+    def _get_fresh(self, training_session_id, stamp):
+        '''Returns the cached entry if it is still valid (same stamp on disk). Must be called holding the lock.'''
+        cached = self._models.get(training_session_id)
+        if cached is None:
+            return None
+        if cached.stamp != stamp:
+            del self._models[training_session_id]
+            return None
+        self._models.move_to_end(training_session_id)
+        return cached
+
+    def _total_bytes(self):
+        return sum(cached.size for cached in self._models.values())
+
+    def _evict(self):
+        '''Evicts the least recently used models until the limits are met. Must be called holding the lock.
+           The most recently used model is always kept, even if it is bigger than the memory limit.'''
+        while len(self._models) > 1 and (len(self._models) > self.max_models or self._total_bytes() > self.max_bytes):
+            self._models.popitem(last=False)
+            self.evictions += 1
+
+
+model_registry = ModelRegistry()
@@ -1,11 +1,23 @@
-from flask_restx import Resource,Namespace, fields, abort
+from flask_restx import Resource,Namespace, fields, abort, marshal
 from flask_cors import cross_origin
-from google import genai
-from typing import Any, Tuple
-from pydantic import BaseModel, Field, create_model
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.output_parsers import JsonOutputParser
-from langchain_google_genai import ChatGoogleGenerativeAI
+from flask import Response, stream_with_context, request
+from typing import Any, Tuple, TYPE_CHECKING
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+import os
+import threading
+import time
+
+from apis.cache import TTLCache, MISSING, hash_key
+from apis.result_cache import genai_result_cache, RESULT_CACHE_ENABLED, CACHE_MODES, CACHE_MODE_USE, CACHE_MODE_BYPASS
+from apis.rate_limit import TokenBucket, call_with_backoff, is_quota_error
+from apis.text_chunking import split_text, merge_chunk_results
+from apis.metrics import metrics_registry, stage_timer, observe_stage
+from apis.genai_clients import genai_client_registry
+
+#google genai, pydantic and langchain are imported by the functions that use them, so the API starts without loading them
+if TYPE_CHECKING:
+  from pydantic import BaseModel
 
 namespace_ner_gen_ai = Namespace('GenAI NER (No training)', 
                              description='Perform NER without training a model.', 
@@ -32,30 +44,86 @@ class GenAIListModels(Resource):
     if not google_studio_api_key:
        abort(401, "API key is required.")
 
-    genai_client = genai.Client(api_key=google_studio_api_key)
     try:
-      return [mdl for mdl in genai_client.models.list().page]
+      return get_model_list(google_studio_api_key)
     except Exception as e:
       abort(401,"Invalid API key")
       #TODO: put some internal error log here
 
 
+GENAI_MODEL_LIST_TTL = float(os.environ.get("GENAI_MODEL_LIST_TTL", 600))
+GENAI_MODEL_LIST_INVALID_KEY_TTL = float(os.environ.get("GENAI_MODEL_LIST_INVALID_KEY_TTL", 60))
+GENAI_MODEL_LIST_MAX_KEYS = int(os.environ.get("GENAI_MODEL_LIST_MAX_KEYS", 1024))
+
+#models available per API key. Keyed by a hash of the API key, the raw key is never stored.
+model_list_cache = TTLCache(max_entries=GENAI_MODEL_LIST_MAX_KEYS, ttl=GENAI_MODEL_LIST_TTL)
+
+
+class InvalidApiKeyError(Exception):
+  pass
+
+
+def get_model_list(google_studio_api_key):
+    """List of models available for a google studio api key. 
+    The list is cached for GENAI_MODEL_LIST_TTL seconds, and keys rejected by google are remembered for GENAI_MODEL_LIST_INVALID_KEY_TTL seconds.
+    Raises InvalidApiKeyError for rejected keys and the google error when the service is unavailable."""
+    cache_key = hash_key(google_studio_api_key)
+    model_list = model_list_cache.get(cache_key)
+    if model_list is None:
+      raise InvalidApiKeyError("Invalid API key")
+    if model_list is not MISSING:
+      return model_list
+
+    from google.genai import errors as genai_errors
+
+    genai_client = genai_client_registry.get_client(google_studio_api_key)
+    try:
+      with stage_timer('genai', 'model_list'):
+        model_list = [mdl for mdl in genai_client.models.list().page]
+    except genai_errors.ClientError as e:
+      #only cache the keys that are rejected, not quota errors
+      if e.code in (400, 401, 403):
+        model_list_cache.set(cache_key, None, ttl=GENAI_MODEL_LIST_INVALID_KEY_TTL)
+        raise InvalidApiKeyError("Invalid API key") from e
+      raise
+
+    model_list_cache.set(cache_key, model_list)
+    return model_list
+
+
+#0: a chunk is as long as the input token limit of the model allows, so only the texts that do not fit in one call are split
+GENAI_CHUNK_MAX_TOKENS = int(os.environ.get("GENAI_CHUNK_MAX_TOKENS", 0))
+GENAI_CHUNK_OVERLAP_TOKENS = int(os.environ.get("GENAI_CHUNK_OVERLAP_TOKENS", 100))
+GENAI_CHUNK_MAX_CONCURRENCY = int(os.environ.get("GENAI_CHUNK_MAX_CONCURRENCY", 4))
+#tokens of the input limit of the model reserved for the prompt and the format instructions
+GENAI_CHUNK_PROMPT_RESERVE_TOKENS = int(os.environ.get("GENAI_CHUNK_PROMPT_RESERVE_TOKENS", 1024))
+
+CHUNKING_AUTO = "auto"  #split the texts longer than a chunk (by default, the texts that do not fit in the model input)
+CHUNKING_OFF = "off"    #send the whole text in a single call
+CHUNKING_MODES = (CHUNKING_AUTO, CHUNKING_OFF)
+
 ##Request model for perform gen ai
 gen_ai_ner_payload = namespace_ner_gen_ai.model("GenAIRequestPayload",{
   'model_key': fields.String(required=True, description='Model key'),
   'text_to_check': fields.String(required=True, description='Text analyze'),
-  'ner_fields': fields.List(fields.String(required=True), description='Named Entities to be extracted')
+  'ner_fields': fields.List(fields.String(required=True), description='Named Entities to be extracted'),
+  'cache_mode': fields.String(required=False, enum=list(CACHE_MODES), description='How to use the result cache: use (default), refresh or bypass. It can also be sent in the X-NER-Cache-Mode header.'),
+  'chunking': fields.String(required=False, enum=list(CHUNKING_MODES), description='auto (default): split the text in chunks processed concurrently when it does not fit in the model input (or is longer than max_chunk_tokens, when sent). off: send the whole text in one call.'),
+  'max_chunk_tokens': fields.Integer(required=False, description=f'Maximum (estimated) tokens per chunk, limited by the input token limit of the model. Defaults to {GENAI_CHUNK_MAX_TOKENS or "the input token limit of the model"}.'),
+  'chunk_overlap_tokens': fields.Integer(required=False, description=f'Tokens repeated between consecutive chunks so the entities in the boundaries are not lost. Defaults to {GENAI_CHUNK_OVERLAP_TOKENS}.'),
 })
 
 
 FieldDetails = Tuple[type, str, list[Any]]  # field type, description, examples
-def create_dynamic_model(model_name:str, fields_dict: dict[str, FieldDetails]) -> type[BaseModel]:
+def create_dynamic_model(model_name:str, fields_dict: dict[str, FieldDetails]) -> "type[BaseModel]":
     """
     Create a dynamic Pydantic model based on the provided fields dictionary.
     
     :param fields_dict: A dictionary where keys are field names and values are tuples of (type, description)
     :return: A dynamically created Pydantic model
     """
+    from pydantic import Field, create_model
+
     return create_model(
 
         model_name,
@@ -76,19 +144,53 @@ class GenAIPerformNER(Resource):
   def post(self, google_studio_api_key):
     """Perform NER with GenAI."""  
 
-    #general validations
+    model_key, text_to_check, ner_fields = validate_perform_ner_payload(google_studio_api_key, namespace_ner_gen_ai.payload)
+
+    cache_mode = get_cache_mode(namespace_ner_gen_ai.payload)
+
+    model = validate_model_key(google_studio_api_key, model_key)
+
+    #long texts are split in chunks that are processed concurrently
+    chunks = get_text_chunks(namespace_ner_gen_ai.payload, text_to_check, model)
+    if len(chunks) > 1:
+      return perform_chunked_ner(google_studio_api_key, model_key, ner_fields, chunks, cache_mode)
+
+    #serve the result from the cache when the same text was already processed with the same model and fields
+    result_cache_key = get_result_cache_key(model_key, ner_fields, text_to_check)
+    if cache_mode == CACHE_MODE_USE:
+      chain_res = genai_result_cache.get(result_cache_key)
+      if chain_res is not MISSING:
+        return chain_res, 200, {RESULT_CACHE_HEADER: 'HIT'}
+
+    #at this point the request is valid, build the Gen AI chain
+    chain = get_ner_chain(model_key, ner_fields, google_studio_api_key)
+
+    chain_res = ""
+    try:
+      chain_res = invoke_chain(chain, text_to_check)
+    except Exception as e:
+      abort(401, message="Unable to perform NER with the selected model. There are any reasons for this: Quota exceeded, Invalid model, Model not suitable for this task, Bad response from google API, etc.")
+      
+    if cache_mode != CACHE_MODE_BYPASS:
+      genai_result_cache.set(result_cache_key, chain_res)
+  
+    return chain_res, 200, {RESULT_CACHE_HEADER: 'MISS' if cache_mode != CACHE_MODE_BYPASS else 'BYPASS'}
+
+
+def validate_perform_ner_payload(google_studio_api_key, payload):
+    """General validations of a perform NER request. Returns the model key, the text to check and the NER fields. Aborts the request otherwise."""
     if not google_studio_api_key:
        abort(401, message="Google AI studio key is required.") 
 
-    model_key = namespace_ner_gen_ai.payload['model_key']
+    model_key = payload['model_key']
     if not model_key:
        abort(400, message="Model key key is required.") 
 
-    text_to_check = namespace_ner_gen_ai.payload['text_to_check']
+    text_to_check = payload['text_to_check']
     if not text_to_check:
        abort(400, message="Text to check is required.") 
 
-    ner_fields = namespace_ner_gen_ai.payload['ner_fields']
+    ner_fields = payload['ner_fields']
     if not ner_fields:
        abort(400, message="NER fields node is required.")
     
@@ -98,22 +200,310 @@ class GenAIPerformNER(Resource):
     if len(ner_fields) == 0:
       abort(400, message="NER fields node expected to have at least one item.")
 
+    return model_key, text_to_check, ner_fields
+
+
+@namespace_ner_gen_ai.route("/perform_ner_stream/<google_studio_api_key>")
+@namespace_ner_gen_ai.param('google_studio_api_key', 'Google studio API key. Go to https://aistudio.google.com/app/apikey to obtain your key.')
+@namespace_ner_gen_ai.expect(gen_ai_ner_payload)
+@namespace_ner_gen_ai.response(401, 'Invalid API key or unauthorized.')
+@namespace_ner_gen_ai.response(400, 'Invalid request.')
+class GenAIPerformNERStream(Resource):
+  def post(self, google_studio_api_key):
+    """Perform NER with GenAI, streaming every field as soon as the model finished generating its value.
+    The response is NDJSON ({"type": "field", "field", "value"} lines), or Server-Sent Events (field events) when the request accepts text/event-stream.
+    The last line (event) is the result, with the same value returned by the perform NER endpoint, or an error."""
+    payload = namespace_ner_gen_ai.payload
+    model_key, text_to_check, ner_fields = validate_perform_ner_payload(google_studio_api_key, payload)
+
+    cache_mode = get_cache_mode(payload)
+
+    model = validate_model_key(google_studio_api_key, model_key)
+    sse = request.accept_mimetypes.best == 'text/event-stream'
+
+    #the chunks are processed concurrently, so the long texts are not streamed by field
+    chunks = get_text_chunks(payload, text_to_check, model)
+    if len(chunks) > 1:
+      chain_res, _, headers = perform_chunked_ner(google_studio_api_key, model_key, ner_fields, chunks, cache_mode)
+      return stream_ner_result(chain_res, headers, sse)
+
+    result_cache_key = get_result_cache_key(model_key, ner_fields, text_to_check)
+    if cache_mode == CACHE_MODE_USE:
+      chain_res = genai_result_cache.get(result_cache_key)
+      if chain_res is not MISSING:
+        return stream_ner_result(chain_res, {RESULT_CACHE_HEADER: 'HIT'}, sse)
+
+    chain = get_ner_chain(model_key, ner_fields, google_studio_api_key)
+
+    def generate():
+      start = time.perf_counter()
+      partial_result = {}
+      try:
+        for field, value in iterate_complete_fields(stream_chain(chain, text_to_check), partial_result):
+          if start is not None:
+            observe_stage('genai', 'stream_first_field', time.perf_counter() - start)
+            start = None
+          yield format_stream_event('field', {'field': field, 'value': value}, sse)
+      except Exception as e:
+        partial_result.clear()
+      if not partial_result:
+        yield format_stream_event('error', {'message': "Unable to perform NER with the selected model. There are any reasons for this: Quota exceeded, Invalid model, Model not suitable for this task, Bad response from google API, etc."}, sse)
+        return
+      chain_res = dict(partial_result)
+      if cache_mode != CACHE_MODE_BYPASS:
+        genai_result_cache.set(result_cache_key, chain_res)
+      yield format_stream_event('result', {'result': chain_res}, sse)
+
+    headers = {RESULT_CACHE_HEADER: 'MISS' if cache_mode != CACHE_MODE_BYPASS else 'BYPASS'}
+    return stream_response(generate(), headers, sse)
+
+
+def iterate_complete_fields(partial_results, result):
+    """Yields (field, value) for every field of a streamed JSON object as soon as it is complete: when the parser started the next field,
+       or at the end of the stream. The partial results are the cumulative objects of a JsonOutputParser stream. The last one is left in result."""
+    completed = set()
+    for partial_result in partial_results:
+      if not isinstance(partial_result, dict):
+        continue
+      result.clear()
+      result.update(partial_result)
+      #the last field of a partial object may still be generated
+      for field in list(partial_result)[:-1]:
+        if field not in completed:
+          completed.add(field)
+          yield field, partial_result[field]
+    for field, value in result.items():
+      if field not in completed:
+        yield field, value
+
+
+def stream_ner_result(chain_res, headers, sse):
+    """Streamed response of a result that is already known (from the cache or the chunks): all the fields and the result."""
+    def generate():
+      for field, value in chain_res.items():
+        yield format_stream_event('field', {'field': field, 'value': value}, sse)
+      yield format_stream_event('result', {'result': chain_res}, sse)
+    return stream_response(generate(), headers, sse)
+
+
+def stream_response(events, headers, sse):
+    if sse:
+      return Response(stream_with_context(events), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', **headers})
+    return Response(stream_with_context(events), mimetype='application/x-ndjson', headers=headers)
+
+
+def format_stream_event(event, data, sse):
+    """A Server-Sent Event, or a NDJSON line with the event in the type key."""
+    if sse:
+      return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({'type': event, **data}) + "\n"
+
+
+def get_text_chunks(payload, text_to_check, model):
+    """Chunks of the text according to the chunking options of the request and the input token limit of the model. Aborts the request if the options are invalid."""
+    chunking = payload.get('chunking') or CHUNKING_AUTO
+    if not isinstance(chunking, str) or chunking.lower() not in CHUNKING_MODES:
+      abort(400, message=f"Chunking expected to be one of {', '.join(CHUNKING_MODES)}.")
+    chunking = chunking.lower()
+    if chunking == CHUNKING_OFF:
+      return [text_to_check]
+
+    max_chunk_tokens = payload.get('max_chunk_tokens')
+    max_chunk_tokens = GENAI_CHUNK_MAX_TOKENS if max_chunk_tokens is None else max_chunk_tokens
+    overlap_tokens = payload.get('chunk_overlap_tokens')
+    overlap_tokens = GENAI_CHUNK_OVERLAP_TOKENS if overlap_tokens is None else overlap_tokens
+    #bool is a subclass of int, true and false are not accepted as numbers
+    if (isinstance(max_chunk_tokens, bool) or isinstance(overlap_tokens, bool) or not isinstance(max_chunk_tokens, int)
+        or not isinstance(overlap_tokens, int) or max_chunk_tokens < 0 or overlap_tokens < 0):
+      abort(400, message="Max chunk tokens and chunk overlap tokens expected to be integers, zero or greater.")
+
+    #the model input limits the chunks, 0 (the default) uses the whole input
+    input_token_limit = getattr(model, 'input_token_limit', None)
+    if input_token_limit:
+      model_chunk_tokens = max(input_token_limit - GENAI_CHUNK_PROMPT_RESERVE_TOKENS, 1)
+      max_chunk_tokens = min(max_chunk_tokens, model_chunk_tokens) if max_chunk_tokens else model_chunk_tokens
+    if not max_chunk_tokens:
+      return [text_to_check]
+
+    return split_text(text_to_check, max_chunk_tokens, overlap_tokens)
+
+
+def perform_chunked_ner(google_studio_api_key, model_key, ner_fields, chunks, cache_mode):
+    """Performs the NER of every chunk concurrently (with retries on quota errors) and merges the results in a single one.
+    The results are cached per chunk, so documents sharing paragraphs reuse them."""
+    chain = get_ner_chain(model_key, ner_fields, google_studio_api_key, max_retries=0)
+
+    def perform_chunk_ner(chunk):
+      result_cache_key = get_result_cache_key(model_key, ner_fields, chunk)
+      if cache_mode == CACHE_MODE_USE:
+        chain_res = genai_result_cache.get(result_cache_key)
+        if chain_res is not MISSING:
+          return chain_res, True
+      chain_res, attempts = call_with_backoff(lambda: invoke_chain(chain, chunk),
+                                              max_retries=GENAI_BATCH_MAX_RETRIES,
+                                              initial_backoff=GENAI_BATCH_INITIAL_BACKOFF)
+      if cache_mode != CACHE_MODE_BYPASS:
+        genai_result_cache.set(result_cache_key, chain_res)
+      return chain_res, False
+
+    try:
+      with ThreadPoolExecutor(max_workers=min(GENAI_CHUNK_MAX_CONCURRENCY, len(chunks))) as executor:
+        chunk_results = list(executor.map(perform_chunk_ner, chunks))
+    except Exception as e:
+      abort(401, message="Unable to perform NER with the selected model. There are any reasons for this: Quota exceeded, Invalid model, Model not suitable for this task, Bad response from google API, etc.")
+
+    chain_res = merge_chunk_results([result for result, cached in chunk_results], normalize_ner_fields(ner_fields))
+    if cache_mode == CACHE_MODE_BYPASS:
+      cache_header = 'BYPASS'
+    else:
+      cache_header = 'HIT' if all(cached for result, cached in chunk_results) else 'MISS'
+    return chain_res, 200, {RESULT_CACHE_HEADER: cache_header, CHUNKS_HEADER: str(len(chunks))}
+
+
+#Bump this version when the prompt changes, so the cached results of the previous prompt are not used.
+PROMPT_TEMPLATE_VERSION = "1"
+RESULT_CACHE_MODE_HEADER = "X-NER-Cache-Mode"
+RESULT_CACHE_HEADER = "X-NER-Cache"
+CHUNKS_HEADER = "X-NER-Chunks"
+
+
+def get_cache_mode(payload):
+    """Result cache mode of the request, taken from the payload or the X-NER-Cache-Mode header. Aborts the request if the mode is unknown."""
+    cache_mode = (payload or {}).get('cache_mode') or request.headers.get(RESULT_CACHE_MODE_HEADER) or CACHE_MODE_USE
+    if not isinstance(cache_mode, str) or cache_mode.lower() not in CACHE_MODES:
+      abort(400, message=f"Cache mode expected to be one of {', '.join(CACHE_MODES)}.")
+    if not RESULT_CACHE_ENABLED:
+      return CACHE_MODE_BYPASS
+    return cache_mode.lower()
 
 
-    #check if the the google studio api key is valid
-    genai_client = genai.Client(api_key=google_studio_api_key)
+def get_result_cache_key(model_key, ner_fields, text_to_check):
+    """Content address of a NER result: model, fields, prompt version and text."""
+    return genai_result_cache.make_key(model_key.replace("models/",""), normalize_ner_fields(ner_fields), PROMPT_TEMPLATE_VERSION, text_to_check)
+
+
+def validate_model_key(google_studio_api_key, model_key):
+    """Check that the google studio api key is valid and the model key is available for it. Aborts the request otherwise.
+    Returns the model profile (input_token_limit, output_token_limit, etc.)."""
     model_list = []
     try:
-      model_list = [mdl.name for mdl in genai_client.models.list().page]
+      with stage_timer('genai', 'validate_model'):
+        model_list = get_model_list(google_studio_api_key)
     except Exception as e:
       abort(401, message="Invalid model key or google ai service unavailable.") 
  
     #check that the model key is valid
     model_key = model_key.replace("models/","")
-    if not any(map(lambda x: x.replace("models/","") == model_key, model_list)):
+    model = next((mdl for mdl in model_list if mdl.name.replace("models/","") == model_key), None)
+    if model is None:
       abort(401, message=f"Model key {model_key} not found.") 
+    return model
+
+
+GENAI_CHAIN_CACHE_MAX_ENTRIES = int(os.environ.get("GENAI_CHAIN_CACHE_MAX_ENTRIES", 256))
+
+#compiled chains keyed by model key, ner fields, llm options and a hash of the API key.
+chain_cache = TTLCache(max_entries=GENAI_CHAIN_CACHE_MAX_ENTRIES)
+chain_build_stats = {'builds': 0, 'build_seconds': 0.0}
+chain_build_stats_lock = threading.Lock()
+
+
+def normalize_ner_fields(ner_fields):
+    """Strip the NER fields and remove the empty and duplicated ones, keeping the order."""
+    return tuple(dict.fromkeys(str(field).strip() for field in ner_fields if field and str(field).strip()))
+
+
+def get_ner_chain(model_key, ner_fields, google_studio_api_key, **llm_kwargs):
+    """Same as build_ner_chain, but the chains are cached (LRU) so the same request signature does not rebuild the chain."""
+    model_key = model_key.replace("models/","")
+    ner_fields = normalize_ner_fields(ner_fields)
+    cache_key = (model_key, ner_fields, tuple(sorted(llm_kwargs.items())), hash_key(google_studio_api_key))
+
+    chain = chain_cache.get(cache_key)
+    if chain is MISSING:
+      start = time.perf_counter()
+      with stage_timer('genai', 'chain_build'):
+        chain = build_ner_chain(model_key, ner_fields, google_studio_api_key, **llm_kwargs)
+      with chain_build_stats_lock:
+        chain_build_stats['builds'] += 1
+        chain_build_stats['build_seconds'] += time.perf_counter() - start
+      chain_cache.set(cache_key, chain)
+    return chain
+
+
+def invoke_chain(chain, text_to_check):
+    """Invokes a NER chain. With the metrics enabled, the prompt, the LLM call and the JSON parsing are timed as stages."""
+    if not metrics_registry.enabled:
+      return chain.invoke(text_to_check)
+    from apis.chain_metrics import StageTimingCallbackHandler
+    return chain.invoke(text_to_check, config={'callbacks': [StageTimingCallbackHandler()]})
+
+
+def stream_chain(chain, text_to_check):
+    """Same as invoke_chain, but returns the stream of the partial results of the chain."""
+    if not metrics_registry.enabled:
+      return chain.stream(text_to_check)
+    from apis.chain_metrics import StageTimingCallbackHandler
+    return chain.stream(text_to_check, config={'callbacks': [StageTimingCallbackHandler()]})
+
+
+def get_chain_cache_stats():
+    """Statistics of the chain cache, including the time spent building chains."""
+    stats = chain_cache.stats()
+    with chain_build_stats_lock:
+      stats.update(chain_build_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+    stats['avg_build_seconds'] = stats['build_seconds'] / stats['builds'] if stats['builds'] else 0.0
+    #approximate CPU time saved by the cache hits
+    stats['saved_seconds'] = stats['hits'] * stats['avg_build_seconds']
+    return stats
+
+
+client_registry_stats_model = namespace_ner_gen_ai.model("GenAIClientRegistryStats",{
+  'enabled': fields.Boolean(description='Indicates if the clients are reused across requests (GENAI_CLIENT_POOL_ENABLED).'),
+  'hits': fields.Integer(description='Number of requests served with an existing client.'),
+  'misses': fields.Integer(description='Number of clients built.'),
+  'evictions': fields.Integer(description='Number of clients removed because they were idle or to honor the registry size.'),
+  'entries': fields.Integer(description='Number of API keys with a client.'),
+  'max_entries': fields.Integer(description='Maximum number of API keys with a client.'),
+  'chat_models': fields.Integer(description='Number of chat models in the registry.'),
+  'chat_models_built': fields.Integer(description='Number of chat models built.'),
+})
+
+
+cache_stats_model = namespace_ner_gen_ai.model("GenAICacheStats",{
+  'hits': fields.Integer(description='Number of lookups served from the cache.'),
+  'misses': fields.Integer(description='Number of lookups not found in the cache.'),
+  'evictions': fields.Integer(description='Number of entries removed to honor the cache size.'),
+  'entries': fields.Integer(description='Number of entries in the cache.'),
+  'max_entries': fields.Integer(description='Maximum number of entries in the cache.'),
+  'hit_rate': fields.Float(description='Hits over lookups.'),
+  'builds': fields.Integer(description='Number of chains built.'),
+  'build_seconds': fields.Float(description='Total time spent building chains.'),
+  'avg_build_seconds': fields.Float(description='Average time spent building a chain.'),
+  'saved_seconds': fields.Float(description='Approximate time saved by the cache hits.'),
+})
+
+@namespace_ner_gen_ai.route("/cache_stats")
+class GenAICacheStats(Resource):
+  def get(self):
+    """Get the statistics of the GenAI caches (model list validation, compiled chains and results)."""
+    result_cache_stats = genai_result_cache.stats()
+    return {'model_list': marshal(model_list_cache.stats(), cache_stats_model, skip_none=True),
+            'chains': marshal(get_chain_cache_stats(), cache_stats_model),
+            'results_memory': marshal(result_cache_stats['memory'], cache_stats_model, skip_none=True),
+            'results_disk': marshal(result_cache_stats['disk'], cache_stats_model, skip_none=True),
+            'clients': marshal(genai_client_registry.stats(), client_registry_stats_model)}
+
+
+def build_ner_chain(model_key, ner_fields, google_studio_api_key, **llm_kwargs):
+    """Build the langchain chain (prompt | llm | json parser) that extracts the given NER fields."""
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_core.output_parsers import JsonOutputParser
+
+    model_key = model_key.replace("models/","")
 
-    #at this point the request is valid, 
     #build the dynamic pydantic object to be passed to the Gen AI chain 
     fields_tuples = [(field, (str,field )) for field in ner_fields]    
     fields_dict = dict(fields_tuples)
@@ -133,16 +523,114 @@ class GenAIPerformNER(Resource):
       )
     ])
    
-    #prepare the chain     
-    llm =  ChatGoogleGenerativeAI(model=model_key, google_api_key=google_studio_api_key)  
+    #prepare the chain. The chat model (and its HTTP connections) is shared by the chains of the same API key and model
+    llm = genai_client_registry.get_chat_model(google_studio_api_key, model_key, **llm_kwargs)
 
-    chain = template.partial(format_instructions=format_instructions) | llm | parser
+    return template.partial(format_instructions=format_instructions) | llm | parser
 
-    chain_res = ""
-    try:
-      chain_res = chain.invoke(text_to_check)
-    except Exception as e:
-      abort(401, message="Unable to perform NER with the selected model. There are any reasons for this: Quota exceeded, Invalid model, Model not suitable for this task, Bad response from google API, etc.")
-      
-  
-    return chain_res
+
+GENAI_BATCH_MAX_CONCURRENCY = int(os.environ.get("GENAI_BATCH_MAX_CONCURRENCY", 4))
+GENAI_BATCH_REQUESTS_PER_MINUTE = float(os.environ.get("GENAI_BATCH_REQUESTS_PER_MINUTE", 60))
+GENAI_BATCH_MAX_RETRIES = int(os.environ.get("GENAI_BATCH_MAX_RETRIES", 4))
+GENAI_BATCH_INITIAL_BACKOFF = float(os.environ.get("GENAI_BATCH_INITIAL_BACKOFF", 1.0))
+
+##Request model for perform gen ai in batch
+gen_ai_ner_batch_payload = namespace_ner_gen_ai.model("GenAIBatchRequestPayload",{
+  'model_key': fields.String(required=True, description='Model key'),
+  'texts': fields.List(fields.String(required=True), required=True, description='Texts to analyze'),
+  'ner_fields': fields.List(fields.String(required=True), description='Named Entities to be extracted'),
+  'max_concurrency': fields.Integer(required=False, description=f'Number of concurrent calls to the model. Defaults to (and limited by) {GENAI_BATCH_MAX_CONCURRENCY}.'),
+  'requests_per_minute': fields.Float(required=False, description=f'Maximum number of calls per minute to the model. Defaults to (and limited by) {GENAI_BATCH_REQUESTS_PER_MINUTE}.'),
+  'max_retries': fields.Integer(required=False, description=f'Retries with exponential backoff when the quota is exceeded. Defaults to (and limited by) {GENAI_BATCH_MAX_RETRIES}.'),
+  'cache_mode': fields.String(required=False, enum=list(CACHE_MODES), description='How to use the result cache: use (default), refresh or bypass. It can also be sent in the X-NER-Cache-Mode header.'),
+})
+
+
+def get_batch_option(payload, name, maximum, error_message, number_types=(int,), allow_zero=False):
+  """Numeric option of a batch request: the maximum (the server setting) when it is not sent, otherwise limited by it.
+  Aborts the request if it is not a number of the expected type, or it is negative (or zero, unless allowed)."""
+  value = payload.get(name)
+  if value is None:
+    return maximum
+  if isinstance(value, bool) or not isinstance(value, number_types) or value < 0 or (value == 0 and not allow_zero):
+    abort(400, message=error_message)
+  return min(value, maximum)
+
+
+@namespace_ner_gen_ai.route("/perform_ner_batch/<google_studio_api_key>")
+@namespace_ner_gen_ai.param('google_studio_api_key', 'Google studio API key. Go to https://aistudio.google.com/app/apikey to obtain your key.')
+@namespace_ner_gen_ai.expect(gen_ai_ner_batch_payload)
+@namespace_ner_gen_ai.response(401, 'Invalid API key or unauthorized.')
+@namespace_ner_gen_ai.response(400, 'Invalid request.')
+class GenAIPerformNERBatch(Resource):
+  def post(self, google_studio_api_key):
+    """Perform NER with GenAI on a list of texts. 
+    The texts are processed concurrently and the results are streamed as NDJSON as soon as they finish (not in the input order, use the index).
+    Errors are reported per item."""
+
+    #general validations
+    if not google_studio_api_key:
+       abort(401, message="Google AI studio key is required.") 
+
+    payload = namespace_ner_gen_ai.payload or {}
+
+    model_key = payload.get('model_key')
+    if not model_key:
+       abort(400, message="Model key key is required.") 
+
+    texts = payload.get('texts')
+    if not texts:
+       abort(400, message="Texts node is required.") 
+
+    if type(texts) is not list:
+      abort(400, message="Texts node expected to be a list.")
+
+    ner_fields = payload.get('ner_fields')
+    if not ner_fields:
+       abort(400, message="NER fields node is required.")
+    
+    if type(ner_fields) is not list:
+      abort(400, message="NER fields node expected to be a list.")
+
+    max_concurrency = get_batch_option(payload, 'max_concurrency', GENAI_BATCH_MAX_CONCURRENCY, "Max concurrency expected to be an integer greater than zero.")
+    requests_per_minute = get_batch_option(payload, 'requests_per_minute', GENAI_BATCH_REQUESTS_PER_MINUTE, "Requests per minute expected to be a number greater than zero.",
+                                           number_types=(int, float))
+    max_retries = get_batch_option(payload, 'max_retries', GENAI_BATCH_MAX_RETRIES, "Max retries expected to be an integer, zero or greater.", allow_zero=True)
+
+    cache_mode = get_cache_mode(payload)
+
+    validate_model_key(google_studio_api_key, model_key)
+
+    #the chain is built once for the whole batch. The retries are handled here, not by the llm client.
+    chain = get_ner_chain(model_key, ner_fields, google_studio_api_key, max_retries=0)
+    rate_limiter = TokenBucket(rate=requests_per_minute / 60.0, capacity=max_concurrency)
+
+    def perform_single_ner(index, text):
+      result_cache_key = get_result_cache_key(model_key, ner_fields, text)
+      if cache_mode == CACHE_MODE_USE:
+        chain_res = genai_result_cache.get(result_cache_key)
+        if chain_res is not MISSING:
+          return {'index': index, 'result': chain_res, 'attempts': 0, 'cached': True}
+      try:
+        chain_res, attempts = call_with_backoff(lambda: invoke_chain(chain, text),
+                                                max_retries=max_retries,
+                                                initial_backoff=GENAI_BATCH_INITIAL_BACKOFF,
+                                                rate_limiter=rate_limiter)
+        if cache_mode != CACHE_MODE_BYPASS:
+          genai_result_cache.set(result_cache_key, chain_res)
+        return {'index': index, 'result': chain_res, 'attempts': attempts, 'cached': False}
+      except Exception as e:
+        return {'index': index, 'error': f"Unable to perform NER with the selected model. Error message: {e}", 'quota_exceeded': is_quota_error(e)}
+
+    def generate():
+      with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+        futures = [executor.submit(perform_single_ner, index, str(text) if text is not None else '') for index, text in enumerate(texts)]
+        try:
+          for future in as_completed(futures):
+            yield json.dumps(future.result()) + "\n"
+        finally:
+          #the client went away, do not keep calling the model
+          for future in futures:
+            future.cancel()
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
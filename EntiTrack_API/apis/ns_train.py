@@ -1,27 +1,34 @@
-from flask_restx import Resource,Namespace, abort, reqparse,fields 
+from flask_restx import Resource,Namespace, abort, reqparse,fields, inputs
 from werkzeug.datastructures import FileStorage
 from flask_cors import cross_origin
+from flask import Response, stream_with_context
 
-import pandas as pd
-from sklearn.model_selection import train_test_split
+#pandas and SpaCy are imported by the functions that use them, so the API starts without loading them
 
 import re 
 import uuid
-
-import spacy
-from spacy.tokens import DocBin
-from spacy.util import filter_spans
+from functools import lru_cache
 
 import os
 
-import subprocess
-import sys
 import shutil
+import time
 
 import json
+from collections import deque
 
-from datetime import datetime
+from datetime import datetime, timedelta
 
+from apis.model_registry import model_registry, get_best_model_path
+from apis.metrics import stage_timer, timed_iterator, observe_stage
+from apis.inference_pool import InferencePool, get_preload_sessions
+from apis.inference_cache import inference_cache, INFERENCE_NORMALIZE_TEXT
+from apis.session_index import SessionIndex
+from apis.training_worker import training_worker_pool, TrainingWorkerError, TRAINING_NICENESS
+from apis.corpus_cache import corpus_cache
+from apis.training_profiles import TRAINING_PROFILES, TRAINING_DEFAULT_PROFILE, get_training_stats
+from apis.rule_patterns import RuleValueCollector, add_entity_ruler, ENTITY_RULER_NAME, RULES_PHRASE_MATCHER_ATTR
+from apis.training_jobs import training_job_queue, QueueFullError, STATUS_QUEUED, STATUS_RUNNING, STATUS_SUCCEEDED, STATUS_FAILED
 
 
 
@@ -63,159 +70,778 @@ file_upload_parser.add_argument('training_description',
                                 required=True,
                                 location='form',
                                 help='Brief description of your training session.')  
+file_upload_parser.add_argument('training_profile', 
+                                type=str, 
+                                required=False,
+                                location='form',
+                                choices=tuple(TRAINING_PROFILES),
+                                help=f'Training profile: {", ".join(TRAINING_PROFILES)}. Defaults to {TRAINING_DEFAULT_PROFILE}. See the training profiles endpoint.')  
+file_upload_parser.add_argument('rules_ahead_of_ner', 
+                                type=inputs.boolean, 
+                                required=False,
+                                default=False,
+                                location='form',
+                                help='Add to the trained model an entity ruler, built from the values of the rule columns, that runs ahead of the NER.')  
+file_upload_parser.add_argument('rule_columns', 
+                                type=str, 
+                                required=False,
+                                location='form',
+                                help='Comma separated entity columns compiled into rules. Defaults to the columns with few distinct values (closed vocabularies).')  
 
 
 
+training_job_model = namespace_ner_train.model("training_job",{
+  'training_session_id': fields.String(required=True, description='Session key for acceding a trained model.'),
+  'status': fields.String(required=True, enum=[STATUS_QUEUED, STATUS_RUNNING, STATUS_SUCCEEDED, STATUS_FAILED], description='Status of the training job.'),
+  'message': fields.String(required=False, description='Reason why the training failed.'),
+  'queue_position': fields.Integer(required=False, description='Position in the queue of training jobs when the job is queued.'),
+  'queued_at': fields.DateTime(required=False, description='Date when the job was queued.'),
+  'started_at': fields.DateTime(required=False, description='Date when the job started to run.'),
+  'finished_at': fields.DateTime(required=False, description='Date when the job finished.'),
+  'elapsed_seconds': fields.Float(required=False, description='Seconds since the job was queued (until it finished).'),
+  'running_seconds': fields.Float(required=False, description='Seconds the job has been running (until it finished).'),
+  'latest_step': fields.Integer(required=False, description='Latest training step.'),
+  'timings': fields.Raw(required=False, description='Seconds spent in every phase of the training (when finished).'),
+})
+
+
 @namespace_ner_train.route("/train")
 class TrainModels(Resource):
   
   @namespace_ner_train.expect(file_upload_parser)
   @namespace_ner_train.response(400, 'Invalid request.')
-  @namespace_ner_train.marshal_with(training_session_model)
+  @namespace_ner_train.response(429, 'Too many training jobs waiting.')
+  @namespace_ner_train.marshal_with(training_job_model, code=202)
   def post(self):
-    """Train an SpaCy Model. Given a dataset and the name of the unstructured column."""
+    """Train an SpaCy Model. Given a dataset and the name of the unstructured column.
+    The training runs in background, use the training status endpoint with the returned training session id to follow it."""
     args = file_upload_parser.parse_args()
     uploaded_file = args['file']
     unstructured_column_name = args['unstructured_column_name']
     training_description = args['training_description']
+    training_profile = args['training_profile'] or TRAINING_DEFAULT_PROFILE
 
     if not unstructured_column_name:
        abort(400, message="Unstructured column name is required.")
 
+    if not training_description:
+       abort(400, message="Training description is required.")
+
+    column_list = validate_training_file(uploaded_file, unstructured_column_name)
+    rule_columns = get_rule_columns(args['rule_columns'], column_list, unstructured_column_name)
+
+    return submit_training_job(uploaded_file, unstructured_column_name, training_description, training_profile,
+                               rules_ahead_of_ner=args['rules_ahead_of_ner'], rule_columns=rule_columns), 202
+
+
+#corpus used to retrain a session: the corpus of the base session plus the new rows, or only the new rows
+RETRAIN_DATA_COMBINED = "combined"
+RETRAIN_DATA_NEW = "new"
+RETRAIN_DATA_MODES = (RETRAIN_DATA_COMBINED, RETRAIN_DATA_NEW)
+
+retrain_upload_parser = file_upload_parser.copy()
+#the entity ruler of the base model (if any) is kept
+retrain_upload_parser.remove_argument('rules_ahead_of_ner')
+retrain_upload_parser.remove_argument('rule_columns')
+retrain_upload_parser.add_argument('training_session_id', 
+                                   type=str, 
+                                   required=True,
+                                   location='form',
+                                   help='Training session id of the model to start from.')  
+retrain_upload_parser.replace_argument('training_description', 
+                                       type=str, 
+                                       required=False,
+                                       location='form',
+                                       help='Brief description of the new training session. Defaults to the description of the base session.')  
+retrain_upload_parser.add_argument('data_mode', 
+                                   type=str, 
+                                   required=False,
+                                   location='form',
+                                   choices=RETRAIN_DATA_MODES,
+                                   help=f'Train on the corpus of the base session plus the file ({RETRAIN_DATA_COMBINED}, default) or only on the file ({RETRAIN_DATA_NEW}).')  
+
+
+@namespace_ner_train.route("/train/retrain")
+class RetrainModel(Resource):
+  
+  @namespace_ner_train.expect(retrain_upload_parser)
+  @namespace_ner_train.response(400, 'Invalid request.')
+  @namespace_ner_train.response(409, 'The base session is still training.')
+  @namespace_ner_train.response(429, 'Too many training jobs waiting.')
+  @namespace_ner_train.marshal_with(training_job_model, code=202)
+  def post(self):
+    """Retrain the model of a training session with additional rows. The new session starts from the weights of the base session model-best
+    and trains for fewer steps than a training from scratch. The base session is not modified, the lineage is recorded in the metadata of the new session.
+    The training runs in background, use the training status endpoint with the returned training session id to follow it."""
+    args = retrain_upload_parser.parse_args()
+    base_training_session_id = args['training_session_id']
+    uploaded_file = args['file']
+    unstructured_column_name = args['unstructured_column_name']
+    training_profile = args['training_profile'] or TRAINING_DEFAULT_PROFILE
+    data_mode = args['data_mode'] or RETRAIN_DATA_COMBINED
+
+    if not base_training_session_id:
+       abort(400, message="Training Session ID is required.")
+
+    base_session = get_training_session_data(base_training_session_id)
+    abort_if_session_not_ready(base_session)
+
+    if not has_trainable_ner(base_training_session_id):
+       abort(400, message=f"Session with id {base_training_session_id} has no trained NER to start from (sessions built from rules can not be retrained).")
+
+    if not unstructured_column_name:
+       abort(400, message="Unstructured column name is required.")
+
+    training_description = args['training_description'] or base_session.training_description
+
+    validate_training_file(uploaded_file, unstructured_column_name)
+
+    return submit_training_job(uploaded_file, unstructured_column_name, training_description, training_profile,
+                               base_training_session_id=base_training_session_id, data_mode=data_mode), 202
 
-    if not uploaded_file:
-       abort(400, message="A file was expected in the request.")
+
+rules_upload_parser = file_upload_parser.copy()
+rules_upload_parser.remove_argument('training_profile')
+rules_upload_parser.remove_argument('rules_ahead_of_ner')
+
+
+@namespace_ner_train.route("/train/rules")
+class RuleSession(Resource):
+  
+  @namespace_ner_train.expect(rules_upload_parser)
+  @namespace_ner_train.response(400, 'Invalid request.')
+  @namespace_ner_train.marshal_with(training_session_model, code=201)
+  def post(self):
+    """Create a session without training: the values of the entity columns are compiled into the patterns of an entity ruler.
+    Suited for the closed vocabulary columns (states, countries, cities, etc.). The session is ready when the request returns."""
+    args = rules_upload_parser.parse_args()
+    uploaded_file = args['file']
+    unstructured_column_name = args['unstructured_column_name']
+    training_description = args['training_description']
+
+    if not unstructured_column_name:
+       abort(400, message="Unstructured column name is required.")
 
     if not training_description:
        abort(400, message="Training description is required.")
 
+    column_list = validate_training_file(uploaded_file, unstructured_column_name)
+    rule_columns = get_rule_columns(args['rule_columns'], column_list, unstructured_column_name)
+
+    training_session_id = str(uuid.uuid4())
+    directory_path = os.path.join("model_train_sessions",training_session_id)
+    os.makedirs(name=directory_path, exist_ok=False) 
+
+    csv_path = os.path.join(directory_path, "upload.csv")
+    uploaded_file.stream.seek(0)
+    uploaded_file.save(csv_path)
+
+    try:
+      with stage_timer('training', 'rules_build'):
+        rules = build_rule_session(get_best_model_path(training_session_id), csv_path, unstructured_column_name, rule_columns)
+      os.remove(csv_path)
+      edit_training_session_metadata(training_session_id=training_session_id,
+                                     training_description=training_description,
+                                     rules=rules)
+    except TrainingError as e:
+      try_to_delete_session_folder(directory_path)
+      abort(400, message=str(e))
+    except Exception:
+      try_to_delete_session_folder(directory_path)
+      raise
+
+    return get_training_session_data(training_session_id), 201
+
+
+def validate_training_file(uploaded_file, unstructured_column_name):
+    """Checks that the uploaded file is a CSV with the unstructured column and at least another column. Aborts the request otherwise."""
+    if not uploaded_file:
+       abort(400, message="A file was expected in the request.")
+
     if not uploaded_file.filename.lower().endswith('.csv'):
        abort(400, message="The file provided in the request was expected to be a file with extension CSV.")
 
-    data_frame_train = None
+    import pandas as pd
+
+    #only the header is read here, the rows are read in chunks by the training job
+    column_list = []
     try:
-      data_frame_train=pd.read_csv(filepath_or_buffer=uploaded_file,sep=",",dtype=str)
+      column_list=pd.read_csv(filepath_or_buffer=uploaded_file,sep=",",dtype=str,nrows=0).columns.to_list()
     except Exception as e:
       abort(400, message=f"The submitted file is an invalid CSV. Error message: {e}")
 
-    column_list = data_frame_train.columns.to_list()
-
-
-    TAG_SUFFIX = "__TAG" 
-
     if unstructured_column_name not in column_list:
       abort(400, message=f'The submitted csv file is missing the column with name "{unstructured_column_name}"')
     
     if len(column_list) <=1:
       abort(400, message=f'The submitted csv file does does not have enough columns. Expected to have the column "{unstructured_column_name}" and at least another column.')
-
-    fragment_columns = [column for column in column_list if column != unstructured_column_name]
-    fragment_tag_columns = [column + TAG_SUFFIX for column in fragment_columns]
+    return column_list
 
 
-    X_train, X_test, _, _ = train_test_split(data_frame_train, data_frame_train, test_size=0.3, random_state=42)
+def get_rule_columns(rule_columns, column_list, unstructured_column_name):
+    """List of rule columns from a comma separated string (None when empty). Aborts the request if a column is not an entity column of the file."""
+    rule_columns = [column.strip() for column in (rule_columns or '').split(",") if column.strip()]
+    unknown = [column for column in rule_columns if column not in column_list or column == unstructured_column_name]
+    if unknown:
+      abort(400, message=f"Rule columns not found in the entity columns of the submitted csv file: {', '.join(unknown)}.")
+    return rule_columns or None
 
-    df_entity_spans_train= create_entity_spans(data_frame=X_train.astype(str), 
-                                                tag_list= fragment_tag_columns,
-                                                text_to_parse_column=unstructured_column_name, 
-                                                tag_suffix= TAG_SUFFIX)
 
-    
-    df_entity_spans_test = create_entity_spans(data_frame=X_test.astype(str), 
-                                                tag_list= fragment_tag_columns,
-                                                text_to_parse_column=unstructured_column_name, 
-                                                tag_suffix= TAG_SUFFIX) 
-    
-    nlp = spacy.blank("en")
-
-    train_doc_bin = get_doc_bin(data=df_entity_spans_train.values.tolist(),
-                                nlp=nlp)
-    
-    test_doc_bin = get_doc_bin(data=df_entity_spans_test.values.tolist(),
-                               nlp=nlp)  
-    
+def submit_training_job(uploaded_file, unstructured_column_name, training_description, training_profile, **training_options):
+    """Saves the uploaded CSV in the folder of a new session and queues its training job. Returns the status of the job.
+       Aborts the request with 429 when the queue is full."""
     training_session_id = str(uuid.uuid4())
    
     directory_path = os.path.join("model_train_sessions",training_session_id)
     os.makedirs(name=directory_path, exist_ok=False) 
 
-    train_spacy_path = os.path.join(directory_path,"train.spacy")
-    train_doc_bin.to_disk(train_spacy_path)
-  
-    test_spacy_path = os.path.join(directory_path,"test.spacy")
-    test_doc_bin.to_disk(test_spacy_path)
+    csv_path = os.path.join(directory_path, "upload.csv")
+    uploaded_file.stream.seek(0)
+    uploaded_file.save(csv_path)
+
+    try:
+      training_job_queue.submit(training_session_id, 
+                                train_session,
+                                training_session_id,
+                                csv_path,
+                                unstructured_column_name,
+                                training_description,
+                                training_profile,
+                                **training_options)
+    except QueueFullError as e:
+      try_to_delete_session_folder(directory_path)
+      abort(429, message=str(e))
+
+    return get_training_job_status(training_session_id)
+
+
+training_profile_model = namespace_ner_train.model("training_profile",{
+  'name': fields.String(required=True, description='Name of the profile (training_profile of the train endpoint).'),
+  'description': fields.String(required=False, description='Description of the profile.'),
+  'is_default': fields.Boolean(required=True, description='Profile used when the train request does not choose one.'),
+  'steps_per_example': fields.Float(description='Training steps per example of the train set (max steps before the limits).'),
+  'min_steps': fields.Integer(description='Minimum of the max steps.'),
+  'max_steps': fields.Integer(description='Maximum of the max steps.'),
+  'evaluations': fields.Integer(description='Number of evaluations over the max steps.'),
+  'patience_evaluations': fields.Integer(description='Evaluations without a better F-score before stopping the training.'),
+  'batch_size_start': fields.Integer(description='Words per batch at the start of the training.'),
+  'batch_size_stop': fields.Integer(description='Maximum words per batch.'),
+  'batch_size_compound': fields.Float(description='Growth of the batch size per step.'),
+  'tok2vec_width': fields.Integer(description='Width of the token to vector layer.'),
+  'tok2vec_depth': fields.Integer(description='Depth of the token to vector layer.'),
+})
+
+
+@namespace_ner_train.route("/train/profiles")
+class TrainProfiles(Resource):
+  @namespace_ner_train.marshal_list_with(training_profile_model)
+  def get(self):
+    """Get the training profiles that can be chosen when training a model."""
+    return [dict(profile.to_dict(), is_default=name == TRAINING_DEFAULT_PROFILE) for name, profile in TRAINING_PROFILES.items()]
+
+
+@namespace_ner_train.route("/train/status/<training_session_id>")
+@namespace_ner_train.param('training_session_id', 'Training session id obtained from the train process.')
+@namespace_ner_train.response(401, 'Invalid session id.')
+class TrainStatus(Resource):
+  @namespace_ner_train.marshal_with(training_job_model)
+  def get(self, training_session_id):
+    """Get the status of the training job of a training session."""
+    status = get_training_job_status(training_session_id)
+    if status is None:
+       abort(401, f"Training job for the session with id {training_session_id} is not found.")
+    return status
+
+
+#seconds between two checks of the progress of a job when streaming it
+TRAINING_PROGRESS_POLL_SECONDS = 0.5
+
+training_progress_parser = reqparse.RequestParser()
+training_progress_parser.add_argument('since', type=int, required=False, default=0, location='args', help='Index of the first evaluation step to return (use next_index of the previous response).')
+
+training_progress_model = namespace_ner_train.model("training_progress",{
+  'training_session_id': fields.String(required=True, description='Session key for acceding a trained model.'),
+  'status': fields.String(required=True, description='Status of the training job.'),
+  'message': fields.String(required=False, description='Reason why the training failed.'),
+  'latest_step': fields.Integer(required=False, description='Latest training step.'),
+  'next_index': fields.Integer(required=True, description='Value of since for the next request.'),
+  'events': fields.List(fields.Raw, description='Evaluation steps: step, epoch, losses, score, scores (ents_f, ents_p, ents_r), seconds and words.'),
+})
+
+
+@namespace_ner_train.route("/train/progress/<training_session_id>")
+@namespace_ner_train.param('training_session_id', 'Training session id obtained from the train process.')
+@namespace_ner_train.response(401, 'Invalid session id.')
+class TrainProgress(Resource):
+  @namespace_ner_train.expect(training_progress_parser)
+  @namespace_ner_train.marshal_with(training_progress_model)
+  def get(self, training_session_id):
+    """Get the losses and scores of the evaluation steps of a training job (polling)."""
+    job = training_job_queue.get(training_session_id)
+    if job is None:
+       abort(401, f"Training job for the session with id {training_session_id} is not found.")
+    since = max(training_progress_parser.parse_args()['since'] or 0, 0)
+    return get_training_progress(job, since)
+
+
+@namespace_ner_train.route("/train/progress/<training_session_id>/stream")
+@namespace_ner_train.param('training_session_id', 'Training session id obtained from the train process.')
+@namespace_ner_train.response(401, 'Invalid session id.')
+class TrainProgressStream(Resource):
+  def get(self, training_session_id):
+    """Stream the evaluation steps of a training job as Server-Sent Events until the job finishes."""
+    job = training_job_queue.get(training_session_id)
+    if job is None:
+       abort(401, f"Training job for the session with id {training_session_id} is not found.")
+
+    def generate():
+      since = 0
+      latest_step = None
+      while True:
+        finished = job.is_finished
+        progress = get_training_progress(job, since)
+        for event in progress['events']:
+          yield f"event: evaluation\ndata: {json.dumps(event)}\n\n"
+        since = progress['next_index']
+        if progress['latest_step'] != latest_step:
+          latest_step = progress['latest_step']
+          yield f"event: step\ndata: {json.dumps({'step': latest_step})}\n\n"
+        if finished:
+          yield f"event: status\ndata: {json.dumps(progress_status(progress))}\n\n"
+          return
+        time.sleep(TRAINING_PROGRESS_POLL_SECONDS)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+def get_training_progress(job, since=0):
+  """Evaluation steps of a training job starting at index since."""
+  events = job.progress[since:]
+  return {'training_session_id': job.training_session_id,
+          'status': job.status,
+          'message': job.message,
+          'latest_step': job.latest_step,
+          'next_index': since + len(events),
+          'events': events}
+
+
+def progress_status(progress):
+  return {key: progress[key] for key in ('training_session_id', 'status', 'message', 'latest_step')}
+
+
+def get_training_job_status(training_session_id):
+  """Status of the training job of a session. 
+     Sessions trained before the process started have no job, they are reported as succeeded if they are valid."""
+  job = training_job_queue.get(training_session_id)
+  if job:
+    status = {'training_session_id': training_session_id,
+              'status': job.status,
+              'message': job.message,
+              'queue_position': training_job_queue.queue_position(training_session_id),
+              'queued_at': job.queued_at,
+              'started_at': job.started_at,
+              'finished_at': job.finished_at,
+              'elapsed_seconds': job.elapsed_seconds,
+              'running_seconds': job.running_seconds,
+              'latest_step': job.latest_step,
+              'timings': job.timings}
+    return status
+
+  if get_training_session_data(training_session_id).is_valid:
+    return {'training_session_id': training_session_id, 'status': STATUS_SUCCEEDED}
+  return None
+
+
+class TrainingError(Exception):
+   pass
+
+
+def train_session(training_session_id, csv_path, unstructured_column_name, training_description, training_profile=TRAINING_DEFAULT_PROFILE,
+                  base_training_session_id=None, data_mode=None, rules_ahead_of_ner=False, rule_columns=None):
+    """Builds the training corpus and trains the model of a session (runs as a background job).
+       With a base_training_session_id, the model is fine tuned from the model of the base session (see RetrainModel).
+       With rules_ahead_of_ner, an entity ruler built from the values of the rule columns runs before the trained NER.
+       The session folder is removed if the training fails."""
+    directory_path = os.path.join("model_train_sessions",training_session_id)
+    try:
+      _train_session(directory_path, training_session_id, csv_path, unstructured_column_name, training_description, training_profile,
+                     base_training_session_id, data_mode, rules_ahead_of_ner, rule_columns)
+    except Exception:
+      try_to_delete_session_folder(directory_path)
+      raise
+
+
+def _train_session(directory_path, training_session_id, csv_path, unstructured_column_name, training_description, training_profile,
+                   base_training_session_id, data_mode, rules_ahead_of_ner, rule_columns):
+    job = training_job_queue.get(training_session_id)
+    timings = {'queue_seconds': round(job.elapsed_seconds, 3)} if job else {}
+    start = time.perf_counter()
+
+    train_spacy_path = os.path.join(directory_path,"train")
+    test_spacy_path = os.path.join(directory_path,"test")
+
+    train_count, test_count, corpus_cached = get_training_corpus(csv_path=csv_path,
+                                                                 unstructured_column_name=unstructured_column_name,
+                                                                 train_path=train_spacy_path,
+                                                                 test_path=test_spacy_path)
+    timings['corpus_seconds'] = round(time.perf_counter() - start, 3)
+
+    rule_values = None
+    if rules_ahead_of_ner:
+      rule_values, _ = read_rule_values(csv_path, unstructured_column_name)
+
+    #the corpus shards have all the data needed for training
+    os.remove(csv_path)
 
     models_path = os.path.join(directory_path,"models")
 
     oConfig_path = os.path.join("config","config.cfg")
+    source_model = None
+    lineage = None
+    if base_training_session_id:
+      #the config and the weights of the base model are used, the new rows only change the number of steps
+      source_model = get_best_model_path(base_training_session_id)
+      oConfig_path = os.path.join(source_model,"config.cfg")
+      lineage = get_retrain_lineage(base_training_session_id, data_mode, train_count, test_count)
+      if data_mode == RETRAIN_DATA_COMBINED:
+        lineage['base_corpus_included'] = copy_session_corpus(base_training_session_id, train_spacy_path, test_spacy_path)
+
+    #steps, evaluations, early stopping, batch sizes and network size of the profile, scaled to the size of the train set (the new rows when retraining)
+    profile_overrides = TRAINING_PROFILES[training_profile].get_overrides(train_count, fine_tune=source_model is not None)
+    overrides = {"paths.train": train_spacy_path,
+                 "paths.dev": test_spacy_path,
+                 **profile_overrides}
+
+    evaluations = []
+    latest_step = None
+
+    def on_progress(message):
+      nonlocal latest_step
+      if message['type'] == 'evaluation':
+        evaluations.append(message)
+      latest_step = message['step']
+      if not job:
+        return
+      if message['type'] == 'evaluation':
+        job.progress.append(message)
+      job.latest_step = message['step']
 
+    try:
+        # The training runs in a pre-warmed worker process with a lower priority, so it does not slow down the inference requests.
+        with stage_timer('training', 'spacy_train'):
+          timings.update(training_worker_pool.run(config_path=oConfig_path,
+                                                  output_path=models_path,
+                                                  overrides=overrides,
+                                                  on_progress=on_progress,
+                                                  source_model=source_model))
+    except TrainingWorkerError as e:
+        print(f"Error while training the model: {e}")
+        raise TrainingError(f'Error while training the model. {e}')
+
+    rules = None
+    if rule_values:
+      rules = add_rules_to_model(get_best_model_path(training_session_id), rule_values, rule_columns)
+
+    timings['total_seconds'] = round(time.perf_counter() - start, 3)
+    if 'queue_seconds' in timings:
+      observe_stage('training', 'queue_wait', timings['queue_seconds'])
+    if job:
+      job.timings = timings
+
+    training_stats = get_training_stats(evaluations=evaluations,
+                                        latest_step=latest_step,
+                                        max_steps=profile_overrides["training.max_steps"],
+                                        duration_seconds=timings['total_seconds'])
+    training_stats.update(train_examples=train_count, test_examples=test_count, corpus_cached=corpus_cached)
 
-    # Define the command and its arguments as a list
-    command = [
-        sys.executable,  # Use the current Python executable
-        "-m",
-        "spacy",
-        "train",
-        oConfig_path,
-        "--paths.train",
-        train_spacy_path,
-        "--paths.dev",
-        test_spacy_path,
-        "--output",
-        models_path,
-        "--training.eval_frequency",
-        "10",
-        "--training.max_steps",
-        "300"
-    ]
+    edit_training_session_metadata(training_session_id=training_session_id,
+                                   training_description=training_description,
+                                   training_timings=timings,
+                                   training_profile={'name': training_profile, 'overrides': profile_overrides, 'fine_tune': source_model is not None},
+                                   training_stats=training_stats,
+                                   lineage=lineage,
+                                   rules=rules)
 
-   
+
+def has_trainable_ner(training_session_id):
+    """True when the pipeline of the session model-best has a NER component (the rules sessions only have the entity ruler)."""
     try:
-        # Run the command
-        result = subprocess.run(command, check=True, capture_output=True, text=True)
+      with open(os.path.join(get_best_model_path(training_session_id),"meta.json"), 'r') as f:
+        return "ner" in (json.load(f).get('pipeline') or [])
+    except (OSError, ValueError):
+      return False
 
-        # Print the output (optional)
-        print("STDOUT:")
-        print(result.stdout)
-        print("STDERR:")
-        print(result.stderr)
 
-        if result.stderr:
-           try_to_delete_session_folder(directory_path)
-           abort(400, message=f'Error while training the model."')
+def get_retrain_lineage(base_training_session_id, data_mode, train_count, test_count):
+    """Lineage of a retrained session: the base session, its own ancestors (newest first) and the rows added."""
+    ancestors = [base_training_session_id]
+    try:
+      with open(os.path.join(get_best_model_path(base_training_session_id),"meta.json"), 'r') as f:
+        base_lineage = json.load(f).get('lineage') or {}
+      ancestors.extend(base_lineage.get('ancestors', []))
+    except (OSError, ValueError):
+      pass
+    return {'base_training_session_id': base_training_session_id,
+            'ancestors': ancestors,
+            'data_mode': data_mode,
+            'new_train_examples': train_count,
+            'new_test_examples': test_count}
 
-    except subprocess.CalledProcessError as e:
-        print(f"Error executing command: {e}")
-        print(f"STDOUT: {e.stdout}")
-        print(f"STDERR: {e.stderr}")
-        try_to_delete_session_folder(directory_path)
-        abort(400, message=f'Error while training the model STDERR:"{e.stderr}; STDOUT:{e.stdout}"')
 
+def copy_session_corpus(training_session_id, train_path, test_path):
+    """Copies the train and test DocBin shards of a session in a base folder of the corpus folders (SpaCy reads the folders recursively,
+       so a retrain of a retrain includes all the previous rows). Returns False when the session has no corpus (trained before the shards were kept)."""
+    directory_path = os.path.join("model_train_sessions",training_session_id)
+    base_train_path = os.path.join(directory_path,"train")
+    base_test_path = os.path.join(directory_path,"test")
+    if not (os.path.isdir(base_train_path) and os.path.isdir(base_test_path)):
+      return False
+    shutil.copytree(base_train_path, os.path.join(train_path,"base"))
+    shutil.copytree(base_test_path, os.path.join(test_path,"base"))
+    return True
+
+
+TRAINING_CSV_CHUNK_SIZE = int(os.environ.get("TRAINING_CSV_CHUNK_SIZE", 10000))
+TRAINING_TEST_SIZE = 0.3
+TRAINING_SPLIT_RANDOM_STATE = 42
+TAG_SUFFIX = "__TAG" 
+#part of the key of the corpus cache, to be increased when a change of the split, create_entity_spans, massage_data or get_doc_bin changes the shards
+TRAINING_PREPROCESS_VERSION = 2
+#processes building the shards of the files with more than one chunk (1 builds them in the training job thread)
+TRAINING_PREPROCESS_WORKERS = int(os.environ.get("TRAINING_PREPROCESS_WORKERS", min(os.cpu_count() or 1, 4)))
+
+def get_training_corpus(csv_path, unstructured_column_name, train_path, test_path, chunk_size=TRAINING_CSV_CHUNK_SIZE):
+    """Writes the train/test corpus of a training CSV, from the corpus cache when the same CSV was already preprocessed
+       with the same parameters (see apis/corpus_cache.py). Returns a tuple with the number of train and test documents and
+       if the corpus came from the cache."""
+    import spacy
+
+    with stage_timer('training', 'corpus_cache_lookup'):
+      corpus_key = corpus_cache.make_key(csv_path, unstructured_column_name, chunk_size, TRAINING_TEST_SIZE, TRAINING_SPLIT_RANDOM_STATE,
+                                         TRAINING_PREPROCESS_VERSION, spacy.__version__)
+      manifest = corpus_cache.restore(corpus_key, train_path, test_path)
+    if manifest is not None:
+      return manifest['train_count'], manifest['test_count'], True
+
+    train_count, test_count = build_training_corpus(csv_path, unstructured_column_name, train_path, test_path, chunk_size)
+    corpus_cache.store(corpus_key, train_path, test_path, {'train_count': train_count, 'test_count': test_count})
+    return train_count, test_count, False
+
+
+def build_training_corpus(csv_path, unstructured_column_name, train_path, test_path, chunk_size=TRAINING_CSV_CHUNK_SIZE):
+    """Reads the training CSV in chunks and writes the train/test corpus as folders of DocBin shards (one shard per chunk).
+       The spacy corpus reader accepts a folder, so memory stays bounded by the chunk size regardless of the file size.
+       When the file has several chunks, they are built in TRAINING_PREPROCESS_WORKERS processes.
+       Returns a tuple with the number of train and test documents."""
+    import pandas as pd
+
+    os.makedirs(train_path, exist_ok=True)
+    os.makedirs(test_path, exist_ok=True)
+
+    train_count = 0
+    test_count = 0
+    executor = None
+    pending = deque()
+
+    def add_counts(counts):
+      nonlocal train_count, test_count
+      train_count += counts[0]
+      test_count += counts[1]
 
-    except FileNotFoundError:
-        print("Error: Could not find the 'spacy' executable. Make sure spaCy is installed and accessible in your environment.")
-        try_to_delete_session_folder(directory_path)
-        abort(400, message=f'Error while training the model."')
+    try:
+      chunks = pd.read_csv(filepath_or_buffer=csv_path,sep=",",dtype=str,chunksize=chunk_size)
+      for shard_index, data_frame_chunk in enumerate(timed_iterator(chunks, 'training', 'csv_parse')):
+        #a file with a single chunk does not pay the start of the processes
+        if shard_index == 1 and TRAINING_PREPROCESS_WORKERS > 1:
+          executor = get_preprocess_executor()
+        if executor is None:
+          add_counts(build_corpus_shard(data_frame_chunk, shard_index, unstructured_column_name, train_path, test_path))
+          continue
+        pending.append(executor.submit(build_corpus_shard_in_worker, data_frame_chunk, shard_index, unstructured_column_name, train_path, test_path))
+        #bounded number of chunks in memory
+        while len(pending) > TRAINING_PREPROCESS_WORKERS * 2:
+          add_counts(pending.popleft().result())
+      while pending:
+        add_counts(pending.popleft().result())
+    except pd.errors.ParserError as e:
+      raise TrainingError(f"The submitted file is an invalid CSV. Error message: {e}")
+    finally:
+      if executor is not None:
+        executor.shutdown(cancel_futures=True)
+
+    if train_count == 0 or test_count == 0:
+      raise TrainingError("The submitted csv file does not have enough rows to create the train and test data sets.")
+
+    return train_count, test_count
+
+
+def get_preprocess_executor():
+    """Pool of processes that build the corpus shards. The processes are started with spawn (not forked from the threaded API)
+       and run with a lower priority, as the training worker processes."""
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    return ProcessPoolExecutor(max_workers=TRAINING_PREPROCESS_WORKERS,
+                               mp_context=multiprocessing.get_context("spawn"),
+                               initializer=set_preprocess_priority)
+
+
+def set_preprocess_priority():
+    if TRAINING_NICENESS and hasattr(os, "nice"):
+      os.nice(TRAINING_NICENESS)
+
+
+def build_corpus_shard_in_worker(data_frame_chunk, shard_index, unstructured_column_name, train_path, test_path):
+    """build_corpus_shard in a preprocessing process. The errors are sent back as TrainingError (abort() raises HTTP exceptions with the message in data)."""
+    try:
+      return build_corpus_shard(data_frame_chunk, shard_index, unstructured_column_name, train_path, test_path)
+    except Exception as e:
+      data = getattr(e, 'data', None)
+      raise TrainingError((data.get('message') if isinstance(data, dict) else None) or str(e))
+
+
+def is_test_row(row_indexes, test_size=TRAINING_TEST_SIZE, random_state=TRAINING_SPLIT_RANDOM_STATE):
+    """Boolean array, True for the rows of the test set. Every row goes to the test set by a hash of its position in the CSV
+       (and the random state), so the split is the same for any chunk size: a chunk sees only its own rows.
+       The first row is always a train row and the second a test row, so the files with two rows have both sets."""
+    import numpy as np
+
+    #splitmix64 of the row position, the integer overflows wrap around
+    hashes = (np.asarray(row_indexes, dtype=np.uint64) + np.uint64(random_state)) * np.uint64(0x9E3779B97F4A7C15)
+    hashes = (hashes ^ (hashes >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    hashes = (hashes ^ (hashes >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    hashes = hashes ^ (hashes >> np.uint64(31))
+    test_rows = (hashes >> np.uint64(11)).astype(np.float64) / float(1 << 53) < test_size
+    positions = np.asarray(row_indexes)
+    test_rows[positions == 0] = False
+    test_rows[positions == 1] = True
+    return test_rows
+
+
+def build_corpus_shard(data_frame_chunk, shard_index, unstructured_column_name, train_path, test_path):
+    """Splits a chunk of the training CSV and writes its train and test DocBin shards. Returns a tuple with the number of train and test documents.
+       The index of the chunk is the position of its rows in the CSV (pandas keeps counting between chunks), see is_test_row."""
+    import spacy
+
+    column_list = data_frame_chunk.columns.to_list()
+    fragment_columns = [column for column in column_list if column != unstructured_column_name]
+    fragment_tag_columns = [column + TAG_SUFFIX for column in fragment_columns]
+
+    test_rows = is_test_row(data_frame_chunk.index)
+    X_train, X_test = data_frame_chunk[~test_rows], data_frame_chunk[test_rows]
+
+    nlp = spacy.blank("en")
+    shard_name = f"shard_{shard_index:05d}.spacy"
+    for data_frame, corpus_path in ((X_train, train_path), (X_test, test_path)):
+      if data_frame.empty:
+        continue
+      with stage_timer('training', 'span_creation'):
+        df_entity_spans = create_entity_spans(data_frame=data_frame.astype(str), 
+                                              tag_list= fragment_tag_columns,
+                                              text_to_parse_column=unstructured_column_name, 
+                                              tag_suffix= TAG_SUFFIX)
+      with stage_timer('training', 'doc_bin'):
+        doc_bin = get_doc_bin(data=df_entity_spans.values.tolist(),
+                              nlp=nlp)
+        doc_bin.to_disk(os.path.join(corpus_path, shard_name))
+
+    return len(X_train), len(X_test)
+
+
+#rows of the training CSV used to measure the precision and recall of a rules session
+RULES_EVALUATION_MAX_ROWS = int(os.environ.get("RULES_EVALUATION_MAX_ROWS", 5000))
+
+
+def read_rule_values(csv_path, unstructured_column_name, evaluation_max_rows=0, chunk_size=TRAINING_CSV_CHUNK_SIZE):
+    """Counts the values of the entity columns of a training CSV, normalized as the training texts (see RuleValueCollector).
+       Returns the collector and the entity spans of up to evaluation_max_rows rows."""
+    import pandas as pd
+
+    collector = RuleValueCollector(normalize=lambda value: normalize_component(value.upper()))
+    evaluation_rows = []
+    try:
+      for data_frame_chunk in pd.read_csv(filepath_or_buffer=csv_path,sep=",",dtype=str,chunksize=chunk_size):
+        entity_columns = [column for column in data_frame_chunk.columns.to_list() if column != unstructured_column_name]
+        collector.add(data_frame_chunk, entity_columns)
+        remaining_rows = evaluation_max_rows - len(evaluation_rows)
+        if remaining_rows > 0:
+          evaluation_rows.extend(create_entity_spans(data_frame=data_frame_chunk.iloc[:remaining_rows].astype(str),
+                                                     tag_list=[column + TAG_SUFFIX for column in entity_columns],
+                                                     text_to_parse_column=unstructured_column_name,
+                                                     tag_suffix=TAG_SUFFIX))
+    except pd.errors.ParserError as e:
+      raise TrainingError(f"The submitted file is an invalid CSV. Error message: {e}")
+    return collector, evaluation_rows
+
+
+def get_rule_patterns(rule_values, rule_columns):
+    """Labels and phrase patterns of the rule columns (the closed vocabulary columns by default)."""
+    try:
+      labels = rule_values.select_labels(rule_columns)
+    except ValueError as e:
+      raise TrainingError(str(e))
+    if not labels:
+      raise TrainingError("None of the entity columns has a closed vocabulary. Choose the rule columns.")
+    return labels, rule_values.build_patterns(labels)
+
+
+def build_rule_session(model_path, csv_path, unstructured_column_name, rule_columns=None):
+    """Builds a pipeline with only an entity ruler from the values of the rule columns, evaluates it with the rows of the CSV
+       and saves it as the model-best of a session. Returns the description of the rules."""
+    import spacy
+    from spacy.training import Example
+    from spacy.util import filter_spans
+
+    rule_values, evaluation_rows = read_rule_values(csv_path, unstructured_column_name, evaluation_max_rows=RULES_EVALUATION_MAX_ROWS)
+    labels, patterns = get_rule_patterns(rule_values, rule_columns)
+
+    nlp = spacy.blank("en")
+    add_entity_ruler(nlp, patterns)
+
+    #the expected entities are the spans of the rule columns, filtered the same way as the training corpus (see get_doc_bin)
+    examples = []
+    for text, spans in evaluation_rows:
+      reference = nlp.make_doc(text)
+      reference.ents = filter_spans([span for span in (reference.char_span(start, end, label=label) for start, end, label in spans if label in labels) if span is not None])
+      examples.append(Example(nlp.make_doc(text), reference))
+    if examples:
+      scores = nlp.evaluate(examples)
+      nlp.meta['performance'] = {key: scores[key] for key in ('ents_f', 'ents_p', 'ents_r', 'ents_per_type')}
+
+    os.makedirs(os.path.dirname(model_path), exist_ok=True)
+    nlp.to_disk(model_path)
+    return {'labels': labels, 'patterns': len(patterns), 'phrase_matcher_attr': RULES_PHRASE_MATCHER_ATTR,
+            'ahead_of_ner': False, 'evaluation_rows': len(examples)}
 
-    edit_training_session_metadata(training_session_id=training_session_id,
-                                   training_description=training_description)
-    
-    return get_training_session_data(training_session_id)
+
+def add_rules_to_model(model_path, rule_values, rule_columns=None):
+    """Adds an entity ruler built from the values of the rule columns ahead of the NER of a trained model. Returns the description of the rules."""
+    import spacy
+
+    labels, patterns = get_rule_patterns(rule_values, rule_columns)
+    nlp = spacy.load(model_path)
+    add_entity_ruler(nlp, patterns, before="ner" if "ner" in nlp.pipe_names else None)
+    nlp.to_disk(model_path)
+    return {'labels': labels, 'patterns': len(patterns), 'phrase_matcher_attr': RULES_PHRASE_MATCHER_ATTR, 'ahead_of_ner': True}
 
 
 train_ner_payload = reqparse.RequestParser()
 train_ner_payload.add_argument('text_to_check', type=str, required=True, help='Text that will be used to perform NER', location='form')
 train_ner_payload.add_argument('training_session_id', type=str, required=True, help='Training session id obtained from listing the trainings.', location='form')
+train_ner_payload.add_argument('normalize_text', type=inputs.boolean, required=False, location='form',
+                               help=f'Normalize the text as the training texts (upper case, punctuation) before the NER. The model sees the normalized text: the returned Entity Text and Start/End Index refer to the normalized text, not to the submitted one. Defaults to {INFERENCE_NORMALIZE_TEXT}.')
 
 
 
 @namespace_ner_train.route("/perform_ner")
 @namespace_ner_train.response(400, 'Invalid data.')
+@namespace_ner_train.response(409, 'The session is still training.')
 @namespace_ner_train.response(500, 'Internal errors.')
 @namespace_ner_train.expect(train_ner_payload)
 class PerformNer(Resource):
    def post(self):
-      """Perform NER given a trained SpaCy model (session_ID)"""
+      """Perform NER given a trained SpaCy model (session_ID)
+      With normalize_text, the NER runs on the text normalized as the training texts (massage_data) and the returned entity texts and indexes refer to the normalized text."""
       
       args = train_ner_payload.parse_args()  # Parse and extract the arguments
       training_session_id = args['training_session_id']
@@ -223,34 +849,269 @@ class PerformNer(Resource):
       if not training_session_id:
          abort(400, f"Training Session ID is required.")      
 
-      res = get_training_session_data(training_session_id)
-      if not res.is_valid:
-         abort(400, f"Session with id {training_session_id} is missing or invalid.")   
+      with stage_timer('spacy', 'session_lookup'):
+         res = get_training_session_data(training_session_id)
+      abort_if_session_not_ready(res)
 
       text_to_check = args['text_to_check']
       if not text_to_check:
          abort(400, message="Text to check is required.") 
 
-      directory_path = os.path.join("model_train_sessions",training_session_id, "models","model-best")
+      try:
+         with stage_timer('spacy', 'inference'):
+            _, results = perform_session_ner(training_session_id, [text_to_check], args['normalize_text'])
+            result = results[0]
+      except Exception as e:
+         abort(500, message=f"Errors found while performing NER with the session model. Error Message {e}") 
+    
+      return result
+
+
+def get_entities(document):
+   '''List of entities found in a SpaCy document, in the format returned by the perform NER endpoints.'''
+   return [{'Entity Label:': ent.label_,
+            'Entity Text': ent.text,                    
+            'Entity Start Index': ent.start_char, 
+            'Entity End Index':ent.end_char} for ent in document.ents]
+
+
+#worker processes for the NER of the trained models (disabled unless INFERENCE_WORKERS is set)
+inference_pool = InferencePool(get_entities)
 
+
+def perform_session_ner(training_session_id, texts, normalize_text=None):
+   '''Texts sent to the model (normalized with massage_data when asked) and their entities, in the same order.
+      The cached and repeated texts are not processed again, the others run in the inference worker processes when the pool is enabled.'''
+   if normalize_text is None:
+      normalize_text = INFERENCE_NORMALIZE_TEXT
+   if normalize_text:
+      texts = [massage_data(text) for text in texts]
+   return texts, inference_cache.perform_ner(training_session_id, texts, inference_pool.perform_ner)
+
+
+def list_recent_sessions(limit):
+   '''Ids of the most recent valid sessions.'''
+   sessions, total = session_index.list(limit=limit, is_valid=True)
+   return [session['training_session_id'] for session in sessions]
+
+
+def start_inference_pool():
+   '''Forks the inference worker processes, after loading the models of the sessions in INFERENCE_PRELOAD_SESSIONS so they are shared by the workers.'''
+   inference_pool.start(get_preload_sessions(list_recent_sessions))
+
+
+def preload_session_models():
+   '''Loads the models of the sessions in INFERENCE_PRELOAD_SESSIONS in the model registry (warm up).'''
+   for training_session_id in get_preload_sessions(list_recent_sessions):
       try:
-         nlp=spacy.load(directory_path)
+         model_registry.get(training_session_id)
       except Exception as e:
-         abort(500, message=f"Errors found while loading the session model. Error Message {e}") 
+         print(f"Unable to preload the model of the session {training_session_id}: {e}")
 
-      document = nlp(text_to_check)
-      entities =[{'Entity Label:': ent.label_,
-                                 'Entity Text': ent.text,                    
-                                 'Entity Start Index': ent.start_char, 
-                                 'Entity End Index':ent.end_char} for ent in document.ents]
 
-      result = entities    
-    
-      return result
+BATCH_DEFAULT_SIZE = 256
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", 10000))
+#every process is a fork of the API process with its own copy of the model, a request can not ask for more than this
+BATCH_MAX_PROCESSES = int(os.environ.get("BATCH_MAX_PROCESSES", 2))
+
+batch_ner_payload = namespace_ner_train.model("BatchNerRequestPayload",{
+  'training_session_id': fields.String(required=True, description='Training session id obtained from listing the trainings.'),
+  'texts': fields.List(fields.String(required=True), required=True, description='Texts that will be used to perform NER.'),
+  'batch_size': fields.Integer(required=False, description=f'Number of texts processed together by SpaCy, between 1 and {BATCH_MAX_SIZE}. Defaults to {BATCH_DEFAULT_SIZE}.'),
+  'n_process': fields.Integer(required=False, description=f'Number of processes used by SpaCy, limited by {BATCH_MAX_PROCESSES}. Defaults to 1 (with more processes the results are not cached). Ignored when the inference workers run.'),
+  'normalize_text': fields.Boolean(required=False, description=f'Normalize the texts as the training texts (upper case, punctuation) before the NER. The model sees the normalized texts: the text of every result line and its Entity Text and Start/End Index are the normalized ones, not the submitted ones. Defaults to {INFERENCE_NORMALIZE_TEXT}.'),
+})
+
+batch_ner_file_payload = reqparse.RequestParser()
+batch_ner_file_payload.add_argument('file', type=FileStorage, location='files', required=True, help='File with the texts (CSV or NDJSON).')
+batch_ner_file_payload.add_argument('training_session_id', type=str, required=True, help='Training session id obtained from listing the trainings.', location='form')
+batch_ner_file_payload.add_argument('text_column', type=str, required=False, location='form',
+                                    help='CSV: name of the column with the texts (defaults to the first column). NDJSON: key with the text when the lines are objects (defaults to "text").')
+batch_ner_file_payload.add_argument('batch_size', type=int, required=False, location='form', help=f'Number of texts processed together by SpaCy, between 1 and {BATCH_MAX_SIZE}. Defaults to {BATCH_DEFAULT_SIZE}.')
+batch_ner_file_payload.add_argument('n_process', type=int, required=False, location='form', help=f'Number of processes used by SpaCy, limited by {BATCH_MAX_PROCESSES}. Defaults to 1 (with more processes the results are not cached). Ignored when the inference workers run.')
+batch_ner_file_payload.add_argument('normalize_text', type=inputs.boolean, required=False, location='form',
+                                    help=f'Normalize the texts as the training texts (upper case, punctuation) before the NER. The model sees the normalized texts: the text of every result line and its Entity Text and Start/End Index are the normalized ones, not the submitted ones. Defaults to {INFERENCE_NORMALIZE_TEXT}.')
+
+
+@namespace_ner_train.route("/perform_ner_batch")
+@namespace_ner_train.response(400, 'Invalid data.')
+@namespace_ner_train.response(409, 'The session is still training.')
+@namespace_ner_train.response(500, 'Internal errors.')
+@namespace_ner_train.expect(batch_ner_payload)
+class PerformNerBatch(Resource):
+   def post(self):
+      """Perform NER on a list of texts given a trained SpaCy model (session_ID). The results are streamed as NDJSON in the same order as the input."""
+      payload = namespace_ner_train.payload or {}
+
+      texts = payload.get('texts')
+      if not texts:
+         abort(400, message="Texts node is required.")
+
+      if type(texts) is not list:
+         abort(400, message="Texts node expected to be a list.")
+
+      return stream_batch_ner(training_session_id=payload.get('training_session_id'),
+                              texts=(str(text) if text is not None else '' for text in texts),
+                              batch_size=payload.get('batch_size'),
+                              n_process=payload.get('n_process'),
+                              normalize_text=payload.get('normalize_text'))
+
+
+@namespace_ner_train.route("/perform_ner_batch_file")
+@namespace_ner_train.response(400, 'Invalid data.')
+@namespace_ner_train.response(409, 'The session is still training.')
+@namespace_ner_train.response(500, 'Internal errors.')
+@namespace_ner_train.expect(batch_ner_file_payload)
+class PerformNerBatchFile(Resource):
+   def post(self):
+      """Perform NER on the texts of a CSV or NDJSON file given a trained SpaCy model (session_ID). The results are streamed as NDJSON in the same order as the input."""
+      args = batch_ner_file_payload.parse_args()
+      uploaded_file = args['file']
+
+      if not uploaded_file:
+         abort(400, message="A file was expected in the request.")
+
+      file_name = uploaded_file.filename.lower()
+      if file_name.endswith('.csv'):
+         texts = read_csv_texts(uploaded_file, args['text_column'])
+      elif file_name.endswith('.ndjson') or file_name.endswith('.jsonl'):
+         texts = read_ndjson_texts(uploaded_file, args['text_column'] or 'text')
+      else:
+         abort(400, message="The file provided in the request was expected to be a file with extension CSV, NDJSON or JSONL.")
+
+      return stream_batch_ner(training_session_id=args['training_session_id'],
+                              texts=texts,
+                              batch_size=args['batch_size'],
+                              n_process=args['n_process'],
+                              normalize_text=args['normalize_text'])
+
+
+def read_csv_texts(uploaded_file, text_column, chunk_size=10000):
+   '''Generator of texts from a CSV file. The file is read in chunks to keep memory bounded.
+      The header is validated before returning, so errors can be reported before the streaming starts.'''
+   import pandas as pd
+
+   try:
+      reader = pd.read_csv(filepath_or_buffer=uploaded_file, sep=",", dtype=str, keep_default_na=False, chunksize=chunk_size)
+      first_chunk = next(reader, None)
+   except Exception as e:
+      abort(400, message=f"The submitted file is an invalid CSV. Error message: {e}")
+
+   if first_chunk is None:
+      abort(400, message="The submitted CSV file has no rows.")
+
+   column_list = first_chunk.columns.to_list()
+   text_column = text_column or column_list[0]
+   if text_column not in column_list:
+      abort(400, message=f'The submitted csv file is missing the column with name "{text_column}"')
+
+   def generate():
+      yield from first_chunk[text_column].tolist()
+      for chunk in reader:
+         yield from chunk[text_column].tolist()
+
+   return generate()
+
+
+def read_ndjson_texts(uploaded_file, text_key):
+   '''Generator of texts from a NDJSON file. Each line can be a JSON string or an object with the text in text_key.
+      Every line is parsed once before returning, so a malformed line is reported (400) before the streaming starts,
+      instead of ending the stream and losing the results of the lines before it.'''
+   for line_number, line in enumerate(uploaded_file.stream, start=1):
+      line = line.strip()
+      if not line:
+         continue
+      try:
+         json.loads(line)
+      except ValueError as e:
+         abort(400, message=f"The submitted NDJSON file has an invalid line {line_number}. Error message: {e}")
+   uploaded_file.stream.seek(0)
+
+   def generate():
+      for line in uploaded_file.stream:
+         line = line.strip()
+         if not line:
+            continue
+         item = json.loads(line)
+         if isinstance(item, dict):
+            item = item.get(text_key, '')
+         yield str(item) if item is not None else ''
+
+   return generate()
+
+
+def stream_batch_ner(training_session_id, texts, batch_size=None, n_process=None, normalize_text=None):
+   '''Validates the batch request and returns a streamed NDJSON response with one line per text (nlp.pipe keeps the input order).'''
+   if not training_session_id:
+      abort(400, message="Training Session ID is required.")
+
+   with stage_timer('spacy', 'session_lookup'):
+      res = get_training_session_data(training_session_id)
+   abort_if_session_not_ready(res)
+
+   batch_size = BATCH_DEFAULT_SIZE if batch_size is None else batch_size
+   if isinstance(batch_size, bool) or not isinstance(batch_size, int) or batch_size < 1 or batch_size > BATCH_MAX_SIZE:
+      abort(400, message=f"Batch size expected to be an integer between 1 and {BATCH_MAX_SIZE}.")
+
+   n_process = 1 if n_process is None else n_process
+   if isinstance(n_process, bool) or not isinstance(n_process, int) or n_process < 1:
+      abort(400, message="Number of processes expected to be an integer greater than zero.")
+   #the inference workers already spread the NER over several processes
+   n_process = 1 if inference_pool.enabled else min(n_process, BATCH_MAX_PROCESSES)
+
+   #the batches go through the result cache (and the inference worker processes), unless the request asks for its own SpaCy processes
+   if n_process == 1:
+      def generate():
+         index = 0
+         try:
+            for batch in iterate_batches(texts, batch_size):
+               with stage_timer('spacy', 'batch_inference'):
+                  batch, batch_entities = perform_session_ner(training_session_id, batch, normalize_text)
+               for text, entities in zip(batch, batch_entities):
+                  yield json.dumps({'index': index, 'text': text, 'entities': entities}) + "\n"
+                  index += 1
+         except Exception as e:
+            #the response already started, report the error as the last line
+            yield json.dumps({'error': f"Errors found while performing NER. Error Message {e}"}) + "\n"
+
+      return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+   try:
+      nlp=model_registry.get(training_session_id)
+   except Exception as e:
+      abort(500, message=f"Errors found while loading the session model. Error Message {e}")
+
+   if normalize_text is None:
+      normalize_text = INFERENCE_NORMALIZE_TEXT
+   if normalize_text:
+      texts = (massage_data(text) for text in texts)
+
+   def generate():
+      try:
+         documents = timed_iterator(nlp.pipe(texts, batch_size=batch_size, n_process=n_process), 'spacy', 'pipe_document')
+         for index, document in enumerate(documents):
+            yield json.dumps({'index': index, 'text': document.text, 'entities': get_entities(document)}) + "\n"
+      except Exception as e:
+         #the response already started, report the error as the last line
+         yield json.dumps({'error': f"Errors found while performing NER. Error Message {e}"}) + "\n"
+
+   return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def iterate_batches(texts, batch_size):
+   '''Groups an iterable of texts in lists of batch_size texts.'''
+   batch = []
+   for text in texts:
+      batch.append(text)
+      if len(batch) >= batch_size:
+         yield batch
+         batch = []
+   if batch:
+      yield batch
 
 
       
-def edit_training_session_metadata(training_session_id, training_description):
+def edit_training_session_metadata(training_session_id, training_description, training_timings=None, training_profile=None, training_stats=None, lineage=None, rules=None):
    """Add some more metadata to the json file of a training session."""
    directory_path = os.path.join("model_train_sessions",training_session_id)
    best_model_path = os.path.join(directory_path,"models","model-best")
@@ -266,11 +1127,23 @@ def edit_training_session_metadata(training_session_id, training_description):
    # Add or update the date_created field in the metadata
    data['date_created'] = formatted_today
    data['training_description'] = training_description
+   if training_timings:
+      data['training_timings'] = training_timings
+   if training_profile:
+      data['training_profile'] = training_profile
+   if training_stats:
+      data['training_stats'] = training_stats
+   if lineage:
+      data['lineage'] = lineage
+   if rules:
+      data['rules'] = rules
    
    #write the updated metadata back to the file
    with open(meta_data_file, 'w') as f:      
       json.dump(data, f, indent=4) 
 
+   session_index.upsert_from_disk(training_session_id)
+
 
 def get_training_session_data(training_session_id):
   """Retrieves an validates all the training session metadata given a training session id.
@@ -281,6 +1154,13 @@ def get_training_session_data(training_session_id):
     res.is_valid = False
     res.invalid_message = f"Session with path {directory_path} does not exits."
     return res 
+
+  #while the job runs, model-best is a checkpoint of the training (SpaCy writes it at every better evaluation)
+  job = training_job_queue.get(training_session_id)
+  if job and job.status != STATUS_SUCCEEDED:
+    res.training_status = job.status
+    res.invalid_message = f"The training of the session is {job.status}."
+    return res
     
   best_model_path = os.path.join(directory_path,"models","model-best")
   if not os.path.exists(best_model_path):
@@ -298,11 +1178,12 @@ def get_training_session_data(training_session_id):
         json_data = json.load(file)
         labels_node = json_data['labels']     
         if labels_node:
-            ner_node = labels_node['ner']
+            #the sessions built from rules only have the labels of the entity ruler
+            ner_node = labels_node.get('ner') or labels_node.get(ENTITY_RULER_NAME)
             if ner_node:
               res.ner_fields = ner_node
 
-        performance_node = json_data['performance']  
+        performance_node = json_data.get('performance')  
         if performance_node:
             res.performance = performance_node 
 
@@ -316,41 +1197,109 @@ def get_training_session_data(training_session_id):
 
 
 
+def abort_if_session_not_ready(res, status_code=400):
+  """Aborts the request when a session (NerTrainingSession) can not be used: 409 while its training job is queued or running,
+     status_code when it is missing or invalid."""
+  if res.training_status in (STATUS_QUEUED, STATUS_RUNNING):
+    abort(409, message=f"The training of the session {res.training_session_id} is {res.training_status}. Use the training status endpoint to know when it finishes.")
+  if not res.is_valid:
+    abort(status_code, message=f"Session with id {res.training_session_id} is missing or invalid.")
+
+
+#index of the sessions metadata used for listing the sessions
+session_index = SessionIndex("model_train_sessions", get_training_session_data)
+
+
+def on_training_job_finished(job):
+  """Indexes the final state of a session, it was indexed as not ready while its job was queued or running.
+     The models loaded from the checkpoints of the training (if any) and their cached results are dropped."""
+  model_registry.invalidate(job.training_session_id)
+  inference_pool.invalidate(job.training_session_id)
+  inference_cache.purge(job.training_session_id)
+  if job.status == STATUS_SUCCEEDED:
+    session_index.upsert_from_disk(job.training_session_id)
+  else:
+    session_index.remove(job.training_session_id)
+
+
+training_job_queue.finished_callbacks.append(on_training_job_finished)
+
+
 class NerTrainingSession:
    
    def __init__(self, training_session_id, is_valid=False):
       self.training_session_id = training_session_id
       self.is_valid = is_valid      
       self.invalid_message = ''
+      #status of the training job while the session is not ready (queued, running or failed), None otherwise
+      self.training_status = None
       self.ner_fields = []
       self.performance = None
       self.date_created = '' 
       self.training_description = ''   
 
+session_list_parser = reqparse.RequestParser()
+session_list_parser.add_argument('page', type=int, required=False, location='args', help='Page number (starting at 1). All the sessions are returned when not provided.')
+session_list_parser.add_argument('page_size', type=int, required=False, location='args', help='Number of sessions per page. Defaults to 50 when a page is requested.')
+session_list_parser.add_argument('date_from', type=str, required=False, location='args', help='Only sessions created on or after this date (YYYY-MM-DD).')
+session_list_parser.add_argument('date_to', type=str, required=False, location='args', help='Only sessions created on or before this date (YYYY-MM-DD).')
+session_list_parser.add_argument('description', type=str, required=False, location='args', help='Only sessions with a training description containing this text.')
+session_list_parser.add_argument('is_valid', type=inputs.boolean, required=False, location='args', help='Only valid (true) or invalid (false) sessions.')
+session_list_parser.add_argument('rebuild_index', type=inputs.boolean, required=False, location='args', help='Rebuild the sessions index from disk before listing.')
+
+SESSION_LIST_DEFAULT_PAGE_SIZE = 50
+
 @namespace_ner_train.route("/session/")
 class SessionProfile(Resource):
+   @namespace_ner_train.expect(session_list_parser)
+   @namespace_ner_train.response(400, 'Invalid request.')
    @namespace_ner_train.marshal_list_with(training_session_model)
    def get(self):
-      """Get a list of training session metadata."""   
-      directory_path = os.path.join("model_train_sessions")  
-      if not os.path.exists(directory_path):
-         return []
-      
-      folders = []
-      for item in os.listdir(directory_path):
-         item_path = os.path.join(directory_path, item)
-         if os.path.isdir(item_path):
-            folders.append(item)
-  
-
-      return [get_training_session_data(training_session_id) for training_session_id in folders]
+      """Get a list of training session metadata (newest first). The total number of sessions that match the filters is returned in the X-Total-Count header."""   
+      args = session_list_parser.parse_args()
+
+      date_from = parse_date_argument(args['date_from'], 'date_from')
+      date_to = parse_date_argument(args['date_to'], 'date_to')
+      if date_to:
+         date_to += timedelta(days=1)
+
+      page = args['page']
+      page_size = args['page_size']
+      offset, limit = 0, None
+      if page is not None or page_size is not None:
+         page = page or 1
+         page_size = page_size or SESSION_LIST_DEFAULT_PAGE_SIZE
+         if page < 1 or page_size < 1:
+            abort(400, message="Page and page size expected to be greater than zero.")
+         offset, limit = (page - 1) * page_size, page_size
+
+      if args['rebuild_index']:
+         session_index.sync(force=True)
+
+      sessions, total = session_index.list(offset=offset, 
+                                           limit=limit, 
+                                           date_from=date_from, 
+                                           date_to=date_to, 
+                                           description=args['description'], 
+                                           is_valid=args['is_valid'])
+      return sessions, 200, {'X-Total-Count': str(total)}
+
+
+def parse_date_argument(value, name):
+   """Parse a YYYY-MM-DD query argument. Aborts the request when the date is invalid."""
+   if not value:
+      return None
+   try:
+      return datetime.strptime(value, "%Y-%m-%d")
+   except ValueError:
+      abort(400, message=f"{name} expected to be a date with format YYYY-MM-DD.")
             
 
 
-
 @namespace_ner_train.route("/session/<training_session_id>")
 @namespace_ner_train.param('training_session_id', 'Training session id obtained from the train process.')
 @namespace_ner_train.response(401, 'Invalid session id.')
+@namespace_ner_train.response(409, 'The session is still training.')
 class SessionProfile(Resource):
    @namespace_ner_train.marshal_with(training_session_model)
    def get(self,training_session_id):
@@ -360,8 +1309,7 @@ class SessionProfile(Resource):
        abort(401, f"Training Session ID is required.")  
 
       res = get_training_session_data(training_session_id)
-      if not res.is_valid:
-         abort(401, f"Session with id {training_session_id} is missing or invalid.") 
+      abort_if_session_not_ready(res, status_code=401)
       
       return res
    
@@ -376,7 +1324,13 @@ class SessionProfile(Resource):
       if not os.path.exists(dir_to_remove):
          abort(401, f"Session with id {training_session_id} is not found.") 
 
+      model_registry.invalidate(training_session_id)
+      inference_pool.invalidate(training_session_id)
+      inference_cache.purge(training_session_id)
+      training_job_queue.pop(training_session_id)
       success = try_to_delete_session_folder(dir_to_remove)
+      if success:
+         session_index.remove(training_session_id)
       return {'success':success}
 
       
@@ -384,6 +1338,84 @@ class SessionProfile(Resource):
    
 
 
+model_cache_stats_model = namespace_ner_train.model("model_cache_stats",{
+  'hits': fields.Integer(description='Number of requests served with an already loaded model.'),
+  'misses': fields.Integer(description='Number of requests that required loading the model from disk.'),
+  'evictions': fields.Integer(description='Number of models removed from memory to honor the cache limits.'),
+  'models_loaded': fields.Integer(description='Number of models currently in memory.'),
+  'loaded_bytes': fields.Integer(description='Approximate size of the models currently in memory.'),
+  'max_models': fields.Integer(description='Maximum number of models kept in memory.'),
+  'max_bytes': fields.Integer(description='Maximum approximate size of the models kept in memory.'),
+  'training_session_ids': fields.List(fields.String(description='Loaded training sessions, least recently used first.')),
+})
+
+@namespace_ner_train.route("/model_cache")
+class ModelCacheStats(Resource):
+   @namespace_ner_train.marshal_with(model_cache_stats_model)
+   def get(self):
+      """Get the statistics of the in memory cache of trained models."""
+      return model_registry.stats()
+
+
+inference_pool_stats_model = namespace_ner_train.model("inference_pool_stats",{
+  'workers': fields.Integer(description='Number of inference worker processes (0 when the pool is disabled).'),
+  'workers_alive': fields.Integer(description='Number of inference worker processes running.'),
+  'shared_sessions': fields.List(fields.String(description='Sessions loaded before forking the workers (shared by all of them).')),
+  'fallbacks': fields.Integer(description='Requests that ran in the API process because their worker was not running.'),
+  'requests_per_worker': fields.List(fields.Integer(description='Requests served by every worker.')),
+  'in_flight_per_worker': fields.List(fields.Integer(description='Requests being served by every worker.')),
+})
+
+@namespace_ner_train.route("/inference_pool")
+class InferencePoolStats(Resource):
+   @namespace_ner_train.marshal_with(inference_pool_stats_model)
+   def get(self):
+      """Get the statistics of the inference worker processes."""
+      return inference_pool.stats()
+
+
+
+inference_cache_stats_model = namespace_ner_train.model("inference_cache_stats",{
+  'enabled': fields.Boolean(description='Indicates if the results are cached (the repeated texts of a request are processed once anyway).'),
+  'hits': fields.Integer(description='Number of texts served from the cache.'),
+  'misses': fields.Integer(description='Number of texts that were not cached.'),
+  'duplicates': fields.Integer(description='Number of texts repeated in the same request, processed once.'),
+  'evictions': fields.Integer(description='Number of results removed from memory to honor the cache limit.'),
+  'purges': fields.Integer(description='Number of times the results of a session were removed (session deleted or model changed).'),
+  'entries': fields.Integer(description='Number of results currently cached.'),
+  'max_entries': fields.Integer(description='Maximum number of results cached.'),
+  'sessions': fields.Integer(description='Number of sessions with cached results.'),
+})
+
+@namespace_ner_train.route("/inference_cache")
+class InferenceCacheStats(Resource):
+   @namespace_ner_train.marshal_with(inference_cache_stats_model)
+   def get(self):
+      """Get the statistics of the cache of NER results of the trained models."""
+      return inference_cache.stats()
+
+
+
+corpus_cache_stats_model = namespace_ner_train.model("corpus_cache_stats",{
+  'enabled': fields.Boolean(description='Indicates if the preprocessed training corpora are cached.'),
+  'hits': fields.Integer(description='Number of trainings that reused a cached corpus.'),
+  'misses': fields.Integer(description='Number of trainings that preprocessed their CSV.'),
+  'stores': fields.Integer(description='Number of corpora added to the cache.'),
+  'evictions': fields.Integer(description='Number of corpora removed to honor the size limit.'),
+  'entries': fields.Integer(description='Number of corpora currently cached.'),
+  'stored_bytes': fields.Integer(description='Size on disk of the cached corpora.'),
+  'max_bytes': fields.Integer(description='Maximum size on disk of the cached corpora.'),
+})
+
+@namespace_ner_train.route("/corpus_cache")
+class CorpusCacheStats(Resource):
+   @namespace_ner_train.marshal_with(corpus_cache_stats_model)
+   def get(self):
+      """Get the statistics of the cache of preprocessed training corpora."""
+      return corpus_cache.stats()
+
+
+
 def try_to_delete_session_folder(folder):
    '''Tries to remove a folder. No need to raise an error if unsuccess.'''
    success = False
@@ -399,68 +1431,111 @@ def try_to_delete_session_folder(folder):
    
     
 
+#patterns used to normalize the training text and the entity components
+COMMA_NOT_FOLLOWED_BY_SPACE_PATTERN = re.compile(r'(,)(?!\s)')
+NEW_LINE_PATTERN = re.compile(r'(\\n)')
+HYPHEN_PATTERN = re.compile(r'(?!\s)(-)(?!\s)')
+DOT_PATTERN = re.compile(r'\.')
+
+
 def massage_data(data):
     '''Pre process string to remove new line characters, add comma punctuations etc.'''
     data = data.upper()
-    cleansed_address1=re.sub(r'(,)(?!\s)',' ',data)
-    cleansed_address2=re.sub(r'(\\n)',' ',cleansed_address1)
-    cleansed_address3=re.sub(r'(?!\s)(-)(?!\s)',' - ',cleansed_address2)
-    cleansed_address=re.sub(r'\.','',cleansed_address3)
+    cleansed_address1=COMMA_NOT_FOLLOWED_BY_SPACE_PATTERN.sub(' ',data)
+    cleansed_address2=NEW_LINE_PATTERN.sub(' ',cleansed_address1)
+    cleansed_address3=HYPHEN_PATTERN.sub(' - ',cleansed_address2)
+    cleansed_address=DOT_PATTERN.sub('',cleansed_address3)
     return cleansed_address
   
    
 
 def create_entity_spans(data_frame,tag_list,text_to_parse_column, tag_suffix):  
-  '''Create entity spans'''
-
-  data_frame[text_to_parse_column] = data_frame[text_to_parse_column].apply(lambda x: massage_data(x))
+  '''Create entity spans. 
+  Returns a series (same index as the data frame) of tuples (text, [(start, end, label)]), with the labels in the order of tag_list.
+  All the tag columns are processed in a single pass over the rows.'''
+  import pandas as pd
 
   tag_suffix_len = len(tag_suffix)
-  for tag in tag_list:
-    original_col_name = tag[:-tag_suffix_len]
-    data_frame[original_col_name] = data_frame[original_col_name].apply(lambda x: x.upper() if x else x)
-    data_frame[tag]=data_frame.apply(lambda row:get_span(search_str=row[text_to_parse_column],
-                                                        component=row[original_col_name],
-                                                        label=original_col_name),
-                                     axis=1)
-  data_frame['EmptySpan']=data_frame.apply(lambda x: [], axis=1)
-
-  for i in tag_list:
-      data_frame['EntitySpans']=data_frame.apply(lambda row: extend_list(row['EmptySpan'],row[i]),axis=1)
-      data_frame['EntitySpans']=data_frame[['EntitySpans',text_to_parse_column]].apply(lambda x: (x.iloc[1], x.iloc[0]),axis=1)
-  return data_frame['EntitySpans']
+  labels = [tag[:-tag_suffix_len] for tag in tag_list]
+
+  texts = data_frame[text_to_parse_column].tolist()
+  components_by_label = [data_frame[label].tolist() for label in labels]
+
+  entity_spans = []
+  for row_index, text in enumerate(texts):
+    text = massage_data(text)
+    spans = []
+    for label, components in zip(labels, components_by_label):
+      component = components[row_index]
+      span = get_span(search_str=text,
+                      component=component.upper() if component else component,
+                      label=label)
+      if span:
+        spans.append(span)
+    entity_spans.append((text, spans))
+
+  return pd.Series(entity_spans, index=data_frame.index, dtype=object)
+
+
+@lru_cache(maxsize=4096)
+def normalize_component(component):
+  '''Normalize a component the same way the text is massaged (dots removed, spaces around hyphens).'''
+  #replace dot with empty space
+  component1=DOT_PATTERN.sub('',component)
+  #normalize space between hyphens
+  return HYPHEN_PATTERN.sub(' - ',component1)      
+
+
+def is_word_char(char):
+  '''Same definition of word character used by the regex \\b (unicode).'''
+  return char.isalnum() or char == '_'
+
+
+def find_whole_word(search_str, component):
+  '''Equivalent to re.search('\\b(?:' + re.escape(component) + ')\\b', search_str) using str.find, with no regex to compile.
+  Returns the tuple (start, end) of the first match or None.'''
+  if not component:
+    span = re.search(r'\b', search_str)
+    return (span.start(), span.end()) if span else None
+
+  starts_with_word = is_word_char(component[0])
+  ends_with_word = is_word_char(component[-1])
+  start = search_str.find(component)
+  while start != -1:
+    end = start + len(component)
+    #there is a word boundary when the characters at both sides are not both word (or both non word) characters
+    boundary_before = (start > 0 and is_word_char(search_str[start - 1])) != starts_with_word
+    boundary_after = (end < len(search_str) and is_word_char(search_str[end])) != ends_with_word
+    if boundary_before and boundary_after:
+      return (start, end)
+    start = search_str.find(component, start + 1)
+  return None
+
 
 def get_span(search_str = None, 
              component=None,
              label=None):
   '''Search for specified component and get the span.
   Eg: get_span(address="221 B, Baker Street, London",address_component="221",label="BUILDING_NO") would return (0,2,"BUILDING_NO")'''
+  import pandas as pd
+
   if not component or pd.isna(component) or str(component)=='NAN':
       pass
   else:
-      
-      #replace dot with empty space
-      component1=re.sub(r'\.','',component)
-      #normalize space between hyphens
-      component2=re.sub(r'(?!\s)(-)(?!\s)',' - ',component1)      
-      span=re.search('\\b(?:'+component2+')\\b',search_str)
+      span=find_whole_word(search_str, normalize_component(component))
       if (not span):
          abort(401, message=f'Error creating entity span. You may need to perform some data cleaning. Unable to find the component: "{component}" inside the string "{search_str}"')
-      return (span.start(),span.end(),label)
-  
-def extend_list(entity_list,entity):
-    if pd.isna(entity):
-        return entity_list
-    else:
-        entity_list.append(entity)
-        return entity_list
+      return (span[0],span[1],label)
     
-def get_doc_bin(data,nlp):
+def get_doc_bin(data,nlp,batch_size=1000):
     '''Create DocBin object for building training/test corpus'''
+    from spacy.tokens import DocBin
+    from spacy.util import filter_spans
+
     # the DocBin will store the example documents
     db = DocBin()
-    for text, annotations in data:
-        doc = nlp(text) #Construct a Doc object
+    #construct the Doc objects in batches, the annotations are passed along as context
+    for doc, annotations in nlp.pipe(data, as_tuples=True, batch_size=batch_size):
         ents = []        
 
         for start, end, label in annotations:           
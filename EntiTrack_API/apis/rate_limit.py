@@ -0,0 +1,75 @@
+'''
+Helpers to call external services (Google GenAI) from several threads without exceeding the quota:
+a thread safe token bucket rate limiter and a retry with exponential backoff for quota errors.
+'''
+
+import random
+import threading
+import time
+
+
+class TokenBucket:
+    '''Thread safe token bucket. Allows bursts up to capacity and refills at rate tokens per second.'''
+
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(1.0, rate))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        '''Blocks until the requested tokens are available.'''
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._last) * self.rate)
+                self._last = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+QUOTA_STATUS_CODE = 429
+QUOTA_STATUS = "RESOURCE_EXHAUSTED"
+
+
+def is_quota_error(error):
+    '''True when the error is a quota/rate limit error of the Google APIs (HTTP 429 or RESOURCE_EXHAUSTED status), or was raised
+       while handling one (LangChain wraps the errors of the Google clients). The message is not checked, it may contain any number.'''
+    seen = set()
+    while error is not None and id(error) not in seen:
+        seen.add(id(error))
+        code = getattr(error, 'code', None)
+        if callable(code):
+            #gRPC errors: code() returns a StatusCode
+            try:
+                code = code()
+            except Exception:
+                code = None
+        status = getattr(error, 'status', None)
+        if (code == QUOTA_STATUS_CODE or getattr(error, 'status_code', None) == QUOTA_STATUS_CODE
+                or getattr(code, 'name', None) == QUOTA_STATUS or status == QUOTA_STATUS):
+            return True
+        error = error.__cause__ or error.__context__
+    return False
+
+
+def call_with_backoff(func, max_retries=4, initial_backoff=1.0, max_backoff=60.0, rate_limiter=None, retry_on=is_quota_error):
+    '''Calls func, retrying with exponential backoff (and jitter) while retry_on(error) is True.
+       When a rate limiter is given, a token is acquired before every attempt.
+       Returns a tuple (result, attempts). The last error is raised when the retries are exhausted.'''
+    attempt = 0
+    while True:
+        attempt += 1
+        if rate_limiter:
+            rate_limiter.acquire()
+        try:
+            return func(), attempt
+        except Exception as e:
+            if attempt > max_retries or not retry_on(e):
+                raise
+            backoff = min(max_backoff, initial_backoff * (2 ** (attempt - 1)))
+            time.sleep(backoff * random.uniform(0.5, 1.0))
@@ -0,0 +1,158 @@
+'''
+Content addressed cache of NER results.
+The results are kept in two tiers: an in memory LRU and a local SQLite database that survives restarts.
+Both tiers expire the entries after a time to live, and the disk tier is bounded by number of entries
+(the least recently used entries are removed first). The expired entries are removed from disk every
+RESULT_CACHE_EVICTION_INTERVAL writes, and the least recently used ones in batches when the limit is passed.
+Disabled by default (RESULT_CACHE_ENABLED): a cached answer of a model is returned instead of a new one,
+so the deployments enable it when the repeated texts are expected to get the same answer.
+'''
+
+import json
+import os
+import threading
+import time
+
+from apis.cache import TTLCache, MISSING, hash_key, SQLiteConnection
+
+
+RESULT_CACHE_ENABLED = os.environ.get("RESULT_CACHE_ENABLED", "false").lower() in ("1", "true", "yes")
+RESULT_CACHE_TTL = float(os.environ.get("RESULT_CACHE_TTL", 7 * 24 * 3600))
+RESULT_CACHE_MEMORY_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_MEMORY_MAX_ENTRIES", 2048))
+RESULT_CACHE_DISK_MAX_ENTRIES = int(os.environ.get("RESULT_CACHE_DISK_MAX_ENTRIES", 100000))
+RESULT_CACHE_EVICTION_INTERVAL = int(os.environ.get("RESULT_CACHE_EVICTION_INTERVAL", 256))
+#fraction of disk_max_entries removed at once when the limit is passed, so the eviction does not run on every write
+RESULT_CACHE_EVICTION_BATCH_FRACTION = 0.05
+RESULT_CACHE_DISK_PATH = os.environ.get("RESULT_CACHE_DISK_PATH", os.path.join("result_cache", "results.sqlite"))
+
+#How a request uses the cache
+CACHE_MODE_USE = "use"          #serve from cache when possible
+CACHE_MODE_REFRESH = "refresh"  #skip the lookup, but store the new result
+CACHE_MODE_BYPASS = "bypass"    #do not read nor write the cache
+CACHE_MODES = (CACHE_MODE_USE, CACHE_MODE_REFRESH, CACHE_MODE_BYPASS)
+
+
+class ResultCache:
+
+    def __init__(self, disk_path=RESULT_CACHE_DISK_PATH, ttl=RESULT_CACHE_TTL,
+                 memory_max_entries=RESULT_CACHE_MEMORY_MAX_ENTRIES, disk_max_entries=RESULT_CACHE_DISK_MAX_ENTRIES,
+                 eviction_interval=RESULT_CACHE_EVICTION_INTERVAL):
+        self.disk_path = disk_path
+        self.ttl = ttl
+        self.disk_max_entries = disk_max_entries
+        self.eviction_interval = max(eviction_interval, 1)
+        self.memory = TTLCache(max_entries=memory_max_entries, ttl=ttl)
+        self._lock = threading.Lock()
+        self._initialized = False
+        #rows on disk, counted when the database is opened and kept up to date by the writes (recounted on every eviction)
+        self._disk_entries = 0
+        self._writes_since_eviction = 0
+        self.disk_hits = 0
+        self.disk_misses = 0
+        self.disk_evictions = 0
+
+    @staticmethod
+    def make_key(*parts):
+        '''Content address of a result (SHA-256 of everything that determines it).'''
+        return hash_key(*parts)
+
+    def get(self, key):
+        '''Returns the cached result or MISSING.'''
+        value = self.memory.get(key)
+        if value is not MISSING:
+            return value
+
+        now = time.time()
+        with self._connect() as connection:
+            row = connection.execute("SELECT value, created_at FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None or row[1] + self.ttl <= now:
+                with self._lock:
+                    self.disk_misses += 1
+                return MISSING
+            connection.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+
+        with self._lock:
+            self.disk_hits += 1
+        value = json.loads(row[0])
+        #the entry in memory expires at the same time than the one on disk
+        self.memory.set(key, value, ttl=row[1] + self.ttl - now)
+        return value
+
+    def set(self, key, value):
+        '''Stores a result (must be JSON serializable) in both tiers.'''
+        self.memory.set(key, value)
+        now = time.time()
+        serialized = json.dumps(value)
+        with self._connect() as connection:
+            inserted = connection.execute("INSERT OR IGNORE INTO results (key, value, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                                          (key, serialized, now, now)).rowcount > 0
+            if not inserted:
+                connection.execute("UPDATE results SET value = ?, created_at = ?, accessed_at = ? WHERE key = ?",
+                                   (serialized, now, now, key))
+            with self._lock:
+                self._disk_entries += inserted
+                self._writes_since_eviction += 1
+                evict = self._disk_entries > self.disk_max_entries or self._writes_since_eviction >= self.eviction_interval
+                if evict:
+                    self._writes_since_eviction = 0
+            if evict:
+                self._evict(connection, now)
+
+    def pop(self, key):
+        '''Removes a result from both tiers.'''
+        self.memory.pop(key)
+        with self._connect() as connection:
+            deleted = connection.execute("DELETE FROM results WHERE key = ?", (key,)).rowcount
+        with self._lock:
+            self._disk_entries -= max(deleted, 0)
+
+    def stats(self):
+        '''Cache statistics for both tiers.'''
+        self._initialize()
+        with self._lock:
+            disk = {'hits': self.disk_hits,
+                    'misses': self.disk_misses,
+                    'evictions': self.disk_evictions,
+                    'entries': self._disk_entries,
+                    'max_entries': self.disk_max_entries}
+        return {'memory': self.memory.stats(),
+                'disk': disk}
+
+    def _evict(self, connection, now):
+        '''Removes the expired entries, and a batch of the least recently used ones when the size limit is passed.
+           The rows are recounted, the database may be shared with other processes.'''
+        evicted = max(connection.execute("DELETE FROM results WHERE created_at <= ?", (now - self.ttl,)).rowcount, 0)
+        count = connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+        if count > self.disk_max_entries:
+            batch = max(int(self.disk_max_entries * RESULT_CACHE_EVICTION_BATCH_FRACTION), 1)
+            cursor = connection.execute("DELETE FROM results WHERE key IN (SELECT key FROM results ORDER BY accessed_at LIMIT ?)",
+                                        (min(count - self.disk_max_entries + batch, count),))
+            evicted += max(cursor.rowcount, 0)
+            count -= max(cursor.rowcount, 0)
+        with self._lock:
+            self._disk_entries = count
+            self.disk_evictions += evicted
+
+    def _connect(self):
+        '''New SQLite connection (connections are not shared between threads).'''
+        self._initialize()
+        return SQLiteConnection(self.disk_path)
+
+    def _initialize(self):
+        '''Creates the database and counts its rows the first time.'''
+        if not self._initialized:
+            with self._lock:
+                if not self._initialized:
+                    folder = os.path.dirname(self.disk_path)
+                    if folder:
+                        os.makedirs(folder, exist_ok=True)
+                    with SQLiteConnection(self.disk_path) as connection:
+                        connection.execute("PRAGMA journal_mode=WAL")
+                        connection.execute("CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+                        connection.execute("CREATE INDEX IF NOT EXISTS idx_results_accessed_at ON results (accessed_at)")
+                        connection.execute("CREATE INDEX IF NOT EXISTS idx_results_created_at ON results (created_at)")
+                        self._disk_entries = connection.execute("SELECT COUNT(*) FROM results").fetchone()[0]
+                    self._initialized = True
+
+
+genai_result_cache = ResultCache()
@@ -0,0 +1,64 @@
+'''
+Phrase patterns of an EntityRuler compiled from the entity columns of a training CSV.
+Closed vocabulary columns (state codes, countries, city names, etc.) repeat a few values over many rows, so the values
+are matched with a PhraseMatcher instead of a trained model: the session is built in seconds and the matching is
+a dictionary lookup per token. Columns with mostly distinct values (building numbers, street names) are left to the NER.
+'''
+
+import os
+from collections import Counter
+
+
+#the columns with a ratio of distinct values over non empty values up to this are selected when the columns are not given
+RULES_AUTO_MAX_DISTINCT_RATIO = float(os.environ.get("RULES_AUTO_MAX_DISTINCT_RATIO", 0.5))
+RULES_MAX_PATTERNS_PER_LABEL = int(os.environ.get("RULES_MAX_PATTERNS_PER_LABEL", 50000))
+#the patterns are matched on the lowercase form of the tokens, so the case of the text does not matter
+RULES_PHRASE_MATCHER_ATTR = "LOWER"
+ENTITY_RULER_NAME = "entity_ruler"
+
+
+class RuleValueCollector:
+    '''Counts the values of every entity column over the chunks of a CSV.'''
+
+    def __init__(self, normalize=None):
+        self.normalize = normalize
+        self.value_counts = {}
+        self.non_empty_counts = Counter()
+
+    def add(self, data_frame, columns):
+        for column in columns:
+            counts = self.value_counts.setdefault(column, Counter())
+            for value in data_frame[column].dropna():
+                value = str(value).strip()
+                if not value:
+                    continue
+                counts[self.normalize(value) if self.normalize else value] += 1
+                self.non_empty_counts[column] += 1
+
+    def select_labels(self, rule_columns=None):
+        '''The given columns (ValueError for unknown ones), or the closed vocabulary columns (RULES_AUTO_MAX_DISTINCT_RATIO).'''
+        if rule_columns:
+            unknown = [column for column in rule_columns if column not in self.value_counts]
+            if unknown:
+                raise ValueError(f"Unknown rule columns: {', '.join(unknown)}. Expected: {', '.join(self.value_counts)}.")
+            return list(rule_columns)
+        return [column for column, counts in self.value_counts.items()
+                if self.non_empty_counts[column] and len(counts) / self.non_empty_counts[column] <= RULES_AUTO_MAX_DISTINCT_RATIO]
+
+    def build_patterns(self, labels):
+        '''EntityRuler phrase patterns of the labels. A value found in several columns goes to the column where it is most frequent.'''
+        best_labels = {}
+        for label in labels:
+            for value, count in self.value_counts[label].most_common(RULES_MAX_PATTERNS_PER_LABEL):
+                key = value.lower()
+                if key not in best_labels or count > best_labels[key][1]:
+                    best_labels[key] = (label, count, value)
+        return [{'label': label, 'pattern': value} for label, count, value in best_labels.values()]
+
+
+def add_entity_ruler(nlp, patterns, before=None):
+    '''Adds an EntityRuler with the phrase patterns to a pipeline (before the given component, e.g. "ner", so the NER keeps its matches).'''
+    ruler = nlp.add_pipe("entity_ruler", name=ENTITY_RULER_NAME, before=before,
+                         config={'phrase_matcher_attr': RULES_PHRASE_MATCHER_ATTR, 'overwrite_ents': False})
+    ruler.add_patterns(patterns)
+    return ruler
@@ -0,0 +1,147 @@
+'''
+Persistent index (SQLite) of the training sessions metadata.
+Listing the sessions from the index is a single query instead of reading the meta.json of every session folder.
+The index is updated when a session is trained, edited or deleted, and it is synchronized with the sessions folder
+when the folder changes (a session folder was added or removed outside of the API) or when the index is missing.
+'''
+
+import json
+import os
+import threading
+from datetime import datetime
+
+from apis.cache import SQLiteConnection
+
+
+#format used by edit_training_session_metadata for date_created
+DATE_CREATED_FORMAT = "%m/%d/%Y %H:%M:%S %p"
+
+
+def parse_date_created(date_created):
+    '''Timestamp of a date_created string, None if it can not be parsed.'''
+    if not date_created:
+        return None
+    try:
+        return datetime.strptime(date_created, DATE_CREATED_FORMAT).timestamp()
+    except ValueError:
+        return None
+
+
+class SessionIndex:
+
+    def __init__(self, sessions_folder, load_session):
+        '''load_session(training_session_id) returns the session metadata read from disk (NerTrainingSession).'''
+        self.sessions_folder = sessions_folder
+        self.index_folder = os.path.join(sessions_folder, ".index")
+        self.index_path = os.path.join(self.index_folder, "sessions.sqlite")
+        self.load_session = load_session
+        self._lock = threading.RLock()
+
+    def upsert(self, session):
+        '''Adds or updates the metadata of a session (NerTrainingSession).'''
+        with self._connect() as connection:
+            self._upsert(connection, session)
+
+    def upsert_from_disk(self, training_session_id):
+        '''Reads the metadata of a session from disk and updates the index.'''
+        self.upsert(self.load_session(training_session_id))
+
+    def remove(self, training_session_id):
+        '''Removes a session from the index.'''
+        with self._connect() as connection:
+            connection.execute("DELETE FROM sessions WHERE training_session_id = ?", (training_session_id,))
+
+    def list(self, offset=0, limit=None, date_from=None, date_to=None, description=None, is_valid=None):
+        '''Sessions (newest first) filtered by creation date (datetime, date_to exclusive), description (contains, case insensitive) and validity.
+           Returns a tuple with the list of rows (dicts) for the requested page and the total number of rows that match the filters.'''
+        self.sync()
+
+        conditions = []
+        params = []
+        if date_from is not None:
+            conditions.append("created_at >= ?")
+            params.append(date_from.timestamp())
+        if date_to is not None:
+            conditions.append("created_at < ?")
+            params.append(date_to.timestamp())
+        if description:
+            conditions.append("training_description LIKE ? ESCAPE '\\'")
+            escaped = description.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            params.append(f"%{escaped}%")
+        if is_valid is not None:
+            conditions.append("is_valid = ?")
+            params.append(1 if is_valid else 0)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+        with self._connect() as connection:
+            total = connection.execute(f"SELECT COUNT(*) FROM sessions {where}", params).fetchone()[0]
+            rows = connection.execute(f"""SELECT training_session_id, is_valid, invalid_message, ner_fields, performance, date_created, training_description
+                                          FROM sessions {where}
+                                          ORDER BY created_at IS NULL, created_at DESC, training_session_id
+                                          LIMIT ? OFFSET ?""",
+                                      params + [-1 if limit is None else limit, offset]).fetchall()
+
+        return [{'training_session_id': row[0],
+                 'is_valid': bool(row[1]),
+                 'invalid_message': row[2],
+                 'ner_fields': json.loads(row[3]) if row[3] else [],
+                 'performance': json.loads(row[4]) if row[4] else None,
+                 'date_created': row[5],
+                 'training_description': row[6]} for row in rows], total
+
+    def sync(self, force=False):
+        '''Synchronizes the index with the sessions folder when the folder changed since the last synchronization.
+           Only the sessions added or removed are read from disk. With force the whole index is rebuilt.'''
+        if not os.path.exists(self.sessions_folder):
+            return
+
+        folder_mtime = os.path.getmtime(self.sessions_folder)
+        with self._connect() as connection:
+            row = connection.execute("SELECT value FROM index_state WHERE key = 'folder_mtime'").fetchone()
+        if not force and row is not None and float(row[0]) == folder_mtime:
+            return
+
+        with self._lock:
+            folders = set(item for item in os.listdir(self.sessions_folder)
+                          if not item.startswith(".") and os.path.isdir(os.path.join(self.sessions_folder, item)))
+            with self._connect() as connection:
+                if force:
+                    connection.execute("DELETE FROM sessions")
+                indexed = set(row[0] for row in connection.execute("SELECT training_session_id FROM sessions"))
+                for training_session_id in indexed - folders:
+                    connection.execute("DELETE FROM sessions WHERE training_session_id = ?", (training_session_id,))
+                for training_session_id in folders - indexed:
+                    self._upsert(connection, self.load_session(training_session_id))
+                connection.execute("INSERT OR REPLACE INTO index_state (key, value) VALUES ('folder_mtime', ?)", (str(folder_mtime),))
+
+    def _upsert(self, connection, session):
+        connection.execute("""INSERT OR REPLACE INTO sessions
+                              (training_session_id, is_valid, invalid_message, ner_fields, performance, date_created, created_at, training_description)
+                              VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
+                           (session.training_session_id,
+                            1 if session.is_valid else 0,
+                            session.invalid_message,
+                            json.dumps(session.ner_fields or []),
+                            json.dumps(session.performance) if session.performance is not None else None,
+                            session.date_created,
+                            parse_date_created(session.date_created),
+                            session.training_description))
+
+    def _connect(self):
+        '''New connection to the index. Creates the index the first time (the index folder is hidden from the session listing).'''
+        if not os.path.exists(self.index_path):
+            with self._lock:
+                os.makedirs(self.index_folder, exist_ok=True)
+                with SQLiteConnection(self.index_path) as connection:
+                    connection.execute("""CREATE TABLE IF NOT EXISTS sessions (
+                                            training_session_id TEXT PRIMARY KEY,
+                                            is_valid INTEGER NOT NULL,
+                                            invalid_message TEXT,
+                                            ner_fields TEXT,
+                                            performance TEXT,
+                                            date_created TEXT,
+                                            created_at REAL,
+                                            training_description TEXT)""")
+                    connection.execute("CREATE INDEX IF NOT EXISTS idx_sessions_created_at ON sessions (created_at)")
+                    connection.execute("CREATE TABLE IF NOT EXISTS index_state (key TEXT PRIMARY KEY, value TEXT)")
+        return SQLiteConnection(self.index_path)
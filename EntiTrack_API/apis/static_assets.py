@@ -0,0 +1,70 @@
+'''
+Serving of the static files of the Blazor WebAssembly UI.
+The Blazor publish already writes a Brotli (.br) and a gzip (.gz) version next to every big file, so the precompressed
+file is sent when the browser accepts it (the multi megabyte .wasm files are 3 times smaller in Brotli).
+The fingerprinted files of _framework (the name has a hash, it changes with the content) are cached by the browsers
+forever, the other files (index.html, blazor.boot.json, etc.) are revalidated with ETag / If-None-Match on every load.
+'''
+
+import mimetypes
+import os
+import re
+
+from flask import request, send_file, abort
+from werkzeug.security import safe_join
+
+
+#precompressed variants in order of preference (suffix of the file, content encoding)
+PRECOMPRESSED_VARIANTS = (('.br', 'br'), ('.gz', 'gzip'))
+
+#Blazor fingerprints the files as name.<10 characters hash>.extension
+FINGERPRINT_PATTERN = re.compile(r'\.[a-z0-9]{10}\.[a-z0-9]+$')
+FRAMEWORK_FOLDER = "_framework/"
+
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+REVALIDATE_CACHE_CONTROL = "no-cache"
+
+#not every system maps these extensions
+mimetypes.add_type('application/wasm', '.wasm')
+mimetypes.add_type('application/json', '.json')
+mimetypes.add_type('text/javascript', '.js')
+
+
+def is_fingerprinted(filename):
+    '''True for the files of _framework with a content hash in the name.'''
+    return filename.startswith(FRAMEWORK_FOLDER) and FINGERPRINT_PATTERN.search(filename) is not None
+
+
+def get_accepted_encodings():
+    '''Content encodings accepted by the client (quality greater than zero).'''
+    return set(encoding.lower() for encoding, quality in request.accept_encodings if quality > 0)
+
+
+def send_static_asset(folder, filename):
+    '''Sends a static file, precompressed when possible, with cache headers and conditional GET (ETag / Last-Modified).'''
+    path = safe_join(folder, filename)
+    if path is None or not os.path.isfile(path):
+        abort(404)
+
+    mimetype, file_encoding = mimetypes.guess_type(filename)
+    file_path = path
+    content_encoding = None
+    if file_encoding:
+        #the compressed files requested by name are sent as they are (no Content-Encoding)
+        mimetype = 'application/octet-stream'
+    else:
+        accepted_encodings = get_accepted_encodings()
+        for suffix, encoding in PRECOMPRESSED_VARIANTS:
+            if encoding in accepted_encodings and os.path.isfile(path + suffix):
+                file_path = path + suffix
+                content_encoding = encoding
+                break
+    mimetype = mimetype or 'application/octet-stream'
+
+    #the ETag is computed from the sent file, so every encoding has its own ETag
+    response = send_file(file_path, mimetype=mimetype, conditional=True, etag=True)
+    if content_encoding:
+        response.headers['Content-Encoding'] = content_encoding
+    response.vary.add('Accept-Encoding')
+    response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL if is_fingerprinted(filename) else REVALIDATE_CACHE_CONTROL
+    return response
@@ -0,0 +1,145 @@
+'''
+Token aware splitting of long texts for the GenAI NER, and merging of the results of every chunk.
+The texts are split on paragraph and sentence boundaries so every chunk fits the input token limit of the model,
+with an optional overlap (the last sentences of a chunk are repeated at the start of the next one)
+so the entities that cross a boundary are not lost.
+'''
+
+import os
+import re
+from collections import Counter
+
+
+#rough number of characters per token for the Gemini models (the API does not count tokens locally)
+GENAI_CHARS_PER_TOKEN = float(os.environ.get("GENAI_CHARS_PER_TOKEN", 4))
+
+PARAGRAPH_PATTERN = re.compile(r'\n\s*\n')
+SENTENCE_PATTERN = re.compile(r'(?<=[.!?;:])\s+|\n')
+WHITESPACE_PATTERN = re.compile(r'\s+')
+
+#values returned by the models when an entity is not present in a chunk
+EMPTY_VALUES = frozenset(('', 'none', 'null', 'n/a', 'na', 'unknown', 'not found', 'not available', 'not specified', 'not provided'))
+
+
+def estimate_tokens(text):
+    '''Approximate number of tokens of a text.'''
+    return int(len(text) / GENAI_CHARS_PER_TOKEN) + 1
+
+
+def split_units(text, max_tokens):
+    '''Splits a text in paragraphs, the paragraphs longer than max_tokens in sentences and the sentences longer than max_tokens in words.
+       Returns the list of units (with the paragraph separators kept at the end of the last unit of every paragraph).'''
+    units = []
+    for paragraph in PARAGRAPH_PATTERN.split(text):
+        if not paragraph.strip():
+            continue
+        if estimate_tokens(paragraph) <= max_tokens:
+            units.append(paragraph + "\n\n")
+            continue
+        for sentence in SENTENCE_PATTERN.split(paragraph):
+            if not sentence.strip():
+                continue
+            if estimate_tokens(sentence) <= max_tokens:
+                units.append(sentence + " ")
+                continue
+            #a single sentence above the limit is split in words (or in characters for a single huge word)
+            max_chars = max(int(max_tokens * GENAI_CHARS_PER_TOKEN), 1)
+            words = []
+            size = 0
+            for word in sentence.split():
+                for start in range(0, len(word), max_chars):
+                    piece = word[start:start + max_chars]
+                    if words and size + len(piece) + 1 > max_chars:
+                        units.append(" ".join(words) + " ")
+                        words = []
+                        size = 0
+                    words.append(piece)
+                    size += len(piece) + 1
+            if words:
+                units.append(" ".join(words) + " ")
+        units[-1] = units[-1].rstrip() + "\n\n"
+    return units
+
+
+def split_text(text, max_tokens, overlap_tokens=0):
+    '''Splits a text in chunks of at most max_tokens (estimated) on paragraph and sentence boundaries.
+       The last units of a chunk (up to overlap_tokens) are repeated at the start of the next chunk.'''
+    if max_tokens <= 0:
+        raise ValueError("The maximum number of tokens per chunk must be greater than zero.")
+    overlap_tokens = max(0, min(overlap_tokens, max_tokens // 2))
+    if estimate_tokens(text) <= max_tokens:
+        return [text]
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    new_units = 0
+    for unit in split_units(text, max_tokens):
+        unit_tokens = estimate_tokens(unit)
+        if current and current_tokens + unit_tokens > max_tokens:
+            chunks.append("".join(current).strip())
+            #keep the last units as overlap, but never more than what leaves room for the next unit
+            overlap = []
+            overlap_size = 0
+            for previous in reversed(current):
+                previous_tokens = estimate_tokens(previous)
+                if overlap_size + previous_tokens > overlap_tokens or overlap_size + previous_tokens + unit_tokens > max_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += previous_tokens
+            current = overlap
+            current_tokens = overlap_size
+            new_units = 0
+        current.append(unit)
+        current_tokens += unit_tokens
+        new_units += 1
+    if current and new_units:
+        chunks.append("".join(current).strip())
+    return chunks
+
+
+def is_empty_value(value):
+    if value is None:
+        return True
+    if isinstance(value, str):
+        return value.strip().lower() in EMPTY_VALUES
+    if isinstance(value, (list, dict)):
+        return len(value) == 0
+    return False
+
+
+def normalize_value(value):
+    '''Key used to consider two values of an entity the same (case and whitespace insensitive).'''
+    if isinstance(value, str):
+        return WHITESPACE_PATTERN.sub(' ', value).strip().casefold()
+    return repr(value)
+
+
+def merge_chunk_results(results, ner_fields):
+    '''Merges the NER results (dicts) of the chunks of a text, in the order of the chunks, into a single result.
+       Empty values are ignored. List values are merged without duplicates.
+       When the chunks disagree on a value, the value found in more chunks wins, then the longest one, then the first one.'''
+    merged = {}
+    for field in ner_fields:
+        values = [result.get(field) for result in results if isinstance(result, dict)]
+        values = [value for value in values if not is_empty_value(value)]
+        if not values:
+            merged[field] = ""
+            continue
+
+        if any(isinstance(value, list) for value in values):
+            items = {}
+            for value in values:
+                for item in (value if isinstance(value, list) else [value]):
+                    if not is_empty_value(item):
+                        items.setdefault(normalize_value(item), item)
+            merged[field] = list(items.values())
+            continue
+
+        votes = Counter(normalize_value(value) for value in values)
+        first_seen = {}
+        for position, value in enumerate(values):
+            first_seen.setdefault(normalize_value(value), (position, value))
+        best = max(votes, key=lambda key: (votes[key], len(key), -first_seen[key][0]))
+        merged[field] = first_seen[best][1]
+    return merged
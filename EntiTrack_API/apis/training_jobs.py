@@ -0,0 +1,154 @@
+'''
+Background queue for the training jobs.
+Training a model takes minutes, so the train endpoint only validates the request and enqueues a job.
+The jobs run in a bounded pool of worker threads (the heavy work runs in the training worker processes),
+so the training requests do not hold the API threads used by the inference endpoints.
+The finished jobs (and their progress) are kept for TRAINING_JOB_RETENTION_SECONDS, and at most TRAINING_MAX_FINISHED_JOBS
+of them. After that the status of a session comes from its metadata.
+The functions in finished_callbacks are called with every job that finishes, once its status is final.
+'''
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+
+TRAINING_MAX_PARALLEL_JOBS = int(os.environ.get("TRAINING_MAX_PARALLEL_JOBS", 1))
+TRAINING_MAX_QUEUED_JOBS = int(os.environ.get("TRAINING_MAX_QUEUED_JOBS", 20))
+TRAINING_JOB_RETENTION_SECONDS = float(os.environ.get("TRAINING_JOB_RETENTION_SECONDS", 3600))
+TRAINING_MAX_FINISHED_JOBS = int(os.environ.get("TRAINING_MAX_FINISHED_JOBS", 100))
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_SUCCEEDED = "succeeded"
+STATUS_FAILED = "failed"
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class TrainingJob:
+
+    def __init__(self, training_session_id):
+        self.training_session_id = training_session_id
+        self.status = STATUS_QUEUED
+        self.message = ''
+        self.queued_at = datetime.now()
+        self.started_at = None
+        self.finished_at = None
+        #evaluation steps reported while training, latest optimization step and time spent per phase
+        self.progress = []
+        self.latest_step = None
+        self.timings = {}
+        self._queued_time = time.monotonic()
+        self._started_time = None
+        self._finished_time = None
+
+    @property
+    def elapsed_seconds(self):
+        '''Seconds since the job was queued, until it finished.'''
+        end = self._finished_time if self._finished_time is not None else time.monotonic()
+        return round(end - self._queued_time, 3)
+
+    @property
+    def running_seconds(self):
+        '''Seconds spent running (not waiting in the queue).'''
+        if self._started_time is None:
+            return 0.0
+        end = self._finished_time if self._finished_time is not None else time.monotonic()
+        return round(end - self._started_time, 3)
+
+    @property
+    def is_finished(self):
+        return self.status in (STATUS_SUCCEEDED, STATUS_FAILED)
+
+
+class TrainingJobQueue:
+
+    def __init__(self, max_parallel_jobs=TRAINING_MAX_PARALLEL_JOBS, max_queued_jobs=TRAINING_MAX_QUEUED_JOBS,
+                 retention_seconds=TRAINING_JOB_RETENTION_SECONDS, max_finished_jobs=TRAINING_MAX_FINISHED_JOBS):
+        self.max_parallel_jobs = max_parallel_jobs
+        self.max_queued_jobs = max_queued_jobs
+        self.retention_seconds = retention_seconds
+        self.max_finished_jobs = max_finished_jobs
+        self._executor = ThreadPoolExecutor(max_workers=max_parallel_jobs, thread_name_prefix="training_job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self.finished_callbacks = []
+
+    def submit(self, training_session_id, func, *args, **kwargs):
+        '''Enqueues func(*args, **kwargs) as the training job of a session.
+           The job fails when func raises, the error message is kept in the job.
+           Raises QueueFullError when there are too many jobs waiting.'''
+        with self._lock:
+            self._evict_finished()
+            if self.count(STATUS_QUEUED) >= self.max_queued_jobs:
+                raise QueueFullError(f"There are {self.max_queued_jobs} training jobs waiting. Try again later.")
+            job = TrainingJob(training_session_id)
+            self._jobs[training_session_id] = job
+
+        self._executor.submit(self._run, job, func, *args, **kwargs)
+        return job
+
+    def get(self, training_session_id):
+        '''Returns the job of a training session or None if the session was not trained by this process.'''
+        with self._lock:
+            self._evict_finished()
+            return self._jobs.get(training_session_id)
+
+    def pop(self, training_session_id):
+        '''Forgets a finished job.'''
+        with self._lock:
+            job = self._jobs.get(training_session_id)
+            if job and job.is_finished:
+                del self._jobs[training_session_id]
+
+    def count(self, status):
+        return sum(1 for job in list(self._jobs.values()) if job.status == status)
+
+    def queue_position(self, training_session_id):
+        '''Position (starting at 1) of a queued job, 0 when it is not queued.'''
+        with self._lock:
+            queued = sorted((job for job in self._jobs.values() if job.status == STATUS_QUEUED), key=lambda job: job._queued_time)
+        for position, job in enumerate(queued, start=1):
+            if job.training_session_id == training_session_id:
+                return position
+        return 0
+
+    def _evict_finished(self):
+        '''Forgets the finished jobs older than the retention, and the oldest ones above max_finished_jobs. Must be called holding the lock.'''
+        finished = sorted((job for job in self._jobs.values() if job.is_finished and job._finished_time is not None),
+                          key=lambda job: job._finished_time)
+        expired_before = time.monotonic() - self.retention_seconds
+        excess = len(finished) - self.max_finished_jobs
+        for index, job in enumerate(finished):
+            if index < excess or job._finished_time <= expired_before:
+                del self._jobs[job.training_session_id]
+
+    def _run(self, job, func, *args, **kwargs):
+        job.status = STATUS_RUNNING
+        job.started_at = datetime.now()
+        job._started_time = time.monotonic()
+        try:
+            func(*args, **kwargs)
+            job.status = STATUS_SUCCEEDED
+        except Exception as e:
+            #abort() raises HTTP exceptions with the message in data
+            data = getattr(e, 'data', None)
+            job.message = (data.get('message') if isinstance(data, dict) else None) or getattr(e, 'description', None) or str(e)
+            job.status = STATUS_FAILED
+            print(f"Training job {job.training_session_id} failed: {job.message}")
+        finally:
+            job.finished_at = datetime.now()
+            job._finished_time = time.monotonic()
+        for callback in self.finished_callbacks:
+            try:
+                callback(job)
+            except Exception as e:
+                print(f"Error while finishing the training job {job.training_session_id}: {e}")
+
+
+training_job_queue = TrainingJobQueue()
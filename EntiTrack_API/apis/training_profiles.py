@@ -0,0 +1,102 @@
+'''
+Training profiles: named sets of overrides of config/config.cfg that trade accuracy for training time.
+The number of steps grows with the number of training examples (between the limits of the profile), the evaluations
+are spread over the training (a fixed number per training, not every 10 steps), and the training stops early when
+the F-score did not improve for patience_evaluations evaluations (SpaCy training.patience).
+'''
+
+import math
+import os
+
+
+class TrainingProfile:
+
+    def __init__(self, name, description, steps_per_example, min_steps, max_steps, evaluations, patience_evaluations,
+                 batch_size_start, batch_size_stop, batch_size_compound, tok2vec_width, tok2vec_depth):
+        if not (0 < min_steps <= max_steps) or steps_per_example <= 0 or evaluations < 1 or patience_evaluations < 1:
+            raise ValueError(f"Invalid steps or evaluations in the training profile {name}.")
+        if not (0 < batch_size_start <= batch_size_stop) or batch_size_compound < 1:
+            raise ValueError(f"Invalid batch size schedule in the training profile {name}.")
+        if tok2vec_width < 1 or tok2vec_depth < 1:
+            raise ValueError(f"Invalid tok2vec size in the training profile {name}.")
+        self.name = name
+        self.description = description
+        self.steps_per_example = steps_per_example
+        self.min_steps = min_steps
+        self.max_steps = max_steps
+        self.evaluations = evaluations
+        self.patience_evaluations = patience_evaluations
+        self.batch_size_start = batch_size_start
+        self.batch_size_stop = batch_size_stop
+        self.batch_size_compound = batch_size_compound
+        self.tok2vec_width = tok2vec_width
+        self.tok2vec_depth = tok2vec_depth
+
+    def get_overrides(self, train_count, fine_tune=False):
+        '''Overrides of the training config for a training set with train_count examples.
+           When fine tuning an existing model (see TRAINING_FINE_TUNE_STEPS_FRACTION) the network size is the one of the model.'''
+        max_steps = min(max(math.ceil(train_count * self.steps_per_example), self.min_steps), self.max_steps)
+        if fine_tune:
+            max_steps = max(math.ceil(max_steps * TRAINING_FINE_TUNE_STEPS_FRACTION), TRAINING_FINE_TUNE_MIN_STEPS)
+        eval_frequency = min(max(max_steps // self.evaluations, MIN_EVAL_FREQUENCY), MAX_EVAL_FREQUENCY)
+        overrides = {"training.max_steps": max_steps,
+                     "training.eval_frequency": eval_frequency,
+                     "training.patience": eval_frequency * self.patience_evaluations,
+                     "training.batcher.size.start": self.batch_size_start,
+                     "training.batcher.size.stop": self.batch_size_stop,
+                     "training.batcher.size.compound": self.batch_size_compound}
+        if not fine_tune:
+            overrides.update({"components.ner.model.tok2vec.width": self.tok2vec_width,
+                              "components.ner.model.tok2vec.depth": self.tok2vec_depth})
+        return overrides
+
+    def to_dict(self):
+        return dict(vars(self))
+
+
+#limits of the steps between two evaluations (the evaluation of small datasets is cheap, but not free)
+MIN_EVAL_FREQUENCY = 10
+MAX_EVAL_FREQUENCY = 200
+
+#a retrain starts from a trained model, so it runs a fraction of the steps of a training from scratch
+TRAINING_FINE_TUNE_STEPS_FRACTION = float(os.environ.get("TRAINING_FINE_TUNE_STEPS_FRACTION", 0.25))
+TRAINING_FINE_TUNE_MIN_STEPS = int(os.environ.get("TRAINING_FINE_TUNE_MIN_STEPS", 50))
+
+TRAINING_PROFILES = {profile.name: profile for profile in (
+    TrainingProfile(name="fast",
+                    description="Smaller network, fewer steps and evaluations. For trying a dataset.",
+                    steps_per_example=0.5, min_steps=100, max_steps=300, evaluations=5, patience_evaluations=2,
+                    batch_size_start=100, batch_size_stop=1000, batch_size_compound=1.01,
+                    tok2vec_width=64, tok2vec_depth=2),
+    TrainingProfile(name="balanced",
+                    description="Network of config/config.cfg and the 300 steps of the trainings before the profiles, with early stopping.",
+                    steps_per_example=2, min_steps=300, max_steps=300, evaluations=15, patience_evaluations=4,
+                    batch_size_start=100, batch_size_stop=1000, batch_size_compound=1.001,
+                    tok2vec_width=96, tok2vec_depth=4),
+    TrainingProfile(name="accurate",
+                    description="Wider network, more steps, smaller batches and more patience. Slower to train.",
+                    steps_per_example=4, min_steps=600, max_steps=10000, evaluations=20, patience_evaluations=6,
+                    batch_size_start=50, batch_size_stop=500, batch_size_compound=1.001,
+                    tok2vec_width=128, tok2vec_depth=4),
+)}
+
+TRAINING_DEFAULT_PROFILE = os.environ.get("TRAINING_DEFAULT_PROFILE", "balanced")
+if TRAINING_DEFAULT_PROFILE not in TRAINING_PROFILES:
+    raise ValueError(f"Unknown TRAINING_DEFAULT_PROFILE {TRAINING_DEFAULT_PROFILE}. Expected: {', '.join(TRAINING_PROFILES)}.")
+
+
+def get_training_stats(evaluations, latest_step, max_steps, duration_seconds):
+    '''Summary of a training from its evaluation steps: best score, steps, words per second and if it stopped early.'''
+    last_evaluation = evaluations[-1] if evaluations else {}
+    scores = [evaluation['score'] for evaluation in evaluations if evaluation.get('score') is not None]
+    words = last_evaluation.get('words')
+    #seconds of the SpaCy training loop until the last evaluation
+    seconds = last_evaluation.get('seconds')
+    return {'duration_seconds': duration_seconds,
+            'steps': latest_step,
+            'max_steps': max_steps,
+            'stopped_early': latest_step is not None and latest_step < max_steps,
+            'evaluations': len(evaluations),
+            'best_score': max(scores) if scores else None,
+            'words': words,
+            'words_per_second': round(words / seconds, 1) if words and seconds else None}
@@ -0,0 +1,255 @@
+'''
+Worker processes that train the SpaCy models with the SpaCy training API (no new interpreter per training).
+Every worker is a long lived process (python -m apis.training_worker, not forked from the threaded API) that imports SpaCy once.
+The workers are started by the first training, so an API that only serves inference does not keep them in memory.
+With TRAINING_PREWARM they are started with the API instead, and the first training does not wait for the SpaCy import.
+The tasks are received on stdin and the training progress (losses and scores of every evaluation step) is sent back
+to the API as JSON lines while the training runs. The SpaCy console output goes to the stderr of the API.
+'''
+
+import json
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+from pathlib import Path
+
+from apis.training_jobs import TRAINING_MAX_PARALLEL_JOBS
+
+
+TRAINING_NICENESS = int(os.environ.get("TRAINING_NICENESS", 10))
+TRAINING_PREWARM = os.environ.get("TRAINING_PREWARM", "false").lower() in ("1", "true", "yes")
+#seconds a training can run before its worker process is killed (and replaced), 0 disables the limit
+TRAINING_TIMEOUT_SECONDS = float(os.environ.get("TRAINING_TIMEOUT_SECONDS", 2 * 3600))
+
+PROGRESS_LOGGER = "entitrack.ProgressLogger.v1"
+PROGRESS_CALLBACK = "entitrack.ProgressBeforeUpdate.v1"
+
+#folder the API runs from (the paths of the tasks are relative to it)
+API_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+#channel to the API process, only set inside of a worker process
+_progress_channel = None
+
+
+def send_progress(message):
+    if _progress_channel is not None:
+        _progress_channel.write(json.dumps(message) + "\n")
+        _progress_channel.flush()
+
+
+def progress_logger(logger):
+    '''SpaCy training logger that wraps the logger of the config and sends every evaluation step to the API process.'''
+    def setup(nlp, stdout=sys.stdout, stderr=sys.stderr):
+        wrapped_log_step, wrapped_finalize = logger(nlp, stdout, stderr)
+
+        def log_step(info):
+            wrapped_log_step(info)
+            #SpaCy only passes the info on the evaluation steps
+            if info is None:
+                return
+            other_scores = info.get("other_scores") or {}
+            send_progress({'type': 'evaluation',
+                           'step': info["step"],
+                           'epoch': info["epoch"],
+                           'losses': {name: float(loss) for name, loss in info["losses"].items()},
+                           'score': float(info["score"]) if info["score"] is not None else None,
+                           'scores': {name: float(score) for name, score in other_scores.items() if isinstance(score, (int, float))},
+                           'seconds': info["seconds"],
+                           'words': info["words"]})
+
+        return log_step, wrapped_finalize
+
+    return setup
+
+
+def progress_before_update():
+    '''SpaCy before_update callback that sends the current step to the API process.'''
+    def before_update(nlp, args):
+        send_progress({'type': 'step', 'step': args["step"], 'epoch': args["epoch"]})
+
+    return before_update
+
+
+def register_progress_functions():
+    '''Registers the progress logger and callback in the SpaCy registry (only the worker processes import SpaCy).'''
+    from spacy.util import registry
+    registry.loggers.register(PROGRESS_LOGGER, func=progress_logger)
+    registry.callbacks.register(PROGRESS_CALLBACK, func=progress_before_update)
+
+
+def run_training(config_path, output_path, overrides, source_model=None):
+    '''Same as the spacy train command, with the progress logger. Returns the time spent in every phase.
+       With a source_model, the components of the pipeline start from the weights of that model (fine-tuning).'''
+    from spacy import util
+    from spacy.training.initialize import init_nlp
+    from spacy.training.loop import train as train_nlp
+
+    timings = {}
+    start = time.perf_counter()
+    config = util.load_config(config_path, overrides=overrides, interpolate=False)
+    logger = config["training"]["logger"]
+    before_update = config["training"]["before_update"]
+    config["training"]["logger"] = {"@loggers": PROGRESS_LOGGER, "logger": logger}
+    config["training"]["before_update"] = {"@callbacks": PROGRESS_CALLBACK}
+    if source_model:
+        #sourced components are not initialized again, SpaCy resumes their training
+        for component_name in config["nlp"]["pipeline"]:
+            config["components"][component_name] = {"source": source_model}
+
+    nlp = init_nlp(config)
+    timings['initialize_seconds'] = round(time.perf_counter() - start, 3)
+
+    start = time.perf_counter()
+    output_path = Path(output_path)
+    output_path.mkdir(parents=True, exist_ok=True)
+    train_nlp(nlp, output_path, stdout=sys.stdout, stderr=sys.stderr)
+    timings['train_seconds'] = round(time.perf_counter() - start, 3)
+
+    #the saved models must not depend on the progress logger (it is only registered in the workers)
+    for model_folder in ("model-best", "model-last"):
+        model_config_path = output_path / model_folder / "config.cfg"
+        if model_config_path.exists():
+            model_config = util.load_config(model_config_path, interpolate=False)
+            model_config["training"]["logger"] = logger
+            model_config["training"]["before_update"] = before_update
+            model_config.to_disk(model_config_path)
+    return timings
+
+
+def worker_main(niceness=TRAINING_NICENESS):
+    '''Main loop of a worker process. Receives training tasks (JSON lines on stdin) and answers with done/error messages.'''
+    global _progress_channel
+    #stdout is kept for the messages to the API, everything printed goes to stderr
+    _progress_channel = os.fdopen(os.dup(sys.stdout.fileno()), "w")
+    os.dup2(sys.stderr.fileno(), sys.stdout.fileno())
+    sys.stdout = sys.stderr
+    #the training runs with a lower priority so it does not slow down the inference requests
+    if niceness and hasattr(os, "nice"):
+        os.nice(niceness)
+    #SpaCy and its training loop are imported before the first task arrives
+    register_progress_functions()
+    import spacy.training.initialize
+    import spacy.training.loop
+
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        try:
+            timings = run_training(**json.loads(line))
+            send_progress({'type': 'done', 'timings': timings})
+        except Exception as e:
+            send_progress({'type': 'error', 'message': f"{type(e).__name__}: {e}"})
+
+
+class TrainingWorkerError(Exception):
+    pass
+
+
+class TrainingWorker:
+
+    def __init__(self):
+        self.process = None
+
+    def start(self):
+        self.process = subprocess.Popen([sys.executable, "-m", "apis.training_worker"], cwd=API_FOLDER,
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+
+    def is_alive(self):
+        return self.process is not None and self.process.poll() is None
+
+    def stop(self):
+        if self.is_alive():
+            try:
+                self.process.stdin.close()
+            except OSError:
+                pass
+            try:
+                self.process.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                self.process.terminate()
+
+    def kill(self):
+        if self.is_alive():
+            self.process.kill()
+            self.process.wait()
+
+    def run(self, task, on_progress=None, timeout=TRAINING_TIMEOUT_SECONDS):
+        '''Sends a training task and waits for it, calling on_progress(message) for every progress message.
+           Returns the timings of the training. Raises TrainingWorkerError when the training fails or the worker dies.
+           A training running longer than timeout seconds kills the worker process (the pool starts a new one).'''
+        timed_out = threading.Event()
+
+        def stop_hung_worker():
+            timed_out.set()
+            self.kill()
+
+        #the worker is killed from another thread, so the reading of its output ends
+        watchdog = threading.Timer(timeout, stop_hung_worker) if timeout else None
+        if watchdog:
+            watchdog.daemon = True
+            watchdog.start()
+        try:
+            self.process.stdin.write(json.dumps(task) + "\n")
+            self.process.stdin.flush()
+            for line in self.process.stdout:
+                message = json.loads(line)
+                if message['type'] == 'done':
+                    return message['timings']
+                if message['type'] == 'error':
+                    raise TrainingWorkerError(message['message'])
+                if on_progress:
+                    on_progress(message)
+        except (BrokenPipeError, OSError, ValueError):
+            pass
+        finally:
+            if watchdog:
+                watchdog.cancel()
+        if timed_out.is_set():
+            #the process is reaped before returning, so the pool sees it dead and replaces it
+            self.process.wait()
+            raise TrainingWorkerError(f"The training did not finish in {timeout:g} seconds, its worker process was stopped.")
+        raise TrainingWorkerError("The training worker process stopped unexpectedly.")
+
+
+class TrainingWorkerPool:
+    '''Fixed size pool of training worker processes. Dead workers are replaced on the next use.'''
+
+    def __init__(self, size=TRAINING_MAX_PARALLEL_JOBS):
+        self.size = size
+        self._idle = queue.Queue()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        '''Starts the worker processes (they import SpaCy right away). Called by the first training, or at startup with TRAINING_PREWARM.'''
+        with self._lock:
+            if self._started:
+                return
+            for _ in range(self.size):
+                worker = TrainingWorker()
+                worker.start()
+                self._idle.put(worker)
+            self._started = True
+
+    def run(self, config_path, output_path, overrides, on_progress=None, source_model=None):
+        '''Trains a model in the next idle worker (starting from the source_model weights when given). Returns the time spent in every phase.'''
+        self.start()
+        worker = self._idle.get()
+        try:
+            if not worker.is_alive():
+                worker.start()
+            return worker.run({'config_path': config_path, 'output_path': output_path, 'overrides': overrides, 'source_model': source_model}, on_progress)
+        finally:
+            if not worker.is_alive():
+                worker.start()
+            self._idle.put(worker)
+
+
+training_worker_pool = TrainingWorkerPool()
+
+
+if __name__ == "__main__":
+    worker_main()
@@ -0,0 +1,67 @@
+'''
+Optional warm-up of the heavy dependencies.
+The namespaces import SpaCy, pandas, google genai and langchain the first time an endpoint needs them,
+so the API starts fast. The components listed in WARMUP_COMPONENTS are loaded when the API starts instead
+(in a background thread by default, so the API can serve requests meanwhile).
+'''
+
+import importlib
+import os
+import threading
+import time
+
+
+#comma separated list of components (see WARMUP_COMPONENT_MODULES, "models" or "all")
+WARMUP_COMPONENTS = os.environ.get("WARMUP_COMPONENTS", "")
+WARMUP_IN_BACKGROUND = os.environ.get("WARMUP_IN_BACKGROUND", "true").lower() in ("1", "true", "yes")
+
+WARMUP_COMPONENT_MODULES = {
+    'pandas': ('pandas',),
+    'spacy': ('spacy', 'spacy.tokens', 'spacy.util'),
+    'genai': ('google.genai', 'pydantic', 'langchain_core.prompts', 'langchain_core.output_parsers', 'langchain_google_genai'),
+}
+#loads the models of the most recent sessions (needs a load_models function)
+WARMUP_MODELS = "models"
+WARMUP_ALL = "all"
+
+
+def parse_components(value):
+    '''List of components from a comma separated string. Raises ValueError for unknown components.'''
+    components = [component.strip().lower() for component in value.split(",") if component.strip()]
+    if WARMUP_ALL in components:
+        return list(WARMUP_COMPONENT_MODULES) + [WARMUP_MODELS]
+    unknown = [component for component in components if component not in WARMUP_COMPONENT_MODULES and component != WARMUP_MODELS]
+    if unknown:
+        raise ValueError(f"Unknown warm up components: {', '.join(unknown)}. Expected: {', '.join(list(WARMUP_COMPONENT_MODULES) + [WARMUP_MODELS, WARMUP_ALL])}.")
+    return components
+
+
+def warm_up(components, load_models=None):
+    '''Imports the modules of the components (and loads the models with load_models()). Returns the seconds spent per component.'''
+    timings = {}
+    for component in components:
+        start = time.perf_counter()
+        try:
+            if component == WARMUP_MODELS:
+                if load_models:
+                    load_models()
+            else:
+                for module_name in WARMUP_COMPONENT_MODULES[component]:
+                    importlib.import_module(module_name)
+        except Exception as e:
+            print(f"Unable to warm up {component}: {e}")
+        timings[component] = round(time.perf_counter() - start, 3)
+    print(f"Warm up finished: {timings}")
+    return timings
+
+
+def start_warm_up(components_value=WARMUP_COMPONENTS, load_models=None, background=WARMUP_IN_BACKGROUND):
+    '''Warms up the components of the comma separated string, in a background thread unless background is False.'''
+    components = parse_components(components_value)
+    if not components:
+        return None
+    if not background:
+        return warm_up(components, load_models)
+    thread = threading.Thread(target=warm_up, args=(components, load_models), name="warm_up", daemon=True)
+    thread.start()
+    return thread
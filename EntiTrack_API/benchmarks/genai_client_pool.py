@@ -0,0 +1,156 @@
+'''
+Load test of /gen_ai_ner/perform_ner against a local stub server standing in for the Google GenAI endpoint, with the
+client registry (GENAI_CLIENT_POOL_ENABLED) disabled and enabled. Reports the latency per request, the requests per
+second and the number of TCP connections opened to the stub, as JSON.
+The stub waits --handshake-ms on every new connection, as the TCP + TLS handshake with the real endpoint would, and
+--latency-ms on every generateContent call.
+
+Usage (from the EntiTrack_API folder):
+    python benchmarks/genai_client_pool.py [--requests 200] [--concurrency 8] [--field-sets 20] [--handshake-ms 30] [--latency-ms 20]
+'''
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+API_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUB_MODEL = "stub-model"
+API_KEY = "stub-api-key"
+
+
+class StubGenAIHandler(BaseHTTPRequestHandler):
+    '''Answers the model list and generateContent calls of the google genai client (HTTP/1.1 with keep-alive).'''
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        self.server.connections += 1
+        time.sleep(self.server.handshake_seconds)
+
+    def do_GET(self):
+        self.send_json({'models': [{'name': f"models/{STUB_MODEL}", 'displayName': "Stub model", 'description': "Local stub model",
+                                    'inputTokenLimit': 100000, 'outputTokenLimit': 8192,
+                                    'supportedGenerationMethods': ["generateContent"]}]})
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b"{}")
+        time.sleep(self.server.latency_seconds)
+        #answers every field asked in the format instructions of the prompt with its own name
+        prompt = json.dumps(body)
+        fields = [field for field in self.server.all_fields if field in prompt]
+        text = json.dumps({field: f"stub {field}" for field in fields})
+        self.send_json({'candidates': [{'content': {'parts': [{'text': text}], 'role': "model"}, 'finishReason': "STOP", 'index': 0}],
+                        'usageMetadata': {'promptTokenCount': 10, 'candidatesTokenCount': 10, 'totalTokenCount': 20}})
+
+    def send_json(self, data):
+        payload = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_stub_server(handshake_ms, latency_ms, all_fields):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubGenAIHandler)
+    server.daemon_threads = True
+    server.connections = 0
+    server.handshake_seconds = handshake_ms / 1000.0
+    server.latency_seconds = latency_ms / 1000.0
+    server.all_fields = all_fields
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(round(fraction * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def run_load(client, field_sets, requests, concurrency):
+    '''Sends the requests concurrently (rotating the NER fields, so the chains differ) and returns the latencies and the errors.'''
+    def send(index):
+        body = {'model_key': STUB_MODEL, 'text_to_check': f"Text number {index}", 'ner_fields': field_sets[index % len(field_sets)],
+                'cache_mode': 'bypass', 'chunking': 'off'}
+        start = time.perf_counter()
+        response = client.post(f"/gen_ai_ner/perform_ner/{API_KEY}", json=body)
+        return time.perf_counter() - start, response.status_code
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(send, range(requests)))
+    return [seconds for seconds, status in results], sum(1 for seconds, status in results if status != 200)
+
+
+def benchmark_mode(app, stub, pool_enabled, field_sets, requests, concurrency):
+    import apis.ns_genai as ns_genai
+
+    #every mode starts cold: no clients, chains or model lists
+    ns_genai.genai_client_registry.enabled = pool_enabled
+    ns_genai.genai_client_registry.clear()
+    ns_genai.chain_cache.clear()
+    ns_genai.model_list_cache.clear()
+
+    client = app.test_client()
+    connections_before = stub.connections
+    start = time.perf_counter()
+    latencies, errors = run_load(client, field_sets, requests, concurrency)
+    elapsed = time.perf_counter() - start
+    return {'pool_enabled': pool_enabled,
+            'requests': requests,
+            'errors': errors,
+            'requests_per_sec': round(requests / elapsed, 1),
+            'mean_ms': round(statistics.mean(latencies) * 1000, 2),
+            'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+            'connections_opened': stub.connections - connections_before,
+            'client_registry': ns_genai.genai_client_registry.stats()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--field-sets', type=int, default=20, help='Distinct lists of NER fields sent (each one is a different chain).')
+    parser.add_argument('--handshake-ms', type=float, default=30.0, help='Delay of the stub on every new connection.')
+    parser.add_argument('--latency-ms', type=float, default=20.0, help='Delay of the stub on every generateContent call.')
+    parser.add_argument('--output', help='Also write the JSON results to this file.')
+    args = parser.parse_args()
+
+    field_sets = [[f"Field{index}_A", f"Field{index}_B", f"Field{index}_C"] for index in range(args.field_sets)]
+    stub = start_stub_server(args.handshake_ms, args.latency_ms, [field for fields in field_sets for field in fields] + ["Warmup"])
+
+    #the clients read the endpoint and the quotas when the API modules are imported
+    os.environ["GENAI_BASE_URL"] = f"http://127.0.0.1:{stub.server_address[1]}"
+    os.environ.setdefault("RESULT_CACHE_ENABLED", "false")
+    #--concurrency requests at the same time, above the limits of the admission control of the GenAI endpoints
+    os.environ.setdefault("ADMISSION_CONTROL_ENABLED", "false")
+    os.chdir(API_FOLDER)
+    sys.path.insert(0, API_FOLDER)
+    from main import app
+
+    #the dependencies are imported by the first request, out of the measures
+    run_load(app.test_client(), [["Warmup"]], 1, 1)
+
+    results = {'settings': vars(args),
+               'modes': [benchmark_mode(app, stub, pool_enabled, field_sets, args.requests, args.concurrency) for pool_enabled in (False, True)]}
+    stub.shutdown()
+
+    output = json.dumps(results, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+'''
+Benchmark of the NER pipeline on the bundled sample_data. Every stage reports docs/sec, p50/p95 latency and peak RSS as JSON,
+so the results of two commits can be compared before deploying.
+
+Stages:
+    spans              massage_data/create_entity_spans on sample_data/AddressSample.csv scaled up (--scale)
+    doc_bin            get_doc_bin on the same spans
+    train              short SpaCy training (--train-steps) on AddressSample.csv, the model is used by the inference stages
+    perform_ner        single text requests to /spacy_train_ner/perform_ner
+    perform_ner_batch  /spacy_train_ner/perform_ner_batch requests of --batch-size texts
+    genai              /gen_ai_ner/perform_ner with a local fake chat model (no network, --genai-latency per call)
+    genai_batch        /gen_ai_ner/perform_ner_batch with the fake chat model
+    genai_chunked      /gen_ai_ner/perform_ner of sample_data/Legal_Document1.txt split in chunks, with the fake chat model
+
+Usage (from the EntiTrack_API folder):
+    python benchmarks/ner_pipeline.py [--stages spans,doc_bin,...] [--scale 4] [--repeat 5] [--output results.json]
+The trained benchmark session is deleted at the end, unless --session-id is given (then that session is used and train is skipped).
+'''
+
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime
+
+
+API_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SAMPLE_DATA_FOLDER = os.path.join(os.path.dirname(API_FOLDER), "sample_data")
+ADDRESS_SAMPLE_CSV = os.path.join(SAMPLE_DATA_FOLDER, "AddressSample.csv")
+LONG_DOCUMENT = os.path.join(SAMPLE_DATA_FOLDER, "Legal_Document1.txt")
+TEXT_COLUMN = "TextToParse"
+
+ALL_STAGES = ('spans', 'doc_bin', 'train', 'perform_ner', 'perform_ner_batch', 'genai', 'genai_batch', 'genai_chunked')
+
+#the app is benchmarked as it serves requests, without worker processes started at import
+os.environ.setdefault("TRAINING_PREWARM", "false")
+os.environ.setdefault("WARMUP_COMPONENTS", "")
+#the GenAI stages measure the request path, not the quota of the Google API
+os.environ.setdefault("GENAI_BATCH_REQUESTS_PER_MINUTE", "1000000")
+#the stages measure the pipeline, not the concurrency limits of the admission control
+os.environ.setdefault("ADMISSION_CONTROL_ENABLED", "false")
+#the inference stages repeat the same texts, with the result cache they would measure cache hits (not comparable between commits)
+os.environ.setdefault("INFERENCE_CACHE_ENABLED", "false")
+os.chdir(API_FOLDER)
+sys.path.insert(0, API_FOLDER)
+
+
+def percentile(values, fraction):
+    '''Percentile (linear interpolation) of a list of values.'''
+    if not values:
+        return None
+    values = sorted(values)
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def current_rss_bytes():
+    '''Resident memory of this process (Linux), None when not available.'''
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+class PeakRSS:
+    '''Samples the resident memory while a stage runs. Falls back to the peak of the whole process (ru_maxrss).'''
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def __enter__(self):
+        self.peak = current_rss_bytes() or 0
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self._stop.set()
+        self._thread.join()
+        if not self.peak:
+            #ru_maxrss is in kilobytes on Linux and in bytes on macOS
+            max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            self.peak = max_rss if sys.platform == "darwin" else max_rss * 1024
+
+    def _sample(self):
+        while not self._stop.is_set():
+            rss = current_rss_bytes()
+            if rss is None:
+                return
+            self.peak = max(self.peak, rss)
+            self._stop.wait(self.interval)
+
+
+def measure(run, repeat, docs_per_run):
+    '''Runs run() repeat times. Returns docs/sec, latency percentiles (of every run) and peak RSS.'''
+    latencies = []
+    with PeakRSS() as peak_rss:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            run()
+            latencies.append(time.perf_counter() - start)
+    total_seconds = sum(latencies)
+    return {'runs': repeat,
+            'docs': docs_per_run * repeat,
+            'seconds': round(total_seconds, 4),
+            'docs_per_sec': round(docs_per_run * repeat / total_seconds, 2) if total_seconds else None,
+            'p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+            'p95_ms': round(percentile(latencies, 0.95) * 1000, 3),
+            'peak_rss_mb': round(peak_rss.peak / (1024 * 1024), 1)}
+
+
+def load_address_sample(scale):
+    '''AddressSample.csv repeated scale times, as the training does (strings, with the tag columns).'''
+    import pandas as pd
+    data_frame = pd.read_csv(ADDRESS_SAMPLE_CSV, sep=",", dtype=str)
+    return pd.concat([data_frame] * scale, ignore_index=True).astype(str)
+
+
+def benchmark_spans(data_frame, repeat):
+    from apis.ns_train import create_entity_spans, TAG_SUFFIX
+    tag_list = [column + TAG_SUFFIX for column in data_frame.columns if column != TEXT_COLUMN]
+    return measure(lambda: create_entity_spans(data_frame, tag_list, TEXT_COLUMN, TAG_SUFFIX), repeat, len(data_frame))
+
+
+def benchmark_doc_bin(data_frame, repeat):
+    import spacy
+    from apis.ns_train import create_entity_spans, get_doc_bin, TAG_SUFFIX
+    tag_list = [column + TAG_SUFFIX for column in data_frame.columns if column != TEXT_COLUMN]
+    data = create_entity_spans(data_frame, tag_list, TEXT_COLUMN, TAG_SUFFIX).values.tolist()
+    nlp = spacy.blank("en")
+    return measure(lambda: get_doc_bin(data=data, nlp=nlp), repeat, len(data))
+
+
+def benchmark_train(training_session_id, train_steps):
+    '''Builds the corpus and trains a model for the benchmark session (in this process). Returns the stage results.'''
+    from apis.ns_train import build_training_corpus, edit_training_session_metadata
+    from apis.training_worker import register_progress_functions, run_training
+
+    session_path = os.path.join("model_train_sessions", training_session_id)
+    os.makedirs(session_path, exist_ok=True)
+    train_path = os.path.join(session_path, "train")
+    test_path = os.path.join(session_path, "test")
+    register_progress_functions()
+
+    timings = {}
+    with PeakRSS() as peak_rss:
+        start = time.perf_counter()
+        train_count, test_count = build_training_corpus(ADDRESS_SAMPLE_CSV, TEXT_COLUMN, train_path, test_path)
+        timings['corpus_seconds'] = time.perf_counter() - start
+        timings.update(run_training(config_path=os.path.join("config", "config.cfg"),
+                                    output_path=os.path.join(session_path, "models"),
+                                    overrides={"paths.train": train_path,
+                                               "paths.dev": test_path,
+                                               "training.eval_frequency": max(train_steps // 2, 1),
+                                               "training.max_steps": train_steps}))
+        total_seconds = time.perf_counter() - start
+    edit_training_session_metadata(training_session_id, "benchmark")
+
+    return {'runs': 1,
+            'docs': train_count,
+            'steps': train_steps,
+            'seconds': round(total_seconds, 4),
+            'docs_per_sec': round(train_count / total_seconds, 2),
+            'steps_per_sec': round(train_steps / timings['train_seconds'], 2),
+            'p50_ms': round(total_seconds * 1000, 3),
+            'p95_ms': round(total_seconds * 1000, 3),
+            'peak_rss_mb': round(peak_rss.peak / (1024 * 1024), 1),
+            'phases_seconds': {phase: round(seconds, 4) for phase, seconds in timings.items()}}
+
+
+def check_response(response):
+    if response.status_code != 200:
+        raise RuntimeError(f"Request failed with status {response.status_code}: {response.get_data(as_text=True)[:500]}")
+    return response
+
+
+def benchmark_perform_ner(client, training_session_id, texts, repeat):
+    text_iterator = iter(texts * repeat)
+    def run():
+        check_response(client.post('/spacy_train_ner/perform_ner', data={'text_to_check': next(text_iterator), 'training_session_id': training_session_id}))
+    #the first request loads the model
+    check_response(client.post('/spacy_train_ner/perform_ner', data={'text_to_check': texts[0], 'training_session_id': training_session_id}))
+    return measure(run, len(texts) * repeat, 1)
+
+
+def benchmark_perform_ner_batch(client, training_session_id, texts, batch_size, repeat):
+    def run():
+        response = check_response(client.post('/spacy_train_ner/perform_ner_batch', json={'training_session_id': training_session_id, 'texts': texts, 'batch_size': batch_size}))
+        if '"error"' in response.get_data(as_text=True):
+            raise RuntimeError("The batch reported an error.")
+    return measure(run, repeat, len(texts))
+
+
+FAKE_MODEL_KEY = "models/fake-chat-model"
+GENAI_NER_FIELDS = ["Address1", "City", "State", "Zip_Code"]
+
+
+class FakeModelProfile:
+    name = FAKE_MODEL_KEY
+    display_name = "Fake chat model"
+    description = "Local fake chat model used by the benchmarks."
+    input_token_limit = 1048576
+    output_token_limit = 8192
+
+
+def install_fake_chat_model(latency):
+    '''Replaces the Google chat model by a langchain fake chat model that answers after latency seconds, and the model list by a fake one.'''
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    import apis.ns_genai as ns_genai
+
+    answer = json.dumps({field: f"fake {field}" for field in GENAI_NER_FIELDS})
+    ns_genai.genai_client_registry.get_chat_model = lambda api_key, model_key, **kwargs: FakeListChatModel(responses=[answer], sleep=latency)
+    ns_genai.get_model_list = lambda google_studio_api_key: [FakeModelProfile()]
+
+
+def benchmark_genai(client, texts, repeat):
+    text_iterator = iter(texts * repeat)
+    def run():
+        check_response(client.post('/gen_ai_ner/perform_ner/benchmark-key', json={'model_key': FAKE_MODEL_KEY, 'ner_fields': GENAI_NER_FIELDS,
+                                                                               'text_to_check': next(text_iterator), 'cache_mode': 'bypass', 'chunking': 'off'}))
+    return measure(run, len(texts) * repeat, 1)
+
+
+def benchmark_genai_batch(client, texts, repeat):
+    def run():
+        response = check_response(client.post('/gen_ai_ner/perform_ner_batch/benchmark-key', json={'model_key': FAKE_MODEL_KEY, 'ner_fields': GENAI_NER_FIELDS,
+                                                                                                  'texts': texts, 'cache_mode': 'bypass'}))
+        if '"error"' in response.get_data(as_text=True):
+            raise RuntimeError("The batch reported an error.")
+    return measure(run, repeat, len(texts))
+
+
+def benchmark_genai_chunked(client, repeat, max_chunk_tokens):
+    with open(LONG_DOCUMENT, encoding="utf-8") as f:
+        document = f.read()
+    def run():
+        check_response(client.post('/gen_ai_ner/perform_ner/benchmark-key', json={'model_key': FAKE_MODEL_KEY, 'ner_fields': GENAI_NER_FIELDS,
+                                                                               'text_to_check': document, 'cache_mode': 'bypass', 'max_chunk_tokens': max_chunk_tokens}))
+    return measure(run, repeat, 1)
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=API_FOLDER, capture_output=True, text=True).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the NER pipeline on the sample data.")
+    parser.add_argument("--stages", default=",".join(ALL_STAGES), help=f"Comma separated stages: {', '.join(ALL_STAGES)}.")
+    parser.add_argument("--scale", type=int, default=4, help="Times AddressSample.csv is repeated for the spans and doc_bin stages.")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per stage (latency percentiles are computed over the runs/requests).")
+    parser.add_argument("--requests", type=int, default=200, help="Texts used by the single request stages.")
+    parser.add_argument("--batch-size", type=int, default=256, help="Texts per batch request.")
+    parser.add_argument("--train-steps", type=int, default=100, help="Training steps of the train stage.")
+    parser.add_argument("--session-id", default=None, help="Existing training session used by the inference stages (skips train).")
+    parser.add_argument("--genai-latency", type=float, default=0.02, help="Seconds the fake chat model waits before answering.")
+    parser.add_argument("--max-chunk-tokens", type=int, default=300, help="Chunk size of the genai_chunked stage.")
+    parser.add_argument("--output", default=None, help="Write the JSON results to this file (printed otherwise).")
+    args = parser.parse_args()
+
+    stages = [stage.strip() for stage in args.stages.split(",") if stage.strip()]
+    unknown = [stage for stage in stages if stage not in ALL_STAGES]
+    if unknown:
+        parser.error(f"Unknown stages: {', '.join(unknown)}.")
+
+    #only the JSON results go to stdout, everything printed by the app and SpaCy goes to stderr
+    results_output = sys.stdout
+    sys.stdout = sys.stderr
+
+    from main import app
+    client = app.test_client()
+    results = {}
+
+    data_frame = load_address_sample(args.scale) if {'spans', 'doc_bin'} & set(stages) else None
+    texts = load_address_sample(1)[TEXT_COLUMN].tolist()
+
+    training_session_id = args.session_id
+    created_session_id = None
+    try:
+        for stage in stages:
+            print(f"Running {stage}...", file=sys.stderr)
+            if stage == 'spans':
+                results[stage] = benchmark_spans(data_frame, args.repeat)
+            elif stage == 'doc_bin':
+                results[stage] = benchmark_doc_bin(data_frame, args.repeat)
+            elif stage == 'train':
+                if args.session_id:
+                    continue
+                created_session_id = training_session_id = f"benchmark-{uuid.uuid4()}"
+                results[stage] = benchmark_train(training_session_id, args.train_steps)
+            elif stage in ('perform_ner', 'perform_ner_batch'):
+                if not training_session_id:
+                    raise SystemExit(f"The {stage} stage needs the train stage or --session-id.")
+                if stage == 'perform_ner':
+                    results[stage] = benchmark_perform_ner(client, training_session_id, texts[:args.requests], 1)
+                else:
+                    results[stage] = benchmark_perform_ner_batch(client, training_session_id, texts, args.batch_size, args.repeat)
+            else:
+                install_fake_chat_model(args.genai_latency)
+                if stage == 'genai':
+                    results[stage] = benchmark_genai(client, texts[:args.requests], 1)
+                elif stage == 'genai_batch':
+                    results[stage] = benchmark_genai_batch(client, texts[:args.requests], args.repeat)
+                else:
+                    results[stage] = benchmark_genai_chunked(client, args.repeat, args.max_chunk_tokens)
+    finally:
+        if created_session_id:
+            shutil.rmtree(os.path.join("model_train_sessions", created_session_id), ignore_errors=True)
+
+    report = {'meta': {'commit': get_commit(),
+                       'date': datetime.now().isoformat(timespec='seconds'),
+                       'python': platform.python_version(),
+                       'platform': platform.platform(),
+                       'cpu_count': os.cpu_count(),
+                       'arguments': vars(args)},
+              'stages': results}
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output, file=results_output)
+
+
+if __name__ == "__main__":
+    main()
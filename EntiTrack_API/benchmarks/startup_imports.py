@@ -0,0 +1,96 @@
+'''
+Startup benchmark: import time of the API (import main) and of every module it imports, measured in fresh interpreters
+with python -X importtime. The heavy dependencies (SpaCy, pandas, google genai, langchain) are imported
+lazily by the endpoints, so they should not show up under main. Their own import time is reported separately.
+
+Usage (from the EntiTrack_API folder):
+    python benchmarks/startup_imports.py [--repeat 3] [--top 25] [--json] [--budget SECONDS]
+With --budget the script exits with an error when importing main takes longer than the budget (use it to catch regressions).
+'''
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+
+API_FOLDER = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+HEAVY_MODULES = ('spacy', 'pandas', 'google.genai', 'pydantic',
+                 'langchain_core.prompts', 'langchain_core.output_parsers', 'langchain_google_genai')
+
+
+def run_import(module_name):
+    '''Imports a module in a fresh interpreter. Returns the wall time (seconds) and the cumulative import time (seconds) per imported module.'''
+    code = f"import time; start = time.perf_counter(); import {module_name}; print(time.perf_counter() - start)"
+    #the startup must not start worker processes nor warm up anything
+    env = dict(os.environ, TRAINING_PREWARM="false", INFERENCE_WORKERS="0", WARMUP_COMPONENTS="")
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", code], cwd=API_FOLDER, env=env,
+                             capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"Importing {module_name} failed:\n{process.stderr[-2000:]}")
+
+    modules = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        modules[name.strip()] = (int(cumulative) / 1e6, depth)
+    return float(process.stdout.strip().splitlines()[-1]), modules
+
+
+def benchmark_main(repeat):
+    '''Median wall time of import main and median cumulative time of the modules imported by it (directly, or from apis).'''
+    wall_times = []
+    module_times = {}
+    for _ in range(repeat):
+        wall_time, modules = run_import("main")
+        wall_times.append(wall_time)
+        for name, (cumulative, depth) in modules.items():
+            if depth <= 1 or name.startswith("apis"):
+                module_times.setdefault(name, []).append(cumulative)
+    return statistics.median(wall_times), {name: statistics.median(times) for name, times in module_times.items()}
+
+
+def benchmark_heavy_modules(repeat):
+    '''Median import time of every heavy dependency on its own.'''
+    return {module_name: statistics.median(run_import(module_name)[0] for _ in range(repeat)) for module_name in HEAVY_MODULES}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import time of the API and its dependencies.")
+    parser.add_argument("--repeat", type=int, default=3, help="Fresh interpreters per measure (the median is reported).")
+    parser.add_argument("--top", type=int, default=25, help="Number of modules reported (slowest first).")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON.")
+    parser.add_argument("--budget", type=float, default=None, help="Fail when importing main takes longer than this (seconds).")
+    args = parser.parse_args()
+
+    main_seconds, module_seconds = benchmark_main(args.repeat)
+    heavy_seconds = benchmark_heavy_modules(args.repeat)
+    heavy_loaded = sorted(name for name in HEAVY_MODULES if name in module_seconds)
+    slowest = sorted(module_seconds.items(), key=lambda item: item[1], reverse=True)[:args.top]
+
+    if args.json:
+        print(json.dumps({'import_main_seconds': round(main_seconds, 4),
+                          'modules_seconds': {name: round(seconds, 4) for name, seconds in slowest},
+                          'heavy_modules_seconds': {name: round(seconds, 4) for name, seconds in heavy_seconds.items()},
+                          'heavy_modules_imported_by_main': heavy_loaded}, indent=2))
+    else:
+        print(f"import main: {main_seconds:.3f}s (median of {args.repeat})\n")
+        print("Slowest modules imported at startup (cumulative):")
+        for name, seconds in slowest:
+            print(f"  {seconds:8.3f}s  {name}")
+        print("\nHeavy dependencies (imported on demand):")
+        for name, seconds in heavy_seconds.items():
+            print(f"  {seconds:8.3f}s  {name}{'  <- imported at startup' if name in heavy_loaded else ''}")
+
+    if args.budget is not None and main_seconds > args.budget:
+        print(f"\nimport main took {main_seconds:.3f}s, over the budget of {args.budget:.3f}s", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
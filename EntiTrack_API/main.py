@@ -6,37 +6,45 @@ Flask-RESTx enables developers to create RESTful APIs with ease, and provide the
 
 import os
 
-from flask import Flask,send_from_directory
+from flask import Flask
 from flask_restx import Api
 
 from flask_cors import cross_origin
 
 #namespaces to be registered
 from apis.ns_genai import namespace_ner_gen_ai
-from apis.ns_train import namespace_ner_train
+from apis.ns_train import namespace_ner_train, start_inference_pool, preload_session_models
+from apis.inference_pool import INFERENCE_WORKERS
+from apis.training_worker import training_worker_pool, TRAINING_PREWARM
+from apis.warmup import start_warm_up
+from apis.static_assets import send_static_asset
+from apis.metrics import instrument_app
+from apis.admission import install_admission_control
 
 ###############################Begin configuration to serve static files for the Blazor WebAssembly app###############################
-BLAZOR_BUILD_DIR = 'UI' # Relative to your Flask static folder
+BLAZOR_BUILD_DIR = 'UI' # Relative to the API folder
 
-#Innit a Flask app with a static folder serving on static URL path '/UI'
+#Innit a Flask app. The UI folder is served on the URL path '/UI' by the routes below (not by the Flask static route),
+#so the precompressed files and the cache headers are handled.
 #The content of UI folder will be populated when the scrip scr_publish_start.sh is run or the script scr_UI_publish.sh is run.
-app = Flask(__name__, static_folder=BLAZOR_BUILD_DIR, static_url_path='/UI')
+app = Flask(__name__, static_folder=None)
 app.config['RESTX_MASK_SWAGGER'] = False
 #app.config['SWAGGER_UI_DOC_EXPANSION'] = 'full'
+BLAZOR_STATIC_FOLDER = os.path.join(app.root_path, BLAZOR_BUILD_DIR)
 
 
 @app.route('/UI/<path:filename>') 
 def serve_blazor_static(filename):
     # This route handles all static files within the Blazor app
-    # It sends files from the 'static/UI' directory
-    return send_from_directory(app.static_folder + '/', filename)
+    # It sends files from the 'UI' directory (the .br/.gz version when the browser accepts it)
+    return send_static_asset(BLAZOR_STATIC_FOLDER, filename)
 
 @app.route('/UI/')
 @app.route('/UI')
 def serve_blazor_index():
     # This route serves the main index.html for the Blazor app
     # When someone navigates to /UI or /UI/, it serves the index.html
-    return send_from_directory(app.static_folder + '/', 'index.html')
+    return send_static_asset(BLAZOR_STATIC_FOLDER, 'index.html')
 
 #this is just to add a quick ling to open the UI from the API documentation
 open_UI_link = ''
@@ -58,15 +66,38 @@ api = Api(app=app,
 api.add_namespace(namespace_ner_gen_ai)
 api.add_namespace(namespace_ner_train)
 
+#the processes started with spawn (corpus preprocessing) import this module as __mp_main__ when the API runs with python main.py,
+#they do not start the worker processes nor the warm up
+if __name__ != "__mp_main__":
+   #fork the inference worker processes before serving any request (and before starting other processes)
+   if INFERENCE_WORKERS:
+      start_inference_pool()
+
+   #the training worker processes are started by the first training, unless they are pre-warmed
+   if TRAINING_PREWARM:
+      training_worker_pool.start()
+
+   #the heavy dependencies are imported by the first request that needs them, unless they are listed in WARMUP_COMPONENTS
+   start_warm_up(load_models=preload_session_models)
+
 ###############################Begin configuration to flask restx###############################
 
 
+#requests count, duration and in flight per endpoint, exposed with the stage timings on /metrics
+instrument_app(app)
+
+#concurrency limits and bounded queues per endpoint class (training, SpaCy inference, GenAI, static UI), statistics on /admission.
+#Installed after the metrics, so the rejected requests are counted too
+install_admission_control(app)
+
+
 #this is is to allow CORS for all routes
 @app.after_request
 def after_request(response):
   header = response.headers
   header['Access-Control-Allow-Origin'] = '*' # Or specify your allowed origin(s)
-  header['Access-Control-Allow-Headers'] = 'Content-Type, Authorization'
+  header['Access-Control-Allow-Headers'] = 'Content-Type, Authorization, X-NER-Cache-Mode'
+  header['Access-Control-Expose-Headers'] = 'X-NER-Cache, X-NER-Chunks, X-Total-Count, Retry-After'
   header['Access-Control-Allow-Methods'] = 'GET, POST, PUT, DELETE, OPTIONS'
   return response
 
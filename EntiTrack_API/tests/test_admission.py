@@ -0,0 +1,39 @@
+'''
+Admission control slots are released when the request finishes, also for the file responses (send_file) that the WSGI
+servers send without closing the response. The responses of the test client are not closed either.
+Run from the EntiTrack_API folder: python -m pytest tests
+'''
+
+import pytest
+
+import main
+from apis.admission import get_endpoint_limiter
+
+
+def test_sequential_static_requests_are_not_rejected(tmp_path, monkeypatch):
+    (tmp_path / "index.html").write_text("<html></html>")
+    monkeypatch.setattr(main, "BLAZOR_STATIC_FOLDER", str(tmp_path))
+    limiter = get_endpoint_limiter("/UI/<path:filename>", "GET")
+    if limiter is None:
+        pytest.skip("The admission control of the static files is disabled.")
+    client = main.app.test_client()
+
+    for _ in range(limiter.max_concurrency + limiter.max_queue + 4):
+        response = client.get("/UI/index.html")
+        assert response.status_code == 200
+
+    assert limiter.stats()['active'] == 0
+
+
+def test_sequential_inference_requests_are_not_rejected():
+    limiter = get_endpoint_limiter("/spacy_train_ner/perform_ner", "POST")
+    if limiter is None:
+        pytest.skip("The admission control of the SpaCy inference is disabled.")
+    client = main.app.test_client()
+
+    #the session does not exist, the request is answered with 400 after taking a slot
+    for _ in range(limiter.max_concurrency + limiter.max_queue + 4):
+        response = client.post("/spacy_train_ner/perform_ner", data={'training_session_id': "missing-session", 'text_to_check': "1 Main St"})
+        assert response.status_code == 400
+
+    assert limiter.stats()['active'] == 0
@@ -286,6 +286,43 @@ class APIManager
         return res;
     }
 
+    /// <summary>
+    /// Gets the status of the training job of a training session (queued, running, succeeded or failed)
+    /// </summary>
+    /// <param name="strTrainingSessionId"></param>
+    /// <returns></returns>
+    public async Task<APIRes> TrainedModel_GetTrainingStatus(string strTrainingSessionId)
+    {
+        APIRes res = new();
+        try
+        {
+            string url = $"{oStateContainer.Base_EntiTrack_Endpoint}/spacy_train_ner/train/status/{strTrainingSessionId}";
+
+            using (HttpClient client = new())
+            {
+                using (HttpRequestMessage request = new())
+                {
+                    request.RequestUri = new Uri(url);
+                    request.Method = HttpMethod.Get;
+                    request.Headers.Add("Accept", "*/*");
+
+                    using (HttpResponseMessage response = await client.SendAsync(request))
+                    {
+                        res.ResponseContent = await response.Content.ReadAsStringAsync();
+                        res.Success_IND = true;
+                        res.IsSuccessStatusCode = response.IsSuccessStatusCode;
+                    }
+                }
+            }
+        }
+        catch (Exception e)
+        {
+            Console.WriteLine($"An unexpected error occurred: {e.Message}");
+            res.ErrorMessage = "Unable to obtain the training status. Error message: " + e.Message;
+        }
+        return res;
+    }
+
     /// <summary>
     /// Performs a single NER given a training session and unstructured text
     /// </summary>
@@ -0,0 +1,27 @@
+using System.Text.Json.Serialization;
+
+public class TrainingJobResponse
+{
+    public const string StatusQueued = "queued";
+    public const string StatusRunning = "running";
+    public const string StatusSucceeded = "succeeded";
+    public const string StatusFailed = "failed";
+
+    [JsonPropertyName("training_session_id")]
+    public Guid TrainingSessionId { get; set; }
+
+    [JsonPropertyName("status")]
+    public string Status { get; set; } = string.Empty;
+
+    [JsonPropertyName("message")]
+    public string? Message { get; set; }
+
+    [JsonPropertyName("queue_position")]
+    public int? QueuePosition { get; set; }
+
+    [JsonPropertyName("latest_step")]
+    public int? LatestStep { get; set; }
+
+    [JsonPropertyName("elapsed_seconds")]
+    public double? ElapsedSeconds { get; set; }
+}